@@ -0,0 +1,309 @@
+# SPDX-License-Identifier: LGPL-2.1-or-later
+"""
+Execution backends for D-Bus method handlers.
+
+dbus-python dispatches every method call on the GLib mainloop and sends
+whatever the handler returns as the reply, so a slow handler holds up
+every other client. defer_methods() replaces selected @dbus.service.method
+handlers of a class with a dispatcher that uses dbus-python's
+async_callbacks: the handler is given to a backend and the reply is sent
+when the backend reports completion.
+
+GLibBackend runs the handler inline on the mainloop, which is what
+dbus-python does without this module. AsyncioBackend runs `async def`
+handlers as coroutines on an asyncio event loop in a helper thread and
+ThreadPoolBackend runs blocking handlers in a bounded pool of worker
+threads. Both deliver the reply back on the GLib mainloop.
+
+The GLib mainloop is expected to run on the main thread. Code that only
+the mainloop may run (attribute values, GObject sources) is reached from
+other threads through call_on_mainloop(), or on_mainloop() in coroutines.
+"""
+
+import asyncio
+import collections
+import concurrent.futures
+import inspect
+import threading
+
+import dbus.service
+
+try:
+    from gi.repository import GObject
+except ImportError:
+    import gobject as GObject
+
+
+class GLibBackend(object):
+    def submit(self, owner, handler, args, reply, error):
+        try:
+            result = handler(*args)
+        except Exception as e:
+            error(e)
+            return
+        complete(reply, result)
+
+
+class AsyncioBackend(object):
+    """
+    Runs coroutine handlers on an asyncio event loop.
+
+    Without an explicit loop a new one is started in a daemon thread.
+    Coroutines run on that thread, not on the GLib mainloop, so they reach
+    mainloop-only state with `await on_mainloop(func, *args)`.
+    """
+    def __init__(self, loop=None):
+        self.loop = loop
+        if loop is None:
+            self.loop = asyncio.new_event_loop()
+            thread = threading.Thread(target=self.loop.run_forever,
+                                      name='asyncio-backend')
+            thread.daemon = True
+            thread.start()
+
+    def submit(self, owner, handler, args, reply, error):
+        try:
+            result = handler(*args)
+        except Exception as e:
+            error(e)
+            return
+        if not inspect.isawaitable(result):
+            complete(reply, result)
+            return
+
+        future = asyncio.run_coroutine_threadsafe(result, self.loop)
+        future.add_done_callback(
+                lambda f: GObject.idle_add(_finish, f, reply, error))
+
+
+class ThreadPoolBackend(object):
+    """
+    Runs blocking handlers in a bounded pool of worker threads.
+
+    An object never has more than its offload_limit handlers (default 1)
+    running at once; further calls wait in a queue of their own. A slow
+    attribute therefore ties up at most offload_limit workers and the
+    others stay free for everything else. The bookkeeping only happens on
+    the GLib mainloop thread, and handlers reach mainloop-only state
+    through call_on_mainloop().
+    """
+    def __init__(self, max_workers=4):
+        self.executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers, thread_name_prefix='offload')
+        self.running = collections.Counter()
+        self.waiting = {}
+
+    def submit(self, owner, handler, args, reply, error):
+        if self.running[owner] >= getattr(owner, 'offload_limit', 1):
+            self.waiting.setdefault(owner, collections.deque()).append(
+                    (handler, args, reply, error))
+            return
+        self._start(owner, handler, args, reply, error)
+
+    def _start(self, owner, handler, args, reply, error):
+        self.running[owner] += 1
+        future = self.executor.submit(handler, *args)
+        future.add_done_callback(
+                lambda f: GObject.idle_add(self._done, owner, f, reply, error))
+
+    def _done(self, owner, future, reply, error):
+        self.running[owner] -= 1
+        if not self.running[owner]:
+            del self.running[owner]
+
+        queue = self.waiting.get(owner)
+        if queue:
+            self._start(owner, *queue.popleft())
+            if not queue:
+                del self.waiting[owner]
+
+        return _finish(future, reply, error)
+
+
+def _finish(future, reply, error):
+    try:
+        result = future.result()
+    except Exception as e:
+        error(e)
+    else:
+        complete(reply, result)
+    return False
+
+
+def complete(reply, result):
+    if result is None:
+        reply()
+    else:
+        reply(result)
+
+
+def in_mainloop():
+    return threading.current_thread() is threading.main_thread()
+
+
+def call_on_mainloop(func, *args):
+    """
+    Call func(*args) on the GLib mainloop and return its result. From any
+    other thread the call is handed over with GObject.idle_add() and the
+    caller blocks until it has run.
+    """
+    if in_mainloop():
+        return func(*args)
+    future = concurrent.futures.Future()
+    GObject.idle_add(_run_into, future, func, args)
+    return future.result()
+
+
+async def on_mainloop(func, *args):
+    """
+    Coroutine version of call_on_mainloop(), which waits without blocking
+    the asyncio event loop.
+    """
+    if in_mainloop():
+        return func(*args)
+    future = concurrent.futures.Future()
+    GObject.idle_add(_run_into, future, func, args)
+    return await asyncio.wrap_future(future)
+
+
+def _run_into(future, func, args):
+    try:
+        future.set_result(func(*args))
+    except Exception as e:
+        future.set_exception(e)
+    return False
+
+
+_backends = {}
+
+
+def get_backend(name):
+    """
+    Return the shared backend called name, creating it on first use.
+    """
+    if name not in _backends:
+        _backends[name] = BACKENDS[name]()
+    return _backends[name]
+
+
+def set_backend(name, backend):
+    """
+    Install backend as the shared backend called name, for example a
+    ThreadPoolBackend with more workers.
+    """
+    _backends[name] = backend
+
+
+def _find_dbus_method(cls, name):
+    for base in cls.__mro__:
+        func = base.__dict__.get(name)
+        if getattr(func, '_dbus_is_method', False):
+            return func
+    return None
+
+
+def _dispatcher(name, arg_names, handler, backend):
+    def method(self, *args, reply_handler, error_handler):
+        get_backend(backend).submit(self, handler, (self,) + args,
+                                    reply_handler, error_handler)
+
+    # dbus-python takes the D-Bus argument names, which Introspect
+    # reports, from the signature of the decorated function.
+    method.__signature__ = inspect.Signature([
+            inspect.Parameter(arg, inspect.Parameter.POSITIONAL_OR_KEYWORD)
+            for arg in ['self'] + list(arg_names) +
+                       ['reply_handler', 'error_handler']])
+    method.__name__ = name
+    return method
+
+
+def defer_methods(cls, names, select_backend):
+    """
+    Give the D-Bus methods in names a deferred reply where cls asks for
+    one.
+
+    select_backend(cls, handler) returns the name of the backend to run
+    handler on, or None to leave the method as an ordinary synchronous
+    one. Handlers inherited from a parent class are considered too, so a
+    subclass can opt in with a class attribute alone. Meant to be called
+    from __init_subclass__; the D-Bus signature is taken from the nearest
+    @dbus.service.method of the same name.
+    """
+    for name in names:
+        handler = getattr(cls, name, None)
+        handler = getattr(handler, '_deferred_handler', handler)
+        if handler is None or getattr(handler, '_dbus_is_method', False):
+            continue
+        # An inherited handler may already be wrapped for metrics. The
+        # deferred method gets wrapped as a whole, so the call would be
+        # counted twice, once of them from a worker thread.
+        handler = unwrap(handler)
+        parent = _find_dbus_method(cls, name)
+        if parent is None:
+            continue
+
+        backend = select_backend(cls, handler)
+        if backend is None and hasattr(parent, '_deferred_handler'):
+            # The inherited metadata expects reply callbacks now.
+            backend = 'glib'
+        if backend is None:
+            continue
+        if (getattr(parent, '_deferred_handler', None) is handler and
+                parent._deferred_backend == backend):
+            continue
+
+        options = getattr(parent, '_dbus_get_args_options', {})
+        method = dbus.service.method(
+                parent._dbus_interface,
+                in_signature=parent._dbus_in_signature,
+                out_signature=parent._dbus_out_signature,
+                async_callbacks=('reply_handler', 'error_handler'),
+                byte_arrays=options.get('byte_arrays', False))(
+                        _dispatcher(name, parent._dbus_args, handler,
+                                    backend))
+        method._deferred_handler = handler
+        method._deferred_backend = backend
+        setattr(cls, name, method)
+
+
+def unwrap(handler):
+    """
+    Return handler without the wrappers metrics.instrument() put around it.
+    """
+    return inspect.unwrap(handler,
+                          stop=lambda f: not hasattr(f, '_metrics_stats'))
+
+
+def call_handler(obj, name, args, reply, error):
+    """
+    Run the handler of D-Bus method name of obj with args the way a method
+    call would, for input that does not come through dbus-python (such as
+    an acquired write socket). Deferred handlers go to their backend and
+    the others run inline; reply or error is called with the outcome. No
+    call is recorded in the metrics.
+    """
+    method = getattr(type(obj), name)
+    handler = unwrap(getattr(method, '_deferred_handler', method))
+    backend = getattr(method, '_deferred_backend', 'glib')
+    get_backend(backend).submit(obj, handler, (obj,) + tuple(args), reply,
+                                error)
+
+
+def select_backend(cls, handler):
+    """
+    select_backend callback for defer_methods(): `async def` handlers go to
+    the asyncio backend, handlers of classes with offload set go to the
+    thread pool and everything else stays synchronous.
+    """
+    if inspect.iscoroutinefunction(handler):
+        return 'asyncio'
+    if getattr(cls, 'offload', False):
+        return 'threads'
+    return None
+
+
+BACKENDS = {
+        'glib': GLibBackend,
+        'asyncio': AsyncioBackend,
+        'threads': ThreadPoolBackend,
+}
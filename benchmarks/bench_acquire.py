@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+# SPDX-License-Identifier: LGPL-2.1-or-later
+"""
+AcquireWrite and AcquireNotify against WriteValue and PropertiesChanged.
+
+The example application is exported on a private bus and driven from a
+second connection in the same process. Before timing anything, the bench
+checks the socket path end to end: data sent on an acquired write socket
+reaches the test characteristic, a notification arrives on an acquired
+notify socket, and hanging up either socket releases it on the server
+side so it can be acquired again.
+
+It then sends --count writes of --size bytes to the test characteristic
+and --count notifications from the Heart Rate Measurement characteristic,
+in batches of --batch, once through D-Bus and once through the acquired
+sockets.
+"""
+
+import argparse
+import socket
+import time
+
+import dbus
+import dbus.bus
+import dbus.mainloop.glib
+
+from gi.repository import GLib
+
+from common import load_script
+
+import harness
+
+gatt = load_script('stock-gatt-server.py')
+
+
+def run_until(condition, timeout=5.0):
+    context = GLib.MainContext.default()
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise RuntimeError('Timed out')
+        if not context.iteration(False):
+            time.sleep(0.0001)
+
+
+def call(method, *args):
+    """
+    Call method asynchronously and run the mainloop, which serves the call
+    as well, until the reply arrives.
+    """
+    result = []
+
+    def replied(*reply):
+        result.append(reply)
+
+    def failed(error):
+        result.append(error)
+
+    method(*args, reply_handler=replied, error_handler=failed)
+    run_until(lambda: result)
+    if isinstance(result[0], Exception):
+        raise result[0]
+    return result[0]
+
+
+def acquire(method, mtu):
+    fd, mtu = call(method, dbus.Dictionary({'mtu': dbus.UInt16(mtu)},
+                                           signature='sv'))
+    sock = socket.socket(fileno=fd.take())
+    sock.setblocking(False)
+    return sock
+
+
+def receive(sock):
+    try:
+        return sock.recv(4096)
+    except BlockingIOError:
+        return None
+
+
+def check_sockets(test, test_proxy, hr, hr_proxy, mtu):
+    sock = acquire(test_proxy.AcquireWrite, mtu)
+    sock.send(b'acquired')
+    run_until(lambda: test.value.read() == b'acquired')
+    sock.close()
+    run_until(lambda: test.write_sock is None)
+    acquire(test_proxy.AcquireWrite, mtu).close()
+    run_until(lambda: test.write_sock is None)
+
+    sock = acquire(hr_proxy.AcquireNotify, mtu)
+    assert hr.notifying, 'AcquireNotify did not start notifications'
+    hr.notify_value(b'\x06\x50')
+    received = []
+    run_until(lambda: received.append(receive(sock)) or received[-1])
+    assert received[-1] == b'\x06\x50', received[-1]
+    sock.close()
+    run_until(lambda: hr.notify_sock is None)
+    assert not hr.notifying, 'hanging up did not stop notifications'
+    acquire(hr_proxy.AcquireNotify, mtu).close()
+    run_until(lambda: hr.notify_sock is None)
+
+
+def writes_per_second(test, send, args):
+    values = [i.to_bytes(4, 'little') * (args.size // 4)
+              for i in range(args.count)]
+    start = time.perf_counter()
+    for first in range(0, args.count, args.batch):
+        batch = values[first:first + args.batch]
+        for value in batch:
+            send(value)
+        run_until(lambda: test.value.read() == batch[-1])
+    return args.count / (time.perf_counter() - start)
+
+
+def dbus_writes(test, proxy, args):
+    options = dbus.Dictionary({'mtu': dbus.UInt16(args.mtu)}, signature='sv')
+
+    def send(value):
+        proxy.WriteValue(dbus.ByteArray(value), options,
+                         reply_handler=lambda: None, error_handler=failed)
+
+    def failed(error):
+        raise error
+
+    return writes_per_second(test, send, args)
+
+
+def socket_writes(test, proxy, args):
+    sock = acquire(proxy.AcquireWrite, args.mtu)
+    try:
+        return writes_per_second(test, sock.send, args)
+    finally:
+        sock.close()
+        run_until(lambda: test.write_sock is None)
+
+
+def notifications_per_second(hr, received, args):
+    value = dbus.ByteArray(bytes(args.size))
+    start = time.perf_counter()
+    for first in range(0, args.count, args.batch):
+        for _ in range(min(args.batch, args.count - first)):
+            hr.emit_notification(value)
+        run_until(lambda: received() >= first + args.batch or
+                  received() >= args.count)
+    return args.count / (time.perf_counter() - start)
+
+
+def dbus_notifications(client, hr, args):
+    count = [0]
+
+    def changed(interface, changed, invalidated):
+        if 'Value' in changed:
+            count[0] += 1
+
+    match = client.add_signal_receiver(
+            changed, 'PropertiesChanged', gatt.DBUS_PROP_IFACE,
+            path=hr.path)
+    try:
+        return notifications_per_second(hr, lambda: count[0], args)
+    finally:
+        match.remove()
+
+
+def socket_notifications(hr, proxy, args):
+    sock = acquire(proxy.AcquireNotify, args.mtu)
+    count = [0]
+
+    def received():
+        while receive(sock) is not None:
+            count[0] += 1
+        return count[0]
+
+    try:
+        return notifications_per_second(hr, received, args)
+    finally:
+        sock.close()
+        run_until(lambda: hr.notify_sock is None)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--count', default=10000, type=int)
+    parser.add_argument('--size', default=20, type=int)
+    parser.add_argument('--batch', default=32, type=int)
+    parser.add_argument('--mtu', default=517, type=int)
+    args = parser.parse_args()
+
+    dbus.mainloop.glib.DBusGMainLoop(set_as_default=True)
+    private_bus = harness.PrivateBus()
+    try:
+        bus = dbus.bus.BusConnection(private_bus.address)
+        client = dbus.bus.BusConnection(private_bus.address)
+        app = gatt.Application(bus)
+        hr = app.services[0].characteristics[0]
+        test = app.services[2].characteristics[0]
+
+        def proxy(chrc):
+            return dbus.Interface(
+                    client.get_object(bus.get_unique_name(), chrc.path,
+                                      introspect=False),
+                    gatt.GATT_CHRC_IFACE)
+
+        hr_proxy = proxy(hr)
+        test_proxy = proxy(test)
+
+        check_sockets(test, test_proxy, hr, hr_proxy, args.mtu)
+
+        print('%-8s %12s %16s' % ('path', 'writes/s', 'notifications/s'))
+        print('%-8s %12.0f %16.0f' % (
+                'D-Bus', dbus_writes(test, test_proxy, args),
+                dbus_notifications(client, hr, args)))
+        print('%-8s %12.0f %16.0f' % (
+                'socket', socket_writes(test, test_proxy, args),
+                socket_notifications(hr, hr_proxy, args)))
+    finally:
+        private_bus.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+# SPDX-License-Identifier: LGPL-2.1-or-later
+"""
+Update-to-air latency of advertisement data.
+
+An advertisement is registered with mock_bluez.py and its ServiceData is
+changed --repeat times, either in place with PropertiesChanged or by
+unregistering and registering it again. Each sample is the time from the
+change to the mock's AdvertisementUpdated signal, which it emits once the
+new data is taken in. While re-registering, the advertisement is off the
+air for the whole sample.
+
+"rotation" times AdvertisementRotation.rotate() of stock-example.py up to
+the AdvertisementUpdated of every advertisement in its pool, and
+"rotation emit" the part rotate() reports, the PropertiesChanged signals
+alone. The mock is started with one instance fewer than the pool, so one
+advertisement is refused; the bench checks that the rotation carries on
+with the others.
+"""
+
+import argparse
+import os
+import time
+
+import dbus
+import dbus.bus
+import dbus.mainloop.glib
+
+from gi.repository import GLib
+
+from common import load_script
+
+import harness
+
+example = load_script('stock-example.py')
+
+ADAPTER_PATH = '/org/bluez/hci0'
+MOCK_IFACE = 'com.github.maldata.MockBluez1'
+
+
+def run(args, mode):
+    private_bus = harness.PrivateBus()
+    try:
+        private_bus.spawn(os.path.join(harness.HERE, 'mock_bluez.py'),
+                          '--instances', str(args.instances))
+        bus = dbus.bus.BusConnection(private_bus.address)
+        harness.wait_for_name(bus, harness.BLUEZ_SERVICE_NAME)
+        manager = dbus.Interface(
+                bus.get_object(harness.BLUEZ_SERVICE_NAME, ADAPTER_PATH,
+                               introspect=False),
+                harness.LE_ADVERTISING_MANAGER_IFACE)
+
+        updates = []
+        errors = []
+        bus.add_signal_receiver(
+                lambda path, props: updates.append(
+                        (time.perf_counter(), props)),
+                'AdvertisementUpdated', MOCK_IFACE,
+                harness.BLUEZ_SERVICE_NAME, ADAPTER_PATH)
+
+        context = GLib.MainContext.default()
+
+        def wait_for_update(count, timeout=10.0):
+            deadline = time.monotonic() + timeout
+            while len(updates) < count:
+                if errors:
+                    raise errors[0]
+                if time.monotonic() > deadline:
+                    raise RuntimeError('advertisement update not seen')
+                context.iteration(True)
+
+        def register():
+            # Without introspection dbus-python cannot guess a{sv} for {}.
+            manager.RegisterAdvertisement(
+                    ad.get_path(), dbus.Dictionary(signature='sv'),
+                    reply_handler=lambda: None, error_handler=errors.append)
+
+        if mode == 'rotation':
+            return run_rotation(args, bus, updates, wait_for_update)
+
+        reregister = mode == 're-register'
+        ad = example.Advertisement(bus, 0, 'broadcast')
+        ad.service_data = {'9999': [0x00, 0x00]}
+        register()
+        wait_for_update(1)
+
+        samples = []
+        for i in range(args.repeat):
+            value = [(i + 1) & 0xff, ((i + 1) >> 8) & 0xff]
+            start = time.perf_counter()
+            if reregister:
+                manager.UnregisterAdvertisement(ad.get_path())
+                ad.service_data = {'9999': value}
+                register()
+            else:
+                ad.service_data = {'9999': value}
+            wait_for_update(i + 2)
+            seen, props = updates[-1]
+            assert list(props['ServiceData']['9999']) == value
+            samples.append(seen - start)
+
+        if reregister:
+            manager.UnregisterAdvertisement(ad.get_path())
+        ad.remove_from_connection()
+        return harness.percentiles(samples), None
+    finally:
+        private_bus.close()
+
+
+def run_rotation(args, bus, updates, wait_for_update):
+    rotation = example.AdvertisementRotation(
+            bus, example.ROTATION_PAYLOADS, args.instances + 1, 0)
+    rotation.register(ADAPTER_PATH)
+    wait_for_update(args.instances)
+    context = GLib.MainContext.default()
+    while not any(r.failed() for r in rotation.registrations):
+        context.iteration(True)
+    assert sum(r.failed() for r in rotation.registrations) == 1
+    assert len(rotation.registrations) == args.instances + 1
+
+    samples = []
+    emits = []
+    for i in range(args.repeat):
+        seen = len(updates)
+        start = time.perf_counter()
+        emits.append(rotation.rotate())
+        wait_for_update(seen + args.instances)
+        samples.append(updates[-1][0] - start)
+
+    for registrations in rotation.registrations:
+        registrations.unregister_all()
+    for ad in rotation.pool:
+        ad.remove_from_connection()
+    return harness.percentiles(samples), harness.percentiles(emits)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeat', default=500, type=int)
+    parser.add_argument('--instances', default=4, type=int,
+                        help="advertising instances of the mock adapter")
+    args = parser.parse_args()
+
+    dbus.mainloop.glib.DBusGMainLoop(set_as_default=True)
+
+    print('%-14s %10s %10s %10s' % ('update', 'p50 (us)', 'p99 (us)',
+                                     'max (us)'))
+    for mode in ('re-register', 'in place', 'rotation'):
+        results = zip((mode, mode + ' emit'), run(args, mode))
+        for name, stats in results:
+            if stats is not None:
+                print('%-14s %10.0f %10.0f %10.0f' % (
+                        name, stats['p50_us'], stats['p99_us'],
+                        stats['max_us']))
+
+
+if __name__ == '__main__':
+    main()
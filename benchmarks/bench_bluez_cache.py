@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+# SPDX-License-Identifier: LGPL-2.1-or-later
+"""
+Adapter lookup with and without bluezcache, against the number of devices.
+
+For each size, mock_bluez.py is started with that many Device1 objects.
+The bench times the old lookup, which calls GetManagedObjects and scans
+the reply, the initial load of an ObjectCache, and a lookup from the
+cache. It then adds and removes --churn devices and checks that the
+cache follows the signals.
+"""
+
+import argparse
+import os
+import time
+
+import dbus
+import dbus.bus
+import dbus.mainloop.glib
+
+from gi.repository import GLib
+
+from common import timeit
+
+import bluezcache
+import harness
+
+ADAPTER_PATH = '/org/bluez/hci0'
+DEVICE_IFACE = 'org.bluez.Device1'
+MOCK_IFACE = 'com.github.maldata.MockBluez1'
+
+
+def scan(bus):
+    om = dbus.Interface(bus.get_object(harness.BLUEZ_SERVICE_NAME, '/'),
+                        harness.DBUS_OM_IFACE)
+    return [o for o, props in om.GetManagedObjects().items()
+            if harness.GATT_MANAGER_IFACE in props]
+
+
+def wait_until(condition, timeout=10.0):
+    context = GLib.MainContext.default()
+    start = time.perf_counter()
+    while not condition():
+        if time.perf_counter() - start > timeout:
+            raise RuntimeError('cache did not catch up')
+        context.iteration(True)
+    return time.perf_counter() - start
+
+
+def run(args, size):
+    private_bus = harness.PrivateBus()
+    try:
+        private_bus.spawn(os.path.join(harness.HERE, 'mock_bluez.py'),
+                          '--devices', str(size))
+        bus = dbus.bus.BusConnection(private_bus.address)
+        harness.wait_for_name(bus, harness.BLUEZ_SERVICE_NAME)
+        mock = dbus.Interface(bus.get_object(harness.BLUEZ_SERVICE_NAME, '/'),
+                              MOCK_IFACE)
+
+        scan_us = timeit(lambda: scan(bus), args.repeat)
+
+        start = time.perf_counter()
+        cache = bluezcache.ObjectCache(bus)
+        cache.load()
+        load_us = (time.perf_counter() - start) * 1e6
+
+        lookup_us = timeit(lambda: cache.paths(harness.GATT_MANAGER_IFACE),
+                           args.repeat)
+        assert cache.paths(harness.GATT_MANAGER_IFACE) == sorted(scan(bus))
+
+        mock.AddDevices(ADAPTER_PATH, args.churn)
+        added = wait_until(lambda: len(cache.paths(
+                DEVICE_IFACE, ADAPTER_PATH)) == size + args.churn)
+        mock.RemoveDevices(ADAPTER_PATH, args.churn)
+        removed = wait_until(lambda: len(cache.paths(
+                DEVICE_IFACE, ADAPTER_PATH)) == size)
+        cache.close()
+        return scan_us, load_us, lookup_us, (added + removed) * 1e6
+    finally:
+        private_bus.close()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', default='0,1000,5000')
+    parser.add_argument('--repeat', default=20, type=int)
+    parser.add_argument('--churn', default=200, type=int)
+    args = parser.parse_args()
+
+    dbus.mainloop.glib.DBusGMainLoop(set_as_default=True)
+
+    print('%8s %14s %14s %14s %14s' % ('devices', 'scan (us)', 'load (us)',
+                                       'lookup (us)', 'churn (us)'))
+    for size in [int(s) for s in args.sizes.split(',')]:
+        print('%8d %14.0f %14.0f %14.3f %14.0f' % ((size,) + run(args, size)))
+
+
+if __name__ == '__main__':
+    main()
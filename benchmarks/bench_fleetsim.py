@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+# SPDX-License-Identifier: LGPL-2.1-or-later
+"""
+Per-device cost of simulating heart rate sensors.
+
+"dbus.Byte" is the original hr_msrmt_cb, kept here for reference: one
+randint and a list of dbus.Byte objects per sample. "hr_msrmt_cb" calls
+the current HeartRateMeasurementChrc.hr_msrmt_cb of one exported
+characteristic per device. "fleet" ticks a fleetsim.WearableFleet whose
+devices feed the same characteristics through StartNotify, as
+stock-gatt-server.py --fleet does. Both of the latter include
+notify_value(); the notifications are sent between ticks, untimed.
+"""
+
+import argparse
+import time
+from random import randint
+
+import dbus
+import dbus.bus
+import dbus.mainloop.glib
+
+from gi.repository import GLib
+
+from common import load_script
+
+import harness
+
+gatt = load_script('stock-gatt-server.py')
+import fleetsim
+
+
+class Device(object):
+    def __init__(self):
+        self.energy_expended = 0
+        self.hr_ee_count = 0
+
+
+def dbus_byte_sample(dev):
+    value = [dbus.Byte(0x06), dbus.Byte(randint(90, 130))]
+    if dev.hr_ee_count % 10 == 0:
+        value[0] = dbus.Byte(value[0] | 0x08)
+        value.append(dbus.Byte(dev.energy_expended & 0xff))
+        value.append(dbus.Byte((dev.energy_expended >> 8) & 0xff))
+    dev.energy_expended = min(0xffff, dev.energy_expended + 1)
+    dev.hr_ee_count += 1
+    return value
+
+
+def drain():
+    context = GLib.MainContext.default()
+    while context.iteration(False):
+        pass
+
+
+def per_device(func, n, ticks):
+    elapsed = 0.0
+    for _ in range(ticks):
+        start = time.perf_counter()
+        func()
+        elapsed += time.perf_counter() - start
+        drain()
+    return elapsed * 1e9 / (n * ticks)
+
+
+def heart_rate_chrcs(bus, first, n, fleet=None):
+    services = [gatt.HeartRateService(bus, first + i, fleet, i)
+                for i in range(n)]
+    return services, [service.characteristics[0] for service in services]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--devices', default='1000,10000')
+    parser.add_argument('--ticks', default=5, type=int)
+    args = parser.parse_args()
+
+    dbus.mainloop.glib.DBusGMainLoop(set_as_default=True)
+    private_bus = harness.PrivateBus()
+    try:
+        bus = dbus.bus.BusConnection(private_bus.address)
+
+        print('%10s %14s %16s %14s' % ('devices', 'dbus.Byte (ns)',
+                                       'hr_msrmt_cb (ns)', 'fleet (ns)'))
+        for n in [int(n) for n in args.devices.split(',')]:
+            devices = [Device() for _ in range(n)]
+            fleet = fleetsim.WearableFleet(n, seed=1)
+            scalar_services, scalar = heart_rate_chrcs(bus, 0, n)
+            fleet_services, fed = heart_rate_chrcs(bus, n, n, fleet)
+            for chrc in fed:
+                chrc.StartNotify()
+            assert len(fleet.subscribers) == n
+
+            def sample_all():
+                for chrc in scalar:
+                    chrc.hr_msrmt_cb()
+
+            print('%10d %14.0f %16.0f %14.0f' % (
+                    n,
+                    per_device(lambda: [dbus_byte_sample(d) for d in devices],
+                               n, args.ticks),
+                    per_device(sample_all, n, args.ticks),
+                    per_device(fleet.tick, n, args.ticks)))
+
+            for chrc in fed:
+                chrc.StopNotify()
+            for service in scalar_services + fleet_services:
+                gatt.unexport(service)
+    finally:
+        private_bus.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+# SPDX-License-Identifier: LGPL-2.1-or-later
+"""
+Introspect cost on a large exported GATT tree.
+
+The tree is exported on a private bus, next to an object exported by
+hand below /. For every object, the cached reply is compared with the
+one dbus-python builds by reflecting over the class and listing the
+registered child paths, and both are timed. The cost of
+adding and removing a characteristic is measured too.
+"""
+
+import argparse
+
+import dbus.bus
+import dbus.mainloop.glib
+import dbus.service
+
+from common import load_script, timeit
+
+import harness
+from bench_managed_objects import UUID, build_app
+
+gatt = load_script('stock-gatt-server.py')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', default='10,100,1000')
+    parser.add_argument('--repeat', default=5, type=int)
+    args = parser.parse_args()
+
+    dbus.mainloop.glib.DBusGMainLoop(set_as_default=True)
+    private_bus = harness.PrivateBus()
+    try:
+        bus = dbus.bus.BusConnection(private_bus.address)
+
+        print('%8s %8s %14s %14s %14s' % ('chrcs', 'objects', 'reflect (us)',
+                                          'cached (us)', 'add+rm (us)'))
+        for size in [int(s) for s in args.sizes.split(',')]:
+            app = build_app(bus, size, 10, 1)
+            by_hand = dbus.service.Object(bus, '/by_hand')
+            objects = list(app._subtree(app))
+            service = app.services[-1]
+
+            def reflect():
+                for obj in objects:
+                    dbus.service.Object.Introspect(obj, obj.get_path(), bus)
+
+            def cached():
+                for obj in objects:
+                    obj.Introspect(obj.get_path(), bus)
+
+            def add_remove():
+                chrc = gatt.Characteristic(bus, 999, UUID, ['read'], service)
+                service.add_characteristic(chrc)
+                service.remove_characteristic(chrc)
+
+            for obj in objects:
+                expected = dbus.service.Object.Introspect(
+                        obj, obj.get_path(), bus)
+                got = obj.Introspect(obj.get_path(), bus)
+                assert sorted(got.splitlines()) == \
+                        sorted(expected.splitlines()), obj.get_path()
+            assert '<node name="by_hand"/>' in app.Introspect('/', bus)
+
+            print('%8d %8d %14.1f %14.1f %14.1f' % (
+                    size, len(objects),
+                    timeit(reflect, args.repeat) / len(objects),
+                    timeit(cached, args.repeat) / len(objects),
+                    timeit(add_remove, args.repeat * 10)))
+            gatt.unexport(app)
+            by_hand.remove_from_connection()
+    finally:
+        private_bus.close()
+
+
+if __name__ == '__main__':
+    main()
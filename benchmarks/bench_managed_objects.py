@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+# SPDX-License-Identifier: LGPL-2.1-or-later
+"""
+GetManagedObjects latency against the size of the exported GATT tree.
+
+Compares the cached tree kept by Application with a full walk of every
+service, characteristic and descriptor (what GetManagedObjects used to do),
+and measures the cost of adding and removing a characteristic. The tree
+is exported on a private bus, and the cached reply is also timed as a
+GetManagedObjects round trip through a proxy on a second connection.
+"""
+
+import argparse
+import time
+
+import dbus.bus
+import dbus.mainloop.glib
+
+from gi.repository import GLib
+
+from common import load_script, timeit
+
+import harness
+
+gatt = load_script('stock-gatt-server.py')
+
+UUID = '12345678-1234-5678-1234-56789abcde00'
+
+
+def full_walk(app):
+    response = {}
+    for service in app.services:
+        response[service.get_path()] = service.get_properties()
+        for chrc in service.get_characteristics():
+            response[chrc.get_path()] = chrc.get_properties()
+            for desc in chrc.get_descriptors():
+                response[desc.get_path()] = desc.get_properties()
+    return response
+
+
+def build_app(bus, n_chrcs, chrcs_per_service, descs_per_chrc):
+    app = gatt.Application(bus, populate=False)
+
+    service = None
+    for i in range(n_chrcs):
+        if i % chrcs_per_service == 0:
+            service = gatt.Service(bus, app.next_index, UUID, True)
+            app.add_service(service)
+        chrc = gatt.Characteristic(bus, len(service.characteristics), UUID,
+                                   ['read', 'write'], service)
+        service.add_characteristic(chrc)
+        for j in range(descs_per_chrc):
+            chrc.add_descriptor(gatt.Descriptor(bus, j, UUID, ['read'], chrc))
+    return app
+
+
+def teardown(app):
+    for service in list(app.services):
+        app.remove_service(service)
+    app.remove_from_connection()
+
+
+def round_trip(proxy, repeat):
+    """
+    Return the mean GetManagedObjects round trip through proxy in
+    microseconds. Calls are made one at a time from the mainloop, which
+    also serves them.
+    """
+    loop = GLib.MainLoop()
+    state = {'left': repeat, 'error': None}
+
+    def call():
+        proxy.GetManagedObjects(reply_handler=replied, error_handler=failed)
+
+    def replied(objects):
+        state['left'] -= 1
+        if state['left']:
+            call()
+        else:
+            loop.quit()
+
+    def failed(error):
+        state['error'] = error
+        loop.quit()
+
+    start = time.perf_counter()
+    call()
+    loop.run()
+    if state['error'] is not None:
+        raise state['error']
+    return (time.perf_counter() - start) * 1e6 / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', default='10,100,1000,5000')
+    parser.add_argument('--repeat', default=200, type=int)
+    args = parser.parse_args()
+
+    dbus.mainloop.glib.DBusGMainLoop(set_as_default=True)
+    private_bus = harness.PrivateBus()
+    try:
+        bus = dbus.bus.BusConnection(private_bus.address)
+        client = dbus.bus.BusConnection(private_bus.address)
+        proxy = dbus.Interface(
+                client.get_object(bus.get_unique_name(), '/',
+                                  introspect=False),
+                gatt.DBUS_OM_IFACE)
+
+        print('%8s %8s %14s %14s %14s %14s' % (
+                'chrcs', 'objects', 'walk (us)', 'cached (us)', 'bus (us)',
+                'add+rm (us)'))
+        for size in [int(s) for s in args.sizes.split(',')]:
+            app = build_app(bus, size, 10, 1)
+            service = app.services[-1]
+            repeat = max(1, args.repeat * 100 // size)
+
+            def add_remove():
+                chrc = gatt.Characteristic(bus, 999, UUID, ['read'], service)
+                service.add_characteristic(chrc)
+                service.remove_characteristic(chrc)
+
+            assert app.GetManagedObjects() == full_walk(app)
+            print('%8d %8d %14.1f %14.3f %14.1f %14.1f' % (
+                    size, len(app.managed_objects),
+                    timeit(lambda: full_walk(app), repeat),
+                    timeit(app.GetManagedObjects, repeat),
+                    round_trip(proxy, repeat),
+                    timeit(add_remove, repeat)))
+            teardown(app)
+    finally:
+        private_bus.close()
+
+
+if __name__ == '__main__':
+    main()
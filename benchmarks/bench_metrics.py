@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+# SPDX-License-Identifier: LGPL-2.1-or-later
+"""
+Per-call overhead of the method metrics.
+
+Calls the ReadValue handler of TestCharacteristic and the GetAll handler
+of a service directly, with and without the metrics wrapper, and times
+writing the Prometheus text file. The objects are exported on a private
+bus, but the handlers are called directly.
+"""
+
+import argparse
+import os
+import tempfile
+
+import dbus.bus
+import dbus.mainloop.glib
+
+from common import load_script, timeit
+
+import harness
+import metrics
+
+gatt = load_script('stock-gatt-server.py')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeat', default=100000, type=int)
+    args = parser.parse_args()
+
+    dbus.mainloop.glib.DBusGMainLoop(set_as_default=True)
+    private_bus = harness.PrivateBus()
+    try:
+        bus = dbus.bus.BusConnection(private_bus.address)
+        app = gatt.Application(bus)
+        service = app.services[-1]
+        chrc = service.get_characteristics()[0]
+
+        calls = [
+                ('ReadValue', type(chrc).ReadValue, (chrc, {})),
+                ('GetAll', type(service).GetAll,
+                 (service, gatt.GATT_SERVICE_IFACE)),
+        ]
+        print('%12s %12s %12s %12s' % ('method', 'raw (us)', 'wrapped (us)',
+                                       'overhead'))
+        for name, wrapper, call_args in calls:
+            raw = timeit(lambda: wrapper.__wrapped__(*call_args),
+                         args.repeat)
+            wrapped = timeit(lambda: wrapper(*call_args), args.repeat)
+            print('%12s %12.3f %12.3f %12.3f' % (name, raw, wrapped,
+                                                 wrapped - raw))
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'metrics.prom')
+            print('Prometheus file with %d methods: %.1f us' % (
+                    len(metrics.registry.methods),
+                    timeit(lambda: metrics.registry.write_prometheus(path),
+                           1000)))
+    finally:
+        private_bus.close()
+
+
+if __name__ == '__main__':
+    main()
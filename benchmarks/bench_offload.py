@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+# SPDX-License-Identifier: LGPL-2.1-or-later
+"""
+Latency of a fast characteristic while another one is slow.
+
+The GATT server gets an extra characteristic whose ReadValue blocks for
+--slow-ms. Clients keep --outstanding reads of it in flight while the
+latency of TestCharacteristic reads is measured, once with the slow
+handler inline on the mainloop and once with it offloaded to the worker
+pool. Afterwards the server's ReadValue call count must match the reads
+made, so an offloaded call is recorded once.
+"""
+
+import argparse
+import os
+import time
+
+import dbus
+import dbus.bus
+import dbus.mainloop.glib
+
+from gi.repository import GLib
+
+import harness
+
+
+def run(args, offload):
+    private_bus = harness.PrivateBus()
+    try:
+        private_bus.spawn(os.path.join(harness.HERE, 'mock_bluez.py'))
+        bus = dbus.bus.BusConnection(private_bus.address)
+        harness.wait_for_name(bus, harness.BLUEZ_SERVICE_NAME)
+
+        server_args = ['--role', 'gatt-server', '--slow-ms', str(args.slow_ms)]
+        if offload:
+            server_args.append('--offload')
+        private_bus.spawn(harness.__file__, *server_args)
+        harness.wait_for_name(bus, harness.GATT_SERVER_NAME)
+        harness.wait_for_registration(bus, harness.GATT_SERVER_NAME)
+
+        def chrc(path):
+            return dbus.Interface(
+                    bus.get_object(harness.GATT_SERVER_NAME, path,
+                                   introspect=False),
+                    harness.GATT_CHRC_IFACE)
+
+        slow = chrc(harness.SLOW_CHRC_PATH)
+        fast = chrc(harness.TEST_CHRC_PATH)
+        stats = dbus.Interface(
+                bus.get_object(harness.GATT_SERVER_NAME, '/',
+                               introspect=False),
+                'com.github.maldata.Stats1')
+        stats.ResetStats()
+        # introspect=False leaves dbus-python unable to guess a{sv} for {}.
+        options = dbus.Dictionary(signature='sv')
+        context = GLib.MainContext.default()
+        inflight = [0]
+        reads = [0]
+
+        def done(*args):
+            inflight[0] -= 1
+
+        samples = []
+        for _ in range(args.repeat):
+            while inflight[0] < args.outstanding:
+                inflight[0] += 1
+                reads[0] += 1
+                slow.ReadValue(options, reply_handler=done,
+                               error_handler=done, timeout=120)
+            start = time.perf_counter()
+            fast.ReadValue(options, timeout=120)
+            samples.append(time.perf_counter() - start)
+            while context.iteration(False):
+                pass
+        while inflight[0]:
+            context.iteration(True)
+
+        calls = stats.GetMethodStats()[
+                harness.GATT_CHRC_IFACE + '.ReadValue']['Calls']
+        assert calls == reads[0] + args.repeat, \
+                'server counted %d reads, %d were made' % (
+                        calls, reads[0] + args.repeat)
+        return harness.percentiles(samples)
+    finally:
+        private_bus.close()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--slow-ms', default=50, type=int)
+    parser.add_argument('--outstanding', default=4, type=int)
+    parser.add_argument('--repeat', default=200, type=int)
+    args = parser.parse_args()
+
+    dbus.mainloop.glib.DBusGMainLoop(set_as_default=True)
+
+    print('%-10s %10s %10s %10s' % ('slow read', 'p50 (us)', 'p99 (us)',
+                                     'max (us)'))
+    for offload in (False, True):
+        stats = run(args, offload)
+        print('%-10s %10.0f %10.0f %10.0f' % (
+                'offloaded' if offload else 'inline', stats['p50_us'],
+                stats['p99_us'], stats['max_us']))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+# SPDX-License-Identifier: LGPL-2.1-or-later
+"""
+Cost of answering GetAll and GetManagedObjects from property snapshots.
+
+Polls every object with GetAll and the application with GetManagedObjects,
+then checks that no snapshot was rebuilt while polling. The same replies
+are also built from scratch with build_properties() (what every call used
+to do) for comparison. The objects are exported on a private bus, but
+the calls are made directly on them.
+"""
+
+import argparse
+
+import dbus.bus
+import dbus.mainloop.glib
+
+from common import load_script, timeit
+
+import harness
+from bench_managed_objects import build_app, teardown
+
+gatt = load_script('stock-gatt-server.py')
+
+
+def objects(app):
+    for service in app.services:
+        yield service, gatt.GATT_SERVICE_IFACE
+        for chrc in service.get_characteristics():
+            yield chrc, gatt.GATT_CHRC_IFACE
+            for desc in chrc.get_descriptors():
+                yield desc, gatt.GATT_DESC_IFACE
+
+
+def versions(app):
+    return sum(obj.properties_version for obj, _ in objects(app))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', default='10,100,1000')
+    parser.add_argument('--repeat', default=200, type=int)
+    args = parser.parse_args()
+
+    dbus.mainloop.glib.DBusGMainLoop(set_as_default=True)
+    private_bus = harness.PrivateBus()
+    try:
+        bus = dbus.bus.BusConnection(private_bus.address)
+
+        print('%8s %8s %14s %14s %14s' % ('chrcs', 'objects', 'rebuild (us)',
+                                          'GetAll (us)', 'managed (us)'))
+        for size in [int(s) for s in args.sizes.split(',')]:
+            app = build_app(bus, size, 10, 1)
+            targets = list(objects(app))
+            repeat = max(1, args.repeat * 100 // size)
+
+            def rebuild():
+                for obj, iface in targets:
+                    obj.build_properties()[iface]
+
+            def get_all():
+                for obj, iface in targets:
+                    obj.GetAll(iface)
+
+            before = versions(app)
+            results = (timeit(rebuild, repeat), timeit(get_all, repeat),
+                       timeit(app.GetManagedObjects, repeat))
+            assert versions(app) == before, 'snapshots rebuilt while polling'
+
+            # A flag change replaces exactly one snapshot.
+            chrc = app.services[0].get_characteristics()[0]
+            chrc.flags = chrc.flags + ['notify']
+            assert versions(app) == before + 1
+            assert 'notify' in app.GetManagedObjects()[chrc.get_path()][
+                    gatt.GATT_CHRC_IFACE]['Flags']
+
+            print('%8d %8d %14.1f %14.1f %14.3f' % (
+                    (size, len(targets)) + results))
+            teardown(app)
+    finally:
+        private_bus.close()
+
+
+if __name__ == '__main__':
+    main()
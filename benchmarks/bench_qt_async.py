@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+# SPDX-License-Identifier: LGPL-2.1-or-later
+"""
+Advertisement registration latency through the Qt interface layer.
+
+--count advertisements from qt-example.py are exported on a private bus
+and registered with mock_bluez.py through BleAdManager. In the
+asynchronous mode, all calls go out at once and complete through
+QDBusPendingCallWatcher. In the sequential mode, each call waits for its
+reply with QDBus.BlockWithGui before the next one is sent. For both
+modes the bench reports the per-call latency, the total time, and the
+longest gap between ticks of a 1 ms QTimer, which shows how long the
+event loop was held up.
+"""
+
+import argparse
+import os
+import time
+
+from PyQt5.QtCore import QCoreApplication, QEventLoop, QTimer
+from PyQt5.QtDBus import QDBus, QDBusConnection, QDBusObjectPath
+
+from common import load_script
+
+import harness
+
+qt = load_script('qt-example.py')
+
+ADAPTER_PATH = '/org/bluez/hci0'
+AD_PATH = '/com/github/maldata/bench/ad'
+
+
+def wait_for_bluez(connection, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while not connection.interface().isServiceRegistered(
+            harness.BLUEZ_SERVICE_NAME).value():
+        if time.monotonic() > deadline:
+            raise RuntimeError('org.bluez did not appear on the bus')
+        time.sleep(0.01)
+
+
+def run(app, args, asynchronous):
+    private_bus = harness.PrivateBus()
+    name = 'bench-%s' % ('async' if asynchronous else 'sequential')
+    try:
+        private_bus.spawn(os.path.join(harness.HERE, 'mock_bluez.py'),
+                          '--instances', str(args.count))
+        connection = QDBusConnection.connectToBus(private_bus.address, name)
+        wait_for_bluez(connection)
+
+        objects = [qt.ExampleObject() for _ in range(args.count)]
+        paths = [AD_PATH + str(i) for i in range(args.count)]
+        for path, obj in zip(paths, objects):
+            connection.registerObject(path, obj)
+        manager = qt.BleAdManager(ADAPTER_PATH, connection=connection,
+                                  timeout=args.timeout_ms)
+
+        ticks = [time.perf_counter(), 0.0]
+
+        def tick():
+            now = time.perf_counter()
+            ticks[1] = max(ticks[1], now - ticks[0])
+            ticks[0] = now
+
+        timer = QTimer()
+        timer.setInterval(1)
+        timer.timeout.connect(tick)
+        timer.start()
+
+        samples = []
+        errors = []
+        start = time.perf_counter()
+        if asynchronous:
+            for path in paths:
+                call = manager.RegisterAdvertisement(path)
+                call.finished.connect(
+                        lambda args, call=call: samples.append(call.latency))
+                call.failed.connect(
+                        lambda name, message: errors.append(message))
+            while len(samples) + len(errors) < len(paths):
+                app.processEvents(QEventLoop.AllEvents |
+                                  QEventLoop.WaitForMoreEvents)
+        else:
+            for path in paths:
+                call_start = time.perf_counter()
+                reply = manager.call(QDBus.BlockWithGui,
+                                     'RegisterAdvertisement',
+                                     QDBusObjectPath(path), {})
+                if reply.type() == reply.ErrorMessage:
+                    errors.append(reply.errorMessage())
+                else:
+                    samples.append(time.perf_counter() - call_start)
+                app.processEvents()
+        total = time.perf_counter() - start
+        timer.stop()
+
+        if errors:
+            raise RuntimeError(errors[0])
+        for path in paths:
+            connection.unregisterObject(path)
+        QDBusConnection.disconnectFromBus(name)
+
+        stats = harness.percentiles(samples)
+        stats['total_ms'] = total * 1000
+        stats['max_gap_ms'] = ticks[1] * 1000
+        return stats
+    finally:
+        private_bus.close()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--count', default=50, type=int)
+    parser.add_argument('--timeout-ms', default=5000, type=int)
+    args = parser.parse_args()
+
+    app = QCoreApplication([])
+
+    print('%-12s %10s %10s %10s %12s' % ('mode', 'p50 (us)', 'p99 (us)',
+                                         'total (ms)', 'max gap (ms)'))
+    for asynchronous in (False, True):
+        stats = run(app, args, asynchronous)
+        print('%-12s %10.0f %10.0f %10.1f %12.1f' % (
+                'async' if asynchronous else 'sequential', stats['p50_us'],
+                stats['p99_us'], stats['total_ms'], stats['max_gap_ms']))
+
+
+if __name__ == '__main__':
+    main()
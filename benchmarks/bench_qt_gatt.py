@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+# SPDX-License-Identifier: LGPL-2.1-or-later
+"""
+qt-gatt-server.py against stock-gatt-server.py.
+
+Each server is started on a private bus next to mock_bluez.py, the
+dbus-python one through harness.py --role gatt-server and the Qt one
+through this script with --role qt-gatt-server, and registers its
+application with the mock. The bench then measures ReadValue latency on
+the test characteristic for 20 and 512 byte values, and the throughput of
+a burst of --notifications PropertiesChanged notifications on the Heart
+Rate Measurement characteristic, both from a dbus-python client.
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import dbus
+import dbus.bus
+import dbus.mainloop.glib
+
+from PyQt5.QtCore import Q_CLASSINFO, QCoreApplication, pyqtSlot
+from PyQt5.QtDBus import (QDBusAbstractAdaptor, QDBusConnection, QDBusMessage,
+                          QDBusObjectPath, QDBusPendingReply)
+
+from common import load_script
+
+import harness
+
+gatt = load_script('qt-gatt-server.py')
+
+GATT_CHRC_IFACE = 'org.bluez.GattCharacteristic1'
+
+SERVERS = {
+        'dbus-python': [os.path.join(harness.HERE, 'harness.py'),
+                        '--role', 'gatt-server'],
+        'qt': [os.path.abspath(__file__), '--role', 'qt-gatt-server'],
+}
+
+
+class BenchControlAdaptor(QDBusAbstractAdaptor):
+    Q_CLASSINFO('D-Bus Interface', harness.BENCH_IFACE)
+
+    @pyqtSlot(QDBusMessage, result=float)
+    def RegistrationTime(self, message):
+        control = self.parent()
+        elapsed = gatt.dispatch(control, message, control.registration_time)
+        return -1.0 if elapsed is None else elapsed
+
+    @pyqtSlot(QDBusObjectPath, 'uint', 'uint', QDBusMessage)
+    def NotifyBurst(self, path, count, size, message):
+        control = self.parent()
+        gatt.dispatch(control, message, control.notify_burst, path.path(),
+                      count, size)
+
+
+class BenchControl(gatt.ExportedObject):
+    """
+    The Qt side of harness.BenchControl.
+    """
+    adaptor_class = BenchControlAdaptor
+
+    def __init__(self, connection, app):
+        self.app = app
+        self.elapsed = None
+        self.error = None
+        super().__init__(connection, harness.BENCH_PATH)
+
+    def registered(self, watcher, start):
+        reply = QDBusPendingReply(watcher)
+        if reply.isError():
+            self.error = reply.error().message()
+        else:
+            self.elapsed = time.perf_counter() - start
+
+    def registration_time(self):
+        if self.error is not None:
+            raise gatt.FailedException(self.error)
+        return -1.0 if self.elapsed is None else self.elapsed
+
+    def notify_burst(self, path, count, size):
+        chrcs = [chrc for service in self.app.services
+                 for chrc in service.characteristics if chrc.path == path]
+        if not chrcs:
+            raise gatt.FailedException('No such characteristic: ' + path)
+        value = bytes(size)
+        for _ in range(count):
+            chrcs[0].emit_notification(value)
+
+
+def serve_qt_gatt(args):
+    qapp = QCoreApplication(sys.argv)
+    connection = QDBusConnection.systemBus()
+    connection.registerService(harness.GATT_SERVER_NAME)
+
+    gatt.register_types()
+    app = gatt.Application(connection)
+    control = BenchControl(connection, app)
+    manager = gatt.GattManager('/org/bluez/hci0', connection)
+
+    start = time.perf_counter()
+    manager.RegisterApplication(app).finished.connect(
+            lambda watcher: control.registered(watcher, start))
+    qapp.exec_()
+
+
+def run(args, server):
+    private_bus = harness.PrivateBus()
+    try:
+        private_bus.spawn(os.path.join(harness.HERE, 'mock_bluez.py'))
+        bus = dbus.bus.BusConnection(private_bus.address)
+        harness.wait_for_name(bus, harness.BLUEZ_SERVICE_NAME)
+        private_bus.spawn(*SERVERS[server])
+        harness.wait_for_name(bus, harness.GATT_SERVER_NAME)
+
+        results = {
+                'register_ms': harness.wait_for_registration(
+                        bus, harness.GATT_SERVER_NAME) * 1e3,
+        }
+
+        chrc = dbus.Interface(bus.get_object(harness.GATT_SERVER_NAME,
+                                             harness.TEST_CHRC_PATH,
+                                             introspect=False),
+                              GATT_CHRC_IFACE)
+        options = dbus.Dictionary({'mtu': dbus.UInt16(args.mtu)},
+                                  signature='sv')
+        for size in (20, 512):
+            chrc.WriteValue(dbus.ByteArray(bytes(size)), options)
+            results['read_%d' % size] = harness.measure(
+                    lambda: chrc.ReadValue(options), args.repeat)
+
+        results['notify'] = harness.notify_throughput(
+                bus, args.notifications, args.notify_size)
+        return results
+    finally:
+        private_bus.close()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--role', choices=['qt-gatt-server'],
+                        help=argparse.SUPPRESS)
+    parser.add_argument('--repeat', default=1000, type=int)
+    parser.add_argument('--mtu', default=517, type=int)
+    parser.add_argument('--notifications', default=10000, type=int)
+    parser.add_argument('--notify-size', default=20, type=int)
+    args = parser.parse_args()
+
+    if args.role == 'qt-gatt-server':
+        return serve_qt_gatt(args)
+
+    dbus.mainloop.glib.DBusGMainLoop(set_as_default=True)
+
+    print('%-12s %10s %10s %10s %10s %10s %12s' % (
+            'server', 'reg (ms)', 'r20 p50', 'r20 p99', 'r512 p50',
+            'r512 p99', 'notify/s'))
+    for server in ('dbus-python', 'qt'):
+        results = run(args, server)
+        print('%-12s %10.1f %10.0f %10.0f %10.0f %10.0f %12.0f' % (
+                server, results['register_ms'],
+                results['read_20']['p50_us'], results['read_20']['p99_us'],
+                results['read_512']['p50_us'],
+                results['read_512']['p99_us'],
+                results['notify']['per_second']))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+# SPDX-License-Identifier: LGPL-2.1-or-later
+"""
+Scanner throughput and memory bounds under an advertisement flood.
+
+mock_bluez.py is started with --devices devices and asked to send --count
+advertisement signals as fast as it can, --duplicates of them with only a
+new RSSI. A Scanner takes them in while the bench pulls batches of at most
+--batch results on every mainloop iteration. The bench reports how many
+advertisements per second the Scanner took in, what it did with them and
+the largest queue and ring buffer sizes seen.
+"""
+
+import argparse
+import os
+import time
+
+import dbus
+import dbus.bus
+import dbus.mainloop.glib
+
+from gi.repository import GLib
+
+import harness
+import scanner
+
+ADAPTER_PATH = '/org/bluez/hci0'
+MOCK_IFACE = 'com.github.maldata.MockBluez1'
+
+
+def run(args, devices):
+    private_bus = harness.PrivateBus()
+    try:
+        private_bus.spawn(os.path.join(harness.HERE, 'mock_bluez.py'),
+                          '--devices', str(devices))
+        bus = dbus.bus.BusConnection(private_bus.address)
+        harness.wait_for_name(bus, harness.BLUEZ_SERVICE_NAME)
+        mock = dbus.Interface(bus.get_object(harness.BLUEZ_SERVICE_NAME, '/'),
+                              MOCK_IFACE)
+
+        scan = scanner.Scanner(bus, history=args.history,
+                               max_devices=args.max_devices)
+        scan.start()
+
+        errors = []
+        mock.EmitAdvertisements(ADAPTER_PATH, args.count, args.duplicates,
+                                reply_handler=lambda: None,
+                                error_handler=errors.append, timeout=600)
+
+        context = GLib.MainContext.default()
+        pulled = 0
+        max_queue = 0
+        first = None
+        deadline = time.monotonic() + 600
+        while scan.stats['advertisements'] < args.count:
+            if errors:
+                raise errors[0]
+            if time.monotonic() > deadline:
+                raise RuntimeError('advertisements went missing')
+            context.iteration(True)
+            if first is None and scan.stats['advertisements']:
+                first = time.perf_counter()
+            max_queue = max(max_queue, len(scan.queue))
+            pulled += len(scan.pull(args.batch))
+        elapsed = time.perf_counter() - first
+        pulled += len(scan.pull(len(scan.queue)))
+
+        max_ring = max(len(t.rssi) for t in scan.devices.values())
+        scan.stop()
+        return {
+                'rate': args.count / elapsed,
+                'pulled': pulled,
+                'duplicates': scan.stats['duplicates'],
+                'coalesced': scan.stats['coalesced'],
+                'tracked': len(scan.devices),
+                'max_queue': max_queue,
+                'max_ring': max_ring,
+        }
+    finally:
+        private_bus.close()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--devices', default='100,1000,5000')
+    parser.add_argument('--count', default=50000, type=int)
+    parser.add_argument('--duplicates', default=0.8, type=float)
+    parser.add_argument('--batch', default=256, type=int)
+    parser.add_argument('--history', default=32, type=int)
+    parser.add_argument('--max-devices', default=4096, type=int)
+    args = parser.parse_args()
+
+    dbus.mainloop.glib.DBusGMainLoop(set_as_default=True)
+
+    columns = ('rate', 'pulled', 'duplicates', 'coalesced', 'tracked',
+               'max_queue', 'max_ring')
+    print('%8s' % 'devices' + ''.join('%12s' % c for c in columns))
+    for devices in [int(d) for d in args.devices.split(',')]:
+        result = run(args, devices)
+        print('%8d' % devices + ''.join('%12d' % result[c] for c in columns))
+
+
+if __name__ == '__main__':
+    main()
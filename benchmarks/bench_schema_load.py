@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+# SPDX-License-Identifier: LGPL-2.1-or-later
+"""
+Startup time of GATT trees built by the schema loader.
+
+Generates schemas with 10, 100 and 1,000 characteristics (one descriptor
+each), builds them with build_from_schema() and reports the time to
+construct the tree and fill the GetManagedObjects cache. The objects are
+exported on a private bus. Read handlers are the default SCHEMA_HANDLERS.
+Each tree is then extended once more after a service was removed, which
+must not reuse the removed service's path.
+"""
+
+import argparse
+import time
+
+import dbus.bus
+import dbus.mainloop.glib
+
+from common import load_script
+
+import harness
+
+gatt = load_script('stock-gatt-server.py')
+
+UUID = '12345678-1234-5678-1234-56789abc%04x'
+
+
+def make_schema(n_chrcs, chrcs_per_service):
+    services = []
+    for i in range(0, n_chrcs, chrcs_per_service):
+        chrcs = []
+        for j in range(i, min(n_chrcs, i + chrcs_per_service)):
+            chrcs.append({
+                    'uuid': UUID % j,
+                    'flags': ['read', 'write', 'notify'],
+                    'value': 'characteristic %d' % j,
+                    'read': 'counter' if j % 2 else None,
+                    'descriptors': [
+                            {'uuid': '2901', 'value': 'description'}
+                    ],
+            })
+        services.append({'uuid': UUID % i, 'characteristics': chrcs})
+    return {'services': services}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', default='10,100,1000')
+    args = parser.parse_args()
+
+    dbus.mainloop.glib.DBusGMainLoop(set_as_default=True)
+    private_bus = harness.PrivateBus()
+    try:
+        bus = dbus.bus.BusConnection(private_bus.address)
+
+        print('%8s %10s %12s %14s' % ('chrcs', 'objects', 'build (ms)',
+                                      'per chrc (us)'))
+        for size in [int(s) for s in args.sizes.split(',')]:
+            schema = make_schema(size, 20)
+            app = gatt.Application(bus, populate=False)
+
+            start = time.perf_counter()
+            gatt.build_from_schema(app, schema)
+            elapsed = time.perf_counter() - start
+
+            print('%8d %10d %12.2f %14.1f' % (size, len(app.managed_objects),
+                                              elapsed * 1e3,
+                                              elapsed * 1e6 / size))
+
+            app.remove_service(app.services[0])
+            gatt.build_from_schema(app, make_schema(1, 1))
+            assert len(set(s.path for s in app.services)) == \
+                    len(app.services)
+
+            for service in list(app.services):
+                app.remove_service(service)
+            app.remove_from_connection()
+    finally:
+        private_bus.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+# SPDX-License-Identifier: LGPL-2.1-or-later
+"""
+CPU time and wakeups for many periodic attributes.
+
+Registers --timers periodic callbacks with intervals spread between 1 s and
+5 s (like HeartRateMeasurementChrc and BatteryLevelCharacteristic) and runs
+the GLib mainloop for --duration seconds, once with one GObject.timeout_add
+source per callback and once with the shared TimerWheel.
+
+"wakeups" counts mainloop iterations, each one a return from poll(), in
+both modes. "dispatches" counts timer sources dispatched: one per
+callback with GObject.timeout_add, one per wheel tick with TimerWheel.
+"""
+
+import argparse
+import random
+import time
+
+from gi.repository import GLib, GObject
+
+from common import load_script  # noqa: F401 (puts the repo on sys.path)
+import timerwheel
+
+
+class IterationCounter(GLib.Source):
+    """
+    Counts mainloop iterations: prepare() is called once before every
+    poll.
+    """
+    def __init__(self):
+        super().__init__()
+        self.iterations = 0
+
+    def prepare(self):
+        self.iterations += 1
+        return False, -1
+
+    def check(self):
+        return False
+
+    def dispatch(self, callback, args):
+        return True
+
+
+def run(mode, n_timers, duration, tick_ms):
+    rng = random.Random(1)
+    calls = [0]
+    dispatches = [0]
+
+    def callback():
+        calls[0] += 1
+        return True
+
+    def glib_callback():
+        dispatches[0] += 1
+        calls[0] += 1
+        return True
+
+    wheel = timerwheel.TimerWheel(tick_ms=tick_ms)
+    sources = []
+    for _ in range(n_timers):
+        interval = rng.randint(1000, 5000)
+        if mode == 'glib':
+            sources.append(GObject.timeout_add(interval, glib_callback))
+        else:
+            wheel.add(interval, callback)
+
+    loop = GLib.MainLoop()
+    GLib.timeout_add(int(duration * 1000), loop.quit)
+    counter = IterationCounter()
+    counter.attach(None)
+    cpu = time.process_time()
+    loop.run()
+    cpu = time.process_time() - cpu
+    counter.destroy()
+
+    for source in sources:
+        GObject.source_remove(source)
+    if mode == 'wheel':
+        dispatches[0] = wheel.wakeups
+    return cpu, counter.iterations, dispatches[0], calls[0]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--timers', default=10000, type=int)
+    parser.add_argument('--duration', default=20.0, type=float)
+    parser.add_argument('--tick-ms', default=100, type=int)
+    args = parser.parse_args()
+
+    print('%-6s %10s %12s %12s %12s' % ('', 'cpu (s)', 'wakeups',
+                                        'dispatches', 'callbacks'))
+    for mode in ('glib', 'wheel'):
+        cpu, wakeups, dispatches, calls = run(mode, args.timers,
+                                              args.duration, args.tick_ms)
+        print('%-6s %10.3f %12d %12d %12d' % (mode, cpu, wakeups,
+                                              dispatches, calls))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+# SPDX-License-Identifier: LGPL-2.1-or-later
+"""
+Write/read/marshal cost of a 512-byte attribute value.
+
+"list" is the old representation: WriteValue receives a dbus.Array of
+dbus.Byte, the handler stores it and ReadValue returns it as is.
+"buffer" is ValueBuffer: WriteValue receives a dbus.ByteArray
+(byte_arrays=True) and ReadValue returns bytes.
+Both replies are appended to a D-Bus message so marshalling is included.
+
+Before timing, the bench checks write_value() on a test characteristic
+exported on a private bus: a short write is applied before it returns,
+with or without an mtu option, and a long write delivered in MTU 23
+chunks the way bluetoothd does, with the mainloop running between them,
+reaches value_written() once, whole.
+"""
+
+import argparse
+import os
+import time
+
+import dbus.bus
+import dbus.mainloop.glib
+
+from gi.repository import GLib
+
+from common import load_script, timeit
+
+import harness
+
+gatt = load_script('stock-gatt-server.py')
+
+
+def marshal(value):
+    msg = dbus.lowlevel.SignalMessage('/bench', 'org.example.Bench', 'Value')
+    msg.append(value, signature='ay')
+
+
+def check_writes(bus):
+    service = gatt.TestService(bus, 0)
+    chrc = service.characteristics[0]
+    written = []
+    chrc.value_written = lambda: written.append(chrc.value.read())
+    context = GLib.MainContext.default()
+
+    for options in ({}, {'mtu': 23}):
+        chrc.write_value(b'\x01\x02', options)
+        assert written == [b'\x01\x02'], written
+        written.clear()
+
+    value = os.urandom(60)
+    chunk = 23 - 5
+    for offset in range(0, len(value), chunk):
+        chrc.write_value(value[offset:offset + chunk],
+                         {'offset': offset, 'mtu': 23, 'type': 'reliable'})
+        while context.iteration(False):
+            pass
+    assert written == [], 'long write committed before it ended'
+    deadline = time.monotonic() + chrc.long_write_timeout / 1000.0 + 1
+    while not written and time.monotonic() < deadline:
+        context.iteration(True)
+    assert written == [value], [len(w) for w in written]
+
+    gatt.unexport(service)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--size', default=512, type=int)
+    parser.add_argument('--repeat', default=20000, type=int)
+    args = parser.parse_args()
+
+    dbus.mainloop.glib.DBusGMainLoop(set_as_default=True)
+    private_bus = harness.PrivateBus()
+    try:
+        check_writes(dbus.bus.BusConnection(private_bus.address))
+    finally:
+        private_bus.close()
+
+    data = os.urandom(args.size)
+    incoming_list = dbus.Array([dbus.Byte(b) for b in data], signature='y')
+    incoming_bytes = dbus.ByteArray(data)
+
+    class ListAttr(object):
+        value = []
+
+    list_attr = ListAttr()
+    buf = gatt.ValueBuffer(max_length=args.size)
+
+    def list_write():
+        list_attr.value = incoming_list
+
+    def list_read():
+        marshal(list_attr.value)
+
+    def buffer_write():
+        buf.write(incoming_bytes)
+
+    def buffer_read():
+        marshal(buf.read())
+
+    print('%-8s %12s %12s' % ('', 'write (us)', 'read (us)'))
+    print('%-8s %12.2f %12.2f' % ('list', timeit(list_write, args.repeat),
+                                  timeit(list_read, args.repeat)))
+    print('%-8s %12.2f %12.2f' % ('buffer', timeit(buffer_write, args.repeat),
+                                  timeit(buffer_read, args.repeat)))
+    # Building the boxed list is what dbus-python does for every WriteValue
+    # without byte_arrays=True.
+    print('unmarshal to list of dbus.Byte: %.2f us' % timeit(
+            lambda: dbus.Array([dbus.Byte(b) for b in data], signature='y'),
+            args.repeat // 10))
+
+
+if __name__ == '__main__':
+    main()
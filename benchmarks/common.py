@@ -0,0 +1,38 @@
+# SPDX-License-Identifier: LGPL-2.1-or-later
+"""
+Helpers shared by the benchmark scripts.
+
+The example programs live in hyphenated files at the top of the repository,
+so they cannot be imported with a plain import statement. load_script()
+loads one of them as a module so its classes can be exercised directly.
+"""
+
+import importlib.util
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+
+def load_script(filename):
+    name = os.path.splitext(filename)[0].replace('-', '_')
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.spec_from_file_location(
+            name, os.path.join(ROOT, filename))
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def timeit(func, repeat):
+    """Return the per-call time of func in microseconds."""
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - start) * 1e6 / repeat
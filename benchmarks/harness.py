@@ -0,0 +1,467 @@
+#!/usr/bin/env python3
+# SPDX-License-Identifier: LGPL-2.1-or-later
+"""
+Reproducible benchmarks for stock-gatt-server.py and stock-example.py.
+
+A private dbus-daemon is started and mock_bluez.py claims org.bluez on
+it. The GATT Application and the TestAdvertisement then run in their own
+processes (this script with --role) and register with the mock, and the
+harness measures them from the outside:
+
+  - registration time of the application and the advertisement
+  - GetManagedObjects and advertisement GetAll latency
+  - ReadValue/WriteValue latency percentiles
+  - PropertiesChanged notification throughput
+
+Results are printed and, with --output, written as JSON. --compare prints
+the change against an earlier JSON file.
+"""
+
+import argparse
+import inspect
+import json
+import os
+import platform
+import signal
+import subprocess
+import sys
+import time
+
+import dbus
+import dbus.mainloop.glib
+import dbus.service
+
+from gi.repository import GLib
+
+from common import ROOT, load_script
+
+import backends
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+BLUEZ_SERVICE_NAME = 'org.bluez'
+GATT_MANAGER_IFACE = 'org.bluez.GattManager1'
+LE_ADVERTISING_MANAGER_IFACE = 'org.bluez.LEAdvertisingManager1'
+GATT_CHRC_IFACE = 'org.bluez.GattCharacteristic1'
+DBUS_OM_IFACE = 'org.freedesktop.DBus.ObjectManager'
+DBUS_PROP_IFACE = 'org.freedesktop.DBus.Properties'
+INTROSPECTABLE_IFACE = 'org.freedesktop.DBus.Introspectable'
+
+BENCH_IFACE = 'com.github.maldata.Bench1'
+BENCH_PATH = '/com/github/maldata/bench'
+GATT_SERVER_NAME = 'com.github.maldata.testservice1'
+ADVERTISER_NAME = 'com.github.maldata.bench.advertiser'
+
+HR_MSRMT_PATH = '/org/bluez/example/service0/char0'
+BATTERY_LVL_PATH = '/org/bluez/example/service1/char0'
+TEST_CHRC_PATH = '/org/bluez/example/service2/char0'
+SLOW_CHRC_PATH = '/org/bluez/example/service3/char0'
+ADVERTISEMENT_PATH = '/org/bluez/example/advertisement0'
+
+
+class BenchControl(dbus.service.Object):
+    """
+    Control object exported next to the code under test, so the harness can
+    ask for in-process timings and trigger notification bursts.
+    """
+    def __init__(self, bus, app=None):
+        self.app = app
+        self.registration_time = None
+        self.registration_error = None
+        dbus.service.Object.__init__(self, bus, BENCH_PATH)
+
+    def registered(self, elapsed):
+        self.registration_time = elapsed
+
+    def failed(self, error):
+        self.registration_error = str(error)
+
+    def find_chrc(self, path):
+        for service in self.app.services:
+            for chrc in service.characteristics:
+                if chrc.path == path:
+                    return chrc
+        raise dbus.exceptions.DBusException('No such characteristic: ' + path)
+
+    @dbus.service.method(BENCH_IFACE, out_signature='d')
+    def RegistrationTime(self):
+        if self.registration_error is not None:
+            raise dbus.exceptions.DBusException(self.registration_error)
+        if self.registration_time is None:
+            return -1.0
+        return self.registration_time
+
+    @dbus.service.method(BENCH_IFACE, in_signature='ouu')
+    def NotifyBurst(self, path, count, size):
+        chrc = self.find_chrc(path)
+        value = dbus.ByteArray(bytes(size))
+        for _ in range(count):
+            chrc.emit_notification(value)
+
+
+def coroutine_handler(func):
+    """
+    Return a coroutine version of handler func with the same signature.
+    The example handlers use mainloop-only state, so it runs them on the
+    mainloop and awaits the result.
+    """
+    func = backends.unwrap(func)
+
+    async def handler(self, *args):
+        return await backends.on_mainloop(func, self, *args)
+    handler.__name__ = func.__name__
+    handler.__qualname__ = func.__qualname__
+    handler.__signature__ = inspect.signature(func)
+    return handler
+
+
+def use_coroutine_handlers(module, methods):
+    """
+    Replace example classes with subclasses whose D-Bus handlers are
+    coroutines, so the same measurements run on the asyncio backend.
+    methods maps class names to the handlers to convert.
+    """
+    for class_name, names in methods.items():
+        base = getattr(module, class_name)
+        namespace = dict((name, coroutine_handler(getattr(base, name)))
+                         for name in names)
+        setattr(module, class_name, type(base)(class_name, (base,),
+                                               namespace))
+
+
+def add_slow_service(gatt, app, delay, use_offload):
+    """
+    Add a service whose only characteristic blocks for delay seconds on
+    every read, like one that polls a sensor or queries a database.
+    """
+    class SlowCharacteristic(gatt.Characteristic):
+        offload_limit = 2
+
+        def ReadValue(self, options):
+            time.sleep(delay)
+            return b'\x00'
+
+    if use_offload:
+        # Opting in from a subclass, over an already instrumented handler.
+        class SlowCharacteristic(SlowCharacteristic):
+            offload = True
+
+    service = gatt.Service(app.bus, app.next_index,
+                           '12345678-1234-5678-1234-56789abcdeff', True)
+    service.add_characteristic(SlowCharacteristic(
+            app.bus, 0, '12345678-1234-5678-1234-56789abcdefe', ['read'],
+            service))
+    app.add_service(service)
+
+
+def serve_gatt(args):
+    gatt = load_script('stock-gatt-server.py')
+    if args.backend == 'asyncio':
+        use_coroutine_handlers(gatt, {
+                'TestCharacteristic': ['ReadValue', 'WriteValue'],
+                'BatteryLevelCharacteristic': ['ReadValue'],
+        })
+    dbus.mainloop.glib.DBusGMainLoop(set_as_default=True)
+    bus = dbus.SystemBus()
+    name = dbus.service.BusName(GATT_SERVER_NAME, bus)
+
+    app = gatt.Application(bus)
+    if args.slow_ms:
+        add_slow_service(gatt, app, args.slow_ms / 1000.0, args.offload)
+    control = BenchControl(bus, app)
+    manager = dbus.Interface(
+            bus.get_object(BLUEZ_SERVICE_NAME, gatt.find_adapter(bus)),
+            GATT_MANAGER_IFACE)
+
+    start = time.perf_counter()
+    manager.RegisterApplication(
+            app.get_path(), {},
+            reply_handler=lambda: control.registered(
+                    time.perf_counter() - start),
+            error_handler=control.failed)
+    GLib.MainLoop().run()
+
+
+def serve_advertisement(args):
+    example = load_script('stock-example.py')
+    if args.backend == 'asyncio':
+        use_coroutine_handlers(example, {'TestAdvertisement': ['GetAll']})
+    dbus.mainloop.glib.DBusGMainLoop(set_as_default=True)
+    bus = dbus.SystemBus()
+    name = dbus.service.BusName(ADVERTISER_NAME, bus)
+
+    advertisement = example.TestAdvertisement(bus, 0)
+    control = BenchControl(bus)
+    manager = dbus.Interface(
+            bus.get_object(BLUEZ_SERVICE_NAME, example.find_adapter(bus)),
+            LE_ADVERTISING_MANAGER_IFACE)
+
+    start = time.perf_counter()
+    manager.RegisterAdvertisement(
+            advertisement.get_path(), {},
+            reply_handler=lambda: control.registered(
+                    time.perf_counter() - start),
+            error_handler=control.failed)
+    GLib.MainLoop().run()
+
+
+class PrivateBus(object):
+    """
+    A dbus-daemon of our own, used as both the system and the session bus
+    of every child process.
+    """
+    def __init__(self):
+        self.procs = []
+        self.daemon = subprocess.Popen(
+                ['dbus-daemon', '--session', '--nofork', '--print-address'],
+                stdout=subprocess.PIPE, universal_newlines=True)
+        self.address = self.daemon.stdout.readline().strip()
+        self.env = dict(os.environ,
+                        DBUS_SYSTEM_BUS_ADDRESS=self.address,
+                        DBUS_SESSION_BUS_ADDRESS=self.address,
+                        PYTHONPATH=os.pathsep.join(
+                                [ROOT, HERE, os.environ.get('PYTHONPATH', '')]))
+        os.environ['DBUS_SYSTEM_BUS_ADDRESS'] = self.address
+        os.environ['DBUS_SESSION_BUS_ADDRESS'] = self.address
+
+    def spawn(self, *args):
+        proc = subprocess.Popen([sys.executable] + list(args), env=self.env)
+        self.procs.append(proc)
+        return proc
+
+    def close(self):
+        for proc in reversed(self.procs + [self.daemon]):
+            proc.send_signal(signal.SIGTERM)
+            try:
+                proc.wait(5)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+
+
+def wait_for_name(bus, name, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while not bus.name_has_owner(name):
+        if time.monotonic() > deadline:
+            raise RuntimeError(name + ' did not appear on the bus')
+        time.sleep(0.01)
+
+
+def wait_for_registration(bus, name, timeout=10.0):
+    control = dbus.Interface(bus.get_object(name, BENCH_PATH), BENCH_IFACE)
+    deadline = time.monotonic() + timeout
+    while True:
+        elapsed = float(control.RegistrationTime())
+        if elapsed >= 0:
+            return elapsed
+        if time.monotonic() > deadline:
+            raise RuntimeError(name + ' did not register')
+        time.sleep(0.01)
+
+
+def percentiles(samples):
+    samples = sorted(samples)
+    n = len(samples)
+
+    def pick(q):
+        return samples[min(n - 1, int(q * n))] * 1e6
+
+    return {
+            'count': n,
+            'mean_us': sum(samples) * 1e6 / n,
+            'p50_us': pick(0.50),
+            'p90_us': pick(0.90),
+            'p99_us': pick(0.99),
+            'max_us': samples[-1] * 1e6,
+    }
+
+
+def measure(func, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - start)
+    return percentiles(samples)
+
+
+def notify_throughput(bus, count, size, timeout=30.0):
+    received = [0]
+    loop = GLib.MainLoop()
+
+    def on_changed(interface, changed, invalidated):
+        if 'Value' in changed:
+            received[0] += 1
+            if received[0] >= count:
+                loop.quit()
+
+    match = bus.add_signal_receiver(
+            on_changed, 'PropertiesChanged', DBUS_PROP_IFACE,
+            GATT_SERVER_NAME, HR_MSRMT_PATH)
+    control = dbus.Interface(bus.get_object(GATT_SERVER_NAME, BENCH_PATH),
+                             BENCH_IFACE)
+
+    start = time.perf_counter()
+    control.NotifyBurst(HR_MSRMT_PATH, count, size,
+                        reply_handler=lambda: None,
+                        error_handler=lambda e: loop.quit())
+    GLib.timeout_add(int(timeout * 1000), loop.quit)
+    loop.run()
+    elapsed = time.perf_counter() - start
+    match.remove()
+
+    return {
+            'sent': count,
+            'received': received[0],
+            'seconds': elapsed,
+            'per_second': received[0] / elapsed,
+    }
+
+
+def check_replies(bus):
+    """
+    Check that the servers answer as the examples do on any backend: the
+    Introspect data keeps the handlers' argument names and values written
+    to the test characteristic read back unchanged.
+    """
+    xml = bus.get_object(GATT_SERVER_NAME, TEST_CHRC_PATH,
+                         introspect=False).Introspect(
+                                 dbus_interface=INTROSPECTABLE_IFACE)
+    for arg in ('"value"', '"options"'):
+        assert 'name=' + arg in xml, 'Introspect lost argument ' + arg
+
+    test = dbus.Interface(bus.get_object(GATT_SERVER_NAME, TEST_CHRC_PATH,
+                                         introspect=False), GATT_CHRC_IFACE)
+    value = dbus.ByteArray(b'same behaviour')
+    test.WriteValue(value, dbus.Dictionary(signature='sv'))
+    read = test.ReadValue(dbus.Dictionary(signature='sv'))
+    assert bytes(read) == value, 'read back %r' % bytes(read)
+
+    ad = dbus.Interface(bus.get_object(ADVERTISER_NAME, ADVERTISEMENT_PATH,
+                                       introspect=False), DBUS_PROP_IFACE)
+    assert ad.GetAll('org.bluez.LEAdvertisement1')['Type'] == 'peripheral'
+
+
+def run_benchmarks(args):
+    bus = dbus.SystemBus()
+    results = {}
+
+    wait_for_name(bus, GATT_SERVER_NAME)
+    wait_for_name(bus, ADVERTISER_NAME)
+    results['register_application_ms'] = \
+            wait_for_registration(bus, GATT_SERVER_NAME) * 1e3
+    results['register_advertisement_ms'] = \
+            wait_for_registration(bus, ADVERTISER_NAME) * 1e3
+    check_replies(bus)
+
+    om = dbus.Interface(bus.get_object(GATT_SERVER_NAME, '/',
+                                       introspect=False), DBUS_OM_IFACE)
+    results['get_managed_objects'] = measure(om.GetManagedObjects,
+                                             args.repeat)
+
+    ad = dbus.Interface(bus.get_object(ADVERTISER_NAME, ADVERTISEMENT_PATH,
+                                       introspect=False), DBUS_PROP_IFACE)
+    results['advertisement_get_all'] = measure(
+            lambda: ad.GetAll('org.bluez.LEAdvertisement1'), args.repeat)
+
+    test = dbus.Interface(bus.get_object(GATT_SERVER_NAME, TEST_CHRC_PATH,
+                                         introspect=False), GATT_CHRC_IFACE)
+    battery = dbus.Interface(bus.get_object(GATT_SERVER_NAME,
+                                            BATTERY_LVL_PATH,
+                                            introspect=False),
+                             GATT_CHRC_IFACE)
+    # Without introspection dbus-python guesses a{sq} for the mtu and
+    # cannot guess anything for {}; BlueZ sends a{sv}.
+    options = dbus.Dictionary({'mtu': dbus.UInt16(args.mtu)}, signature='sv')
+    no_options = dbus.Dictionary(signature='sv')
+    for size in (20, 512):
+        value = dbus.ByteArray(bytes(size))
+        results['write_value_%d' % size] = measure(
+                lambda: test.WriteValue(value, options), args.repeat)
+        results['read_value_%d' % size] = measure(
+                lambda: test.ReadValue(no_options), args.repeat)
+    results['read_value_battery'] = measure(
+            lambda: battery.ReadValue(no_options), args.repeat)
+
+    results['notify'] = notify_throughput(bus, args.notifications,
+                                          args.notify_size)
+    return results
+
+
+def print_results(results, baseline=None):
+    for key in sorted(results):
+        value = results[key]
+        old = baseline.get(key) if baseline else None
+        if isinstance(value, dict):
+            metric = 'per_second' if 'per_second' in value else 'p50_us'
+            line = '%-28s %s=%.1f' % (key, metric, value[metric])
+            if 'p99_us' in value:
+                line += ' p99_us=%.1f' % value['p99_us']
+            if isinstance(old, dict) and metric in old and old[metric]:
+                line += ' (%+.1f%%)' % (
+                        (value[metric] / old[metric] - 1) * 100)
+        else:
+            line = '%-28s %.3f' % (key, value)
+            if isinstance(old, (int, float)) and old:
+                line += ' (%+.1f%%)' % ((value / old - 1) * 100)
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--role', choices=['gatt-server', 'advertiser'],
+                        help=argparse.SUPPRESS)
+    parser.add_argument('--backend', default='glib',
+                        choices=['glib', 'asyncio'],
+                        help="run the characteristic and advertisement " +
+                        "handlers as coroutines on the asyncio backend")
+    parser.add_argument('--slow-ms', default=0, type=int,
+                        help=argparse.SUPPRESS)
+    parser.add_argument('--offload', action='store_true',
+                        help=argparse.SUPPRESS)
+    parser.add_argument('--repeat', default=1000, type=int)
+    parser.add_argument('--mtu', default=517, type=int)
+    parser.add_argument('--notifications', default=10000, type=int)
+    parser.add_argument('--notify-size', default=20, type=int)
+    parser.add_argument('--output', help="write the results to this file")
+    parser.add_argument('--compare', help="JSON results of an earlier run")
+    args = parser.parse_args()
+
+    if args.role == 'gatt-server':
+        return serve_gatt(args)
+    if args.role == 'advertiser':
+        return serve_advertisement(args)
+
+    dbus.mainloop.glib.DBusGMainLoop(set_as_default=True)
+    private_bus = PrivateBus()
+    try:
+        private_bus.spawn(os.path.join(HERE, 'mock_bluez.py'))
+        wait_for_name(dbus.SystemBus(), BLUEZ_SERVICE_NAME)
+        private_bus.spawn(__file__, '--role', 'gatt-server',
+                          '--backend', args.backend)
+        private_bus.spawn(__file__, '--role', 'advertiser',
+                          '--backend', args.backend)
+        results = run_benchmarks(args)
+    finally:
+        private_bus.close()
+
+    report = {
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'dbus_python': dbus.__version__,
+            'args': vars(args),
+            'results': results,
+    }
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)['results']
+    print_results(results, baseline)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+# SPDX-License-Identifier: LGPL-2.1-or-later
+"""
+Multi-central load generator for the GATT server.
+
+Starts the same private bus, mock BlueZ and GATT server process as
+harness.py, then runs N simulated centrals, each in its own process with
+its own bus connection. Every central issues asynchronous ReadValue,
+WriteValue and StartNotify/StopNotify calls at a fixed rate, picking the
+operation from --mix and the target from the exported characteristics
+that support it. Achieved throughput and latency percentiles are reported
+per characteristic class and operation.
+
+--centrals takes a comma separated list to sweep the number of centrals
+and see where the mainloop saturates (achieved rate falls behind the
+offered rate and tail latency climbs).
+"""
+
+import argparse
+import array
+import collections
+import multiprocessing
+import os
+import random
+import time
+
+import dbus
+import dbus.bus
+import dbus.mainloop.glib
+
+from gi.repository import GLib
+
+import harness
+from common import load_script
+
+TICK_MS = 10
+
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(','):
+        op, weight = part.split('=')
+        mix[op.strip()] = float(weight)
+    return mix
+
+
+def characteristic_targets(address):
+    """
+    Map each operation to the (path, class name) pairs that support it, using
+    the same tree the server process builds. The tree is exported on a
+    connection of its own to address, which dbus-python requires, and
+    never registered.
+    """
+    gatt = load_script('stock-gatt-server.py')
+    bus = dbus.bus.BusConnection(address)
+    app = gatt.Application(bus)
+    targets = collections.defaultdict(list)
+    for service in app.services:
+        for chrc in service.characteristics:
+            name = type(chrc).__name__
+            if 'read' in chrc.flags:
+                targets['read'].append((chrc.path, name))
+            if 'write' in chrc.flags:
+                targets['write'].append((chrc.path, name))
+            if 'notify' in chrc.flags:
+                targets['notify'].append((chrc.path, name))
+    bus.close()
+    return dict(targets)
+
+
+def central(address, targets, mix, rate, duration, max_inflight, seed,
+            results):
+    dbus.mainloop.glib.DBusGMainLoop(set_as_default=True)
+    bus = dbus.bus.BusConnection(address)
+    rng = random.Random(seed)
+    loop = GLib.MainLoop()
+
+    proxies = {}
+    for pairs in targets.values():
+        for path, _ in pairs:
+            proxies[path] = dbus.Interface(
+                    bus.get_object(harness.GATT_SERVER_NAME, path,
+                                   introspect=False),
+                    harness.GATT_CHRC_IFACE)
+
+    ops = [op for op in mix if targets.get(op)]
+    weights = [mix[op] for op in ops]
+    latencies = collections.defaultdict(lambda: array.array('d'))
+    errors = collections.Counter()
+    notifying = set()
+    state = {'inflight': 0, 'skipped': 0, 'credit': 0.0}
+    value = dbus.ByteArray(bytes(20))
+    # introspect=False leaves dbus-python unable to guess a{sv} for {}.
+    options = dbus.Dictionary(signature='sv')
+    end = time.monotonic() + duration
+
+    def issue():
+        op = rng.choices(ops, weights)[0]
+        path, name = rng.choice(targets[op])
+        proxy = proxies[path]
+        key = (name, op)
+        start = time.perf_counter()
+
+        def done(*reply):
+            state['inflight'] -= 1
+            latencies[key].append(time.perf_counter() - start)
+
+        def failed(error):
+            state['inflight'] -= 1
+            errors[(name, op, error.get_dbus_name())] += 1
+
+        state['inflight'] += 1
+        if op == 'read':
+            proxy.ReadValue(options, reply_handler=done, error_handler=failed)
+        elif op == 'write':
+            proxy.WriteValue(value, options, reply_handler=done,
+                             error_handler=failed)
+        elif path in notifying:
+            notifying.discard(path)
+            proxy.StopNotify(reply_handler=done, error_handler=failed)
+        else:
+            notifying.add(path)
+            proxy.StartNotify(reply_handler=done, error_handler=failed)
+
+    def tick():
+        if time.monotonic() >= end:
+            GLib.timeout_add(1000, loop.quit)
+            return False
+        state['credit'] += rate * TICK_MS / 1000.0
+        while state['credit'] >= 1:
+            state['credit'] -= 1
+            if state['inflight'] >= max_inflight:
+                state['skipped'] += 1
+            else:
+                issue()
+        return True
+
+    GLib.timeout_add(TICK_MS, tick)
+    loop.run()
+
+    results.put({
+            'latencies': dict((k, v.tobytes()) for k, v in latencies.items()),
+            'errors': dict(errors),
+            'skipped': state['skipped'],
+    })
+
+
+def run_load(address, targets, args, n_centrals):
+    ctx = multiprocessing.get_context('spawn')
+    results = ctx.Queue()
+    procs = []
+    for i in range(n_centrals):
+        proc = ctx.Process(target=central, args=(
+                address, targets, parse_mix(args.mix), args.rate,
+                args.duration, args.max_inflight, args.seed + i, results))
+        proc.start()
+        procs.append(proc)
+
+    merged = collections.defaultdict(lambda: array.array('d'))
+    errors = collections.Counter()
+    skipped = 0
+    for _ in procs:
+        result = results.get()
+        for key, raw in result['latencies'].items():
+            merged[key].frombytes(raw)
+        errors.update(result['errors'])
+        skipped += result['skipped']
+    for proc in procs:
+        proc.join()
+    return merged, errors, skipped
+
+
+def report(n_centrals, args, merged, errors, skipped):
+    offered = n_centrals * args.rate
+    total = sum(len(v) for v in merged.values())
+    print('\n%d centrals, offered %.0f calls/s, achieved %.0f calls/s, '
+          '%d skipped (max in-flight reached)' % (
+                  n_centrals, offered, total / args.duration, skipped))
+    print('%-28s %-7s %8s %10s %10s %10s %10s' % (
+            'characteristic', 'op', 'calls', 'calls/s', 'p50 (us)',
+            'p99 (us)', 'max (us)'))
+    for (name, op) in sorted(merged):
+        stats = harness.percentiles(merged[(name, op)])
+        print('%-28s %-7s %8d %10.0f %10.0f %10.0f %10.0f' % (
+                name, op, stats['count'], stats['count'] / args.duration,
+                stats['p50_us'], stats['p99_us'], stats['max_us']))
+    for (name, op, error), count in sorted(errors.items()):
+        print('%-28s %-7s %8d errors: %s' % (name, op, count, error))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--centrals', default='1,2,4,8',
+                        help="number of centrals, or a comma separated " +
+                        "list to sweep (default: 1,2,4,8)")
+    parser.add_argument('--rate', default=200.0, type=float,
+                        help="calls per second per central (default: 200)")
+    parser.add_argument('--mix', default='read=70,write=25,notify=5',
+                        help="relative weight of each operation")
+    parser.add_argument('--duration', default=10.0, type=float)
+    parser.add_argument('--max-inflight', default=64, type=int,
+                        help="outstanding calls per central")
+    parser.add_argument('--seed', default=1, type=int)
+    args = parser.parse_args()
+
+    dbus.mainloop.glib.DBusGMainLoop(set_as_default=True)
+    private_bus = harness.PrivateBus()
+    try:
+        private_bus.spawn(os.path.join(harness.HERE, 'mock_bluez.py'))
+        bus = dbus.SystemBus()
+        harness.wait_for_name(bus, harness.BLUEZ_SERVICE_NAME)
+        private_bus.spawn(harness.__file__, '--role', 'gatt-server')
+        harness.wait_for_name(bus, harness.GATT_SERVER_NAME)
+        harness.wait_for_registration(bus, harness.GATT_SERVER_NAME)
+        targets = characteristic_targets(private_bus.address)
+
+        for n in [int(n) for n in args.centrals.split(',')]:
+            merged, errors, skipped = run_load(private_bus.address, targets,
+                                               args, n)
+            report(n, args, merged, errors, skipped)
+    finally:
+        private_bus.close()
+
+
+if __name__ == '__main__':
+    main()
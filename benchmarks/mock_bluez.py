@@ -0,0 +1,346 @@
+#!/usr/bin/env python3
+# SPDX-License-Identifier: LGPL-2.1-or-later
+"""
+Minimal stand-in for the org.bluez service, for use on a private bus.
+
+Exports an ObjectManager at / and one or more adapters implementing
+Adapter1, GattManager1 and LEAdvertisingManager1. Registering an
+application fetches its objects with GetManagedObjects and registering an
+advertisement fetches its properties with GetAll, the same round trips
+bluetoothd makes. Like bluetoothd, registered advertisements are watched
+for PropertiesChanged. Each time an advertisement's data is taken in,
+from registration or from a change, the adapter emits
+AdvertisementUpdated, which stands in for the data going on air. Nothing
+touches a radio.
+
+Adapters can also carry Device1 objects, --devices of them from the start
+and more with AddDevices. They are only listed in GetManagedObjects and
+announced with InterfacesAdded/InterfacesRemoved; they have no methods.
+EmitAdvertisements sends a burst of the RSSI and ManufacturerData
+PropertiesChanged signals bluetoothd sends while discovering.
+
+Run it with DBUS_SYSTEM_BUS_ADDRESS pointing at the private bus.
+"""
+
+import argparse
+import collections
+import random
+import struct
+import time
+
+import dbus
+import dbus.lowlevel
+import dbus.mainloop.glib
+import dbus.service
+
+from gi.repository import GLib
+
+BLUEZ_SERVICE_NAME = 'org.bluez'
+ADAPTER_IFACE = 'org.bluez.Adapter1'
+GATT_MANAGER_IFACE = 'org.bluez.GattManager1'
+LE_ADVERTISING_MANAGER_IFACE = 'org.bluez.LEAdvertisingManager1'
+LE_ADVERTISEMENT_IFACE = 'org.bluez.LEAdvertisement1'
+DEVICE_IFACE = 'org.bluez.Device1'
+DBUS_OM_IFACE = 'org.freedesktop.DBus.ObjectManager'
+DBUS_PROP_IFACE = 'org.freedesktop.DBus.Properties'
+MOCK_IFACE = 'com.github.maldata.MockBluez1'
+
+
+class AlreadyExistsException(dbus.exceptions.DBusException):
+    _dbus_error_name = 'org.bluez.Error.AlreadyExists'
+
+
+class DoesNotExistException(dbus.exceptions.DBusException):
+    _dbus_error_name = 'org.bluez.Error.DoesNotExist'
+
+
+class InvalidArgsException(dbus.exceptions.DBusException):
+    _dbus_error_name = 'org.freedesktop.DBus.Error.InvalidArgs'
+
+
+class Root(dbus.service.Object):
+    def __init__(self, bus):
+        self.adapters = []
+        dbus.service.Object.__init__(self, bus, '/')
+
+    @dbus.service.method(DBUS_OM_IFACE, out_signature='a{oa{sa{sv}}}')
+    def GetManagedObjects(self):
+        objects = {}
+        for adapter in self.adapters:
+            objects[adapter.path] = adapter.get_properties()
+            objects.update(adapter.devices)
+        return objects
+
+    def _adapter(self, path):
+        for adapter in self.adapters:
+            if adapter.path == path:
+                return adapter
+        raise DoesNotExistException()
+
+    @dbus.service.method(MOCK_IFACE, in_signature='ou')
+    def AddDevices(self, adapter, count):
+        adapter = self._adapter(adapter)
+        for _ in range(count):
+            path, interfaces = adapter.add_device()
+            self.InterfacesAdded(path, interfaces)
+
+    @dbus.service.method(MOCK_IFACE, in_signature='oud')
+    def EmitAdvertisements(self, adapter, count, duplicates):
+        """
+        Send count advertisements round-robin over the devices of adapter.
+        A duplicates share of them only carry a new RSSI, the others new
+        ManufacturerData as well.
+        """
+        adapter = self._adapter(adapter)
+        paths = list(adapter.devices)
+        if not paths:
+            raise DoesNotExistException()
+        rand = random.Random(count)
+        for i in range(count):
+            path = paths[i % len(paths)]
+            props = adapter.devices[path][DEVICE_IFACE]
+            changed = {'RSSI': dbus.Int16(-40 - rand.randrange(50))}
+            if rand.random() >= duplicates:
+                changed['ManufacturerData'] = dbus.Dictionary(
+                        {dbus.UInt16(0xffff): dbus.Array(
+                                struct.pack('<I', i), signature='y')},
+                        signature='qv')
+            props.update(changed)
+            # The devices are not exported, so build the signal by hand.
+            msg = dbus.lowlevel.SignalMessage(path, DBUS_PROP_IFACE,
+                                              'PropertiesChanged')
+            msg.append(DEVICE_IFACE, changed, dbus.Array([], signature='s'),
+                       signature='sa{sv}as')
+            self.connection.send_message(msg)
+
+    @dbus.service.method(MOCK_IFACE, in_signature='ou')
+    def RemoveDevices(self, adapter, count):
+        adapter = self._adapter(adapter)
+        for _ in range(min(count, len(adapter.devices))):
+            path, interfaces = adapter.devices.popitem(last=False)
+            self.InterfacesRemoved(path, list(interfaces))
+
+    @dbus.service.signal(DBUS_OM_IFACE, signature='oa{sa{sv}}')
+    def InterfacesAdded(self, path, interfaces):
+        pass
+
+    @dbus.service.signal(DBUS_OM_IFACE, signature='oas')
+    def InterfacesRemoved(self, path, interfaces):
+        pass
+
+    @dbus.service.method(MOCK_IFACE, out_signature='a{sv}')
+    def GetStats(self):
+        stats = {}
+        for adapter in self.adapters:
+            stats[adapter.path] = dbus.Dictionary(adapter.stats(),
+                                                  signature='sv')
+        return stats
+
+
+class Adapter(dbus.service.Object):
+    def __init__(self, bus, index, instances):
+        self.path = '/org/bluez/hci%d' % index
+        self.index = index
+        self.bus = bus
+        self.powered = False
+        self.discovering = False
+        self.instances = instances
+        self.applications = {}
+        self.advertisements = {}
+        self.advertisement_watches = {}
+        self.advertisement_updates = 0
+        self.register_times = []
+        self.devices = collections.OrderedDict()
+        self.next_device = 0
+        dbus.service.Object.__init__(self, bus, self.path)
+
+    def add_device(self):
+        n = self.next_device
+        self.next_device += 1
+        address = '%02X:00:00:%02X:%02X:%02X' % (
+                self.index, (n >> 16) & 0xff, (n >> 8) & 0xff, n & 0xff)
+        path = dbus.ObjectPath(self.path + '/dev_' + address.replace(':', '_'))
+        self.devices[path] = {
+                DEVICE_IFACE: {
+                        'Address': address,
+                        'Adapter': dbus.ObjectPath(self.path),
+                        'Name': 'Device %d' % n,
+                        'RSSI': dbus.Int16(-40 - n % 50),
+                },
+        }
+        return path, self.devices[path]
+
+    def get_properties(self):
+        return {
+                ADAPTER_IFACE: {
+                        'Address': '00:00:00:00:00:%02X' % self.index,
+                        'Powered': dbus.Boolean(self.powered),
+                        'Discovering': dbus.Boolean(self.discovering),
+                },
+                GATT_MANAGER_IFACE: {},
+                LE_ADVERTISING_MANAGER_IFACE: {
+                        'ActiveInstances': dbus.Byte(len(self.advertisements)),
+                        'SupportedInstances': dbus.Byte(
+                                self.instances - len(self.advertisements)),
+                        'SupportedIncludes': dbus.Array(['tx-power'],
+                                                        signature='s'),
+                },
+        }
+
+    def stats(self):
+        return {
+                'applications': dbus.UInt32(len(self.applications)),
+                'advertisements': dbus.UInt32(len(self.advertisements)),
+                'devices': dbus.UInt32(len(self.devices)),
+                'advertisement_updates': dbus.UInt32(
+                        self.advertisement_updates),
+                'register_times': dbus.Array(self.register_times,
+                                             signature='d'),
+        }
+
+    @dbus.service.method(DBUS_PROP_IFACE, in_signature='ss',
+                         out_signature='v')
+    def Get(self, interface, name):
+        props = self.get_properties()
+        if interface not in props or name not in props[interface]:
+            raise InvalidArgsException()
+        return props[interface][name]
+
+    @dbus.service.method(DBUS_PROP_IFACE, in_signature='s',
+                         out_signature='a{sv}')
+    def GetAll(self, interface):
+        props = self.get_properties()
+        if interface not in props:
+            raise InvalidArgsException()
+        return props[interface]
+
+    @dbus.service.method(ADAPTER_IFACE)
+    def StartDiscovery(self):
+        self.discovering = True
+
+    @dbus.service.method(ADAPTER_IFACE)
+    def StopDiscovery(self):
+        self.discovering = False
+
+    @dbus.service.method(DBUS_PROP_IFACE, in_signature='ssv')
+    def Set(self, interface, name, value):
+        if interface != ADAPTER_IFACE or name != 'Powered':
+            raise InvalidArgsException()
+        self.powered = bool(value)
+
+    def _fetch(self, sender, path, interface, method, args, table, key,
+               reply, error):
+        start = time.perf_counter()
+
+        def fetched(*result):
+            table[key] = result[0] if result else None
+            self.register_times.append(time.perf_counter() - start)
+            reply()
+
+        getattr(self.bus.get_object(sender, path, introspect=False),
+                method)(*args, dbus_interface=interface,
+                        reply_handler=fetched, error_handler=error)
+
+    @dbus.service.method(GATT_MANAGER_IFACE, in_signature='oa{sv}',
+                         sender_keyword='sender',
+                         async_callbacks=('reply', 'error'))
+    def RegisterApplication(self, application, options, sender=None,
+                            reply=None, error=None):
+        key = (sender, application)
+        if key in self.applications:
+            raise AlreadyExistsException()
+        self._fetch(sender, application, DBUS_OM_IFACE, 'GetManagedObjects',
+                    (), self.applications, key, reply, error)
+
+    @dbus.service.method(GATT_MANAGER_IFACE, in_signature='o',
+                         sender_keyword='sender')
+    def UnregisterApplication(self, application, sender=None):
+        if self.applications.pop((sender, application), None) is None:
+            raise DoesNotExistException()
+
+    @dbus.service.method(LE_ADVERTISING_MANAGER_IFACE, in_signature='oa{sv}',
+                         sender_keyword='sender',
+                         async_callbacks=('reply', 'error'))
+    def RegisterAdvertisement(self, advertisement, options, sender=None,
+                              reply=None, error=None):
+        key = (sender, advertisement)
+        if key in self.advertisements:
+            raise AlreadyExistsException()
+        if len(self.advertisements) >= self.instances:
+            raise dbus.exceptions.DBusException(
+                    'Maximum advertisements reached',
+                    name='org.bluez.Error.NotPermitted')
+
+        def registered():
+            self.advertisement_watches[key] = self.bus.add_signal_receiver(
+                    lambda interface, changed, invalidated:
+                            self._advertisement_changed(key, interface,
+                                                        changed, invalidated),
+                    'PropertiesChanged', DBUS_PROP_IFACE, sender,
+                    advertisement)
+            self._advertisement_updated(key)
+            reply()
+
+        def failed(e):
+            self.advertisements.pop(key, None)
+            error(e)
+
+        # Hold the instance while the properties are fetched, so that
+        # registrations made at the same time cannot all get it.
+        self.advertisements[key] = None
+        self._fetch(sender, advertisement, DBUS_PROP_IFACE, 'GetAll',
+                    (LE_ADVERTISEMENT_IFACE,), self.advertisements, key,
+                    registered, failed)
+
+    @dbus.service.method(LE_ADVERTISING_MANAGER_IFACE, in_signature='o',
+                         sender_keyword='sender')
+    def UnregisterAdvertisement(self, advertisement, sender=None):
+        key = (sender, advertisement)
+        if self.advertisements.get(key) is None:
+            raise DoesNotExistException()
+        del self.advertisements[key]
+        self.advertisement_watches.pop(key).remove()
+
+    def _advertisement_changed(self, key, interface, changed, invalidated):
+        props = self.advertisements.get(key)
+        if props is None or interface != LE_ADVERTISEMENT_IFACE:
+            return
+        props.update(changed)
+        for name in invalidated:
+            props.pop(name, None)
+        self._advertisement_updated(key)
+
+    def _advertisement_updated(self, key):
+        self.advertisement_updates += 1
+        self.AdvertisementUpdated(key[1], self.advertisements[key])
+
+    @dbus.service.signal(MOCK_IFACE, signature='oa{sv}')
+    def AdvertisementUpdated(self, advertisement, properties):
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--adapters', default=1, type=int)
+    parser.add_argument('--instances', default=5, type=int,
+                        help="advertising instances per adapter")
+    parser.add_argument('--devices', default=0, type=int,
+                        help="Device1 objects per adapter")
+    args = parser.parse_args()
+
+    dbus.mainloop.glib.DBusGMainLoop(set_as_default=True)
+    bus = dbus.SystemBus()
+
+    root = Root(bus)
+    for i in range(args.adapters):
+        root.adapters.append(Adapter(bus, i, args.instances))
+        for _ in range(args.devices):
+            root.adapters[-1].add_device()
+
+    # Claim the name last so clients never see a half-built tree.
+    name = dbus.service.BusName(BLUEZ_SERVICE_NAME, bus)
+    GLib.MainLoop().run()
+
+
+if __name__ == '__main__':
+    main()
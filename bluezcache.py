@@ -0,0 +1,182 @@
+# SPDX-License-Identifier: LGPL-2.1-or-later
+"""
+Client-side cache of the org.bluez object tree.
+
+GetManagedObjects returns every object bluetoothd knows about, including
+each Device1 it has ever seen, so scanning its reply to find an adapter
+gets slower as the neighbourhood gets busier. ObjectCache makes that call
+once and then follows InterfacesAdded, InterfacesRemoved and
+PropertiesChanged. Objects are indexed by interface name and by the
+adapter they belong to, so lookups only touch the objects they return.
+
+Signals are only delivered while the GLib mainloop runs. The cache starts
+over when bluetoothd restarts.
+"""
+
+import collections
+
+import dbus
+
+BLUEZ_SERVICE_NAME = 'org.bluez'
+DBUS_OM_IFACE = 'org.freedesktop.DBus.ObjectManager'
+DBUS_PROP_IFACE = 'org.freedesktop.DBus.Properties'
+
+
+def adapter_of(path):
+    """
+    Return the adapter path that path belongs to (/org/bluez/hci0 for
+    /org/bluez/hci0/dev_00_11_22_33_44_55), or None.
+    """
+    parts = path.split('/')
+    if len(parts) < 4 or not parts[3].startswith('hci'):
+        return None
+    return '/'.join(parts[:4])
+
+
+class ObjectCache(object):
+    """
+    objects maps each object path to {interface: {property: value}}.
+    by_interface and by_adapter map interface names and adapter paths to
+    sets of object paths. Listeners added with watch() are called as
+    callback(event, path, properties) for 'added', 'changed' and
+    'removed' events on the interface they watch.
+    """
+    def __init__(self, bus, service=BLUEZ_SERVICE_NAME):
+        self.bus = bus
+        self.service = service
+        self.objects = {}
+        self.by_interface = collections.defaultdict(set)
+        self.by_adapter = collections.defaultdict(set)
+        self.listeners = collections.defaultdict(list)
+        self.owner = None
+
+        # Subscribe before loading so no change falls in between.
+        self._matches = [
+                bus.add_signal_receiver(self._interfaces_added,
+                                        'InterfacesAdded', DBUS_OM_IFACE,
+                                        service),
+                bus.add_signal_receiver(self._interfaces_removed,
+                                        'InterfacesRemoved', DBUS_OM_IFACE,
+                                        service),
+                bus.add_signal_receiver(self._properties_changed,
+                                        'PropertiesChanged', DBUS_PROP_IFACE,
+                                        service, path_keyword='path'),
+        ]
+        self._owner_watch = bus.watch_name_owner(service, self._owner_changed)
+
+    def close(self):
+        for match in self._matches:
+            match.remove()
+        self._owner_watch.cancel()
+
+    def load(self):
+        self.clear()
+        # Lets _owner_changed tell a restart from the initial owner.
+        self.owner = self.bus.get_name_owner(self.service)
+        om = dbus.Interface(self.bus.get_object(self.service, '/'),
+                            DBUS_OM_IFACE)
+        for path, interfaces in om.GetManagedObjects().items():
+            self._add(str(path), interfaces)
+
+    def clear(self):
+        self.objects.clear()
+        self.by_interface.clear()
+        self.by_adapter.clear()
+
+    def paths(self, interface, adapter=None):
+        """
+        Return the sorted paths of the objects implementing interface,
+        optionally only those belonging to adapter.
+        """
+        paths = self.by_interface.get(interface, ())
+        if adapter is not None:
+            paths = self.by_adapter.get(adapter, set()).intersection(paths)
+        return sorted(paths)
+
+    def properties(self, path, interface):
+        return self.objects.get(path, {}).get(interface)
+
+    def watch(self, interface, callback):
+        self.listeners[interface].append(callback)
+
+    def unwatch(self, interface, callback):
+        self.listeners[interface].remove(callback)
+
+    def _notify(self, event, path, interface, properties):
+        for callback in self.listeners.get(interface, ()):
+            callback(event, path, properties)
+
+    def _add(self, path, interfaces):
+        obj = self.objects.setdefault(path, {})
+        adapter = adapter_of(path)
+        for interface, properties in interfaces.items():
+            interface = str(interface)
+            obj[interface] = dict(properties)
+            self.by_interface[interface].add(path)
+            if adapter is not None:
+                self.by_adapter[adapter].add(path)
+            self._notify('added', path, interface, obj[interface])
+
+    def _remove(self, path, interfaces):
+        obj = self.objects.get(path)
+        if obj is None:
+            return
+        for interface in interfaces:
+            interface = str(interface)
+            properties = obj.pop(interface, None)
+            if properties is None:
+                continue
+            paths = self.by_interface[interface]
+            paths.discard(path)
+            if not paths:
+                del self.by_interface[interface]
+            self._notify('removed', path, interface, properties)
+        if obj:
+            return
+        del self.objects[path]
+        adapter = adapter_of(path)
+        if adapter in self.by_adapter:
+            paths = self.by_adapter[adapter]
+            paths.discard(path)
+            if not paths:
+                del self.by_adapter[adapter]
+
+    def _interfaces_added(self, path, interfaces):
+        self._add(str(path), interfaces)
+
+    def _interfaces_removed(self, path, interfaces):
+        self._remove(str(path), interfaces)
+
+    def _properties_changed(self, interface, changed, invalidated, path=None):
+        properties = self.objects.get(str(path), {}).get(str(interface))
+        if properties is None:
+            return
+        properties.update(changed)
+        for name in invalidated:
+            properties.pop(name, None)
+        self._notify('changed', str(path), str(interface), properties)
+
+    def _owner_changed(self, owner):
+        if owner == self.owner:
+            return
+        self.owner = owner
+        if owner:
+            self.load()
+        else:
+            for path in list(self.objects):
+                self._remove(path, list(self.objects[path]))
+
+
+_caches = {}
+
+
+def get_cache(bus):
+    """
+    Return the ObjectCache shared by all users of bus, loading it on
+    first use.
+    """
+    cache = _caches.get(bus)
+    if cache is None:
+        cache = _caches[bus] = ObjectCache(bus)
+        cache.load()
+    return cache
@@ -0,0 +1,107 @@
+# SPDX-License-Identifier: LGPL-2.1-or-later
+"""
+Vectorized simulation of many fake wearables.
+
+HeartRateMeasurementChrc and BatteryLevelCharacteristic simulate one
+device each, one Python-level sample at a time. WearableFleet keeps the
+heart rate, energy expended and battery level of every simulated device
+in NumPy arrays, advances them all in one step per tick and encodes every
+Heart Rate Measurement payload into a single array. Per-device work is
+then reduced to slicing its bytes out of that array.
+
+NumPy is only needed when a fleet is created.
+"""
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+import timerwheel
+
+HR_MIN = 90
+HR_MAX = 130
+
+# Heart Rate Measurement flags: sensor contact supported and detected,
+# with the Energy Expended field present every tenth sample.
+HR_FLAGS = 0x06
+HR_FLAG_ENERGY_EXPENDED = 0x08
+
+
+class WearableFleet(object):
+    def __init__(self, n, seed=None):
+        if numpy is None:
+            raise RuntimeError('WearableFleet needs NumPy')
+        self.n = n
+        self.rng = numpy.random.default_rng(seed)
+        self.heart_rate = numpy.zeros(n, numpy.uint8)
+        self.energy_expended = numpy.zeros(n, numpy.uint32)
+        self.battery = numpy.full(n, 100, numpy.int16)
+        # Devices are switched on at different times, so they do not all
+        # send the Energy Expended field in the same tick.
+        self.sample_count = self.rng.integers(0, 10, n, dtype=numpy.uint32)
+        self.payloads = numpy.zeros((n, 4), numpy.uint8)
+        self.lengths = numpy.full(n, 2, numpy.uint8)
+        self.subscribers = {}
+        self.ticks = 0
+        self._raw = bytes(4 * n)
+
+    def tick(self):
+        """
+        Take one heart rate sample on every device and notify subscribers.
+        """
+        self.heart_rate = self.rng.integers(HR_MIN, HR_MAX + 1, self.n,
+                                            dtype=numpy.uint8)
+        with_ee = self.sample_count % 10 == 0
+
+        payloads = self.payloads
+        payloads[:, 0] = numpy.where(with_ee,
+                                     HR_FLAGS | HR_FLAG_ENERGY_EXPENDED,
+                                     HR_FLAGS)
+        payloads[:, 1] = self.heart_rate
+        payloads[:, 2] = self.energy_expended & 0xff
+        payloads[:, 3] = self.energy_expended >> 8
+        self.lengths = numpy.where(with_ee, 4, 2).astype(numpy.uint8)
+        self._raw = payloads.tobytes()
+
+        numpy.minimum(self.energy_expended + 1, 0xffff,
+                      out=self.energy_expended)
+        self.sample_count += 1
+        self.ticks += 1
+
+        for index, callback in list(self.subscribers.items()):
+            callback(self.payload(index))
+        return True
+
+    def drain_battery(self, amount=2):
+        numpy.maximum(self.battery - amount, 0, out=self.battery)
+        return True
+
+    def payload(self, index):
+        """
+        Return the Heart Rate Measurement bytes of device index from the
+        last tick.
+        """
+        start = index * 4
+        return self._raw[start:start + int(self.lengths[index])]
+
+    def battery_level(self, index):
+        return int(self.battery[index])
+
+    def reset_energy_expended(self, index):
+        self.energy_expended[index] = 0
+
+    def subscribe(self, index, callback):
+        self.subscribers[index] = callback
+
+    def unsubscribe(self, index):
+        self.subscribers.pop(index, None)
+
+    def start(self, wheel=None):
+        """
+        Tick every second and drain batteries every five seconds, like the
+        single-device simulations.
+        """
+        wheel = wheel or timerwheel.get_default()
+        wheel.add(1000, self.tick)
+        wheel.add(5000, self.drain_battery)
@@ -0,0 +1,323 @@
+# SPDX-License-Identifier: LGPL-2.1-or-later
+"""
+Method and notification metrics for the example servers.
+
+Classes that inherit Instrumented have each of their D-Bus method handlers
+wrapped so that every call is recorded in the default Registry: a call
+count, errors by D-Bus error name and a latency histogram per interface
+and method. Handlers with deferred replies (see backends.py) are timed
+until the reply or error is sent. count_notification() counts
+notifications per object path.
+
+The numbers can be read over D-Bus through StatsInterface or written to a
+Prometheus text-format file with start_prometheus_file(). Recording only
+does a clock read, a bisect and a few integer increments on the mainloop
+thread, so metrics stay on all the time.
+"""
+
+import bisect
+import collections
+import functools
+import os
+import time
+
+import dbus
+import dbus.exceptions
+import dbus.service
+
+try:
+    from gi.repository import GObject
+except ImportError:
+    import gobject as GObject
+
+STATS_IFACE = 'com.github.maldata.Stats1'
+
+# Upper bounds in seconds, as in Prometheus' default buckets, with a few
+# finer ones because most handlers answer in well under a millisecond.
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+                   0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+_clock = time.perf_counter
+
+
+class Histogram(object):
+    def __init__(self, bounds=LATENCY_BUCKETS):
+        self.bounds = bounds
+        # One more bucket for everything above the last bound.
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def cumulative(self):
+        total = 0
+        for count in self.counts:
+            total += count
+            yield total
+
+
+class MethodStats(object):
+    def __init__(self, interface, method):
+        self.interface = interface
+        self.method = method
+        self.calls = 0
+        self.errors = collections.Counter()
+        self.latency = Histogram()
+
+    def record(self, elapsed, error=None):
+        self.calls += 1
+        self.latency.observe(elapsed)
+        if error is not None:
+            self.errors[error_name(error)] += 1
+
+
+class NotificationStats(object):
+    """
+    Notification count of one object path, plus per-second counts for
+    the last window seconds to compute a recent rate from.
+    """
+    def __init__(self, window=10):
+        self.window = window
+        self.count = 0
+        self.seconds = collections.deque(maxlen=window + 1)
+
+    def record(self):
+        self.count += 1
+        now = int(time.monotonic())
+        if self.seconds and self.seconds[-1][0] == now:
+            self.seconds[-1][1] += 1
+        else:
+            self.seconds.append([now, 1])
+
+    def rate(self):
+        """Notifications per second over the last window seconds."""
+        since = int(time.monotonic()) - self.window
+        return sum(n for t, n in self.seconds if t >= since) / self.window
+
+
+class Registry(object):
+    def __init__(self):
+        self.methods = {}
+        self.notifications = {}
+
+    def method(self, interface, method):
+        key = (interface, method)
+        stats = self.methods.get(key)
+        if stats is None:
+            stats = self.methods[key] = MethodStats(interface, method)
+        return stats
+
+    def count_notification(self, path):
+        stats = self.notifications.get(path)
+        if stats is None:
+            stats = self.notifications[path] = NotificationStats()
+        stats.record()
+
+    def reset(self):
+        for stats in self.methods.values():
+            stats.__init__(stats.interface, stats.method)
+        self.notifications.clear()
+
+    def prometheus_text(self):
+        lines = []
+
+        def header(name, kind, text):
+            lines.append('# HELP %s %s' % (name, text))
+            lines.append('# TYPE %s %s' % (name, kind))
+
+        methods = sorted(self.methods.items())
+        header('dbus_method_calls_total', 'counter',
+               'D-Bus method calls handled.')
+        for (iface, method), stats in methods:
+            lines.append('dbus_method_calls_total{%s} %d' % (
+                    _labels(interface=iface, method=method), stats.calls))
+
+        header('dbus_method_errors_total', 'counter',
+               'D-Bus method calls answered with an error.')
+        for (iface, method), stats in methods:
+            for name, count in sorted(stats.errors.items()):
+                lines.append('dbus_method_errors_total{%s} %d' % (
+                        _labels(interface=iface, method=method, error=name),
+                        count))
+
+        header('dbus_method_latency_seconds', 'histogram',
+               'Time from receiving a D-Bus method call to its reply.')
+        for (iface, method), stats in methods:
+            latency = stats.latency
+            bounds = [repr(b) for b in latency.bounds] + ['+Inf']
+            for le, count in zip(bounds, latency.cumulative()):
+                lines.append('dbus_method_latency_seconds_bucket{%s} %d' % (
+                        _labels(interface=iface, method=method, le=le),
+                        count))
+            labels = _labels(interface=iface, method=method)
+            lines.append('dbus_method_latency_seconds_sum{%s} %r' % (
+                    labels, latency.sum))
+            lines.append('dbus_method_latency_seconds_count{%s} %d' % (
+                    labels, latency.count))
+
+        header('gatt_notifications_total', 'counter',
+               'Notifications and indications sent.')
+        for path, stats in sorted(self.notifications.items()):
+            lines.append('gatt_notifications_total{%s} %d' % (
+                    _labels(path=path), stats.count))
+        return '\n'.join(lines) + '\n'
+
+    def write_prometheus(self, path):
+        # Written next to the target and renamed over it, so a scraper
+        # never reads a half-written file.
+        tmp = path + '.tmp'
+        with open(tmp, 'w') as f:
+            f.write(self.prometheus_text())
+        os.replace(tmp, path)
+
+
+def _labels(**labels):
+    return ','.join('%s="%s"' % (k, str(v).replace('\\', '\\\\')
+                                         .replace('"', '\\"'))
+                    for k, v in sorted(labels.items()))
+
+
+def error_name(error):
+    """
+    Return the D-Bus error name dbus-python replies with for error.
+    """
+    if isinstance(error, dbus.exceptions.DBusException):
+        name = error.get_dbus_name()
+        if name:
+            return name
+    return 'org.freedesktop.DBus.Python.%s.%s' % (
+            type(error).__module__, type(error).__name__)
+
+
+registry = Registry()
+
+
+def count_notification(path):
+    registry.count_notification(path)
+
+
+def _find_dbus_method(cls, name):
+    for base in cls.__mro__:
+        func = base.__dict__.get(name)
+        if getattr(func, '_dbus_is_method', False):
+            return func
+    return None
+
+
+def _wrap(func, stats, async_callbacks):
+    # functools.wraps copies the dbus-python metadata as well, so a
+    # wrapped @dbus.service.method is dispatched exactly like the original.
+    if async_callbacks:
+        reply_name, error_name_ = async_callbacks
+
+        @functools.wraps(func)
+        def wrapper(self, *args, **kwargs):
+            start = _clock()
+            reply = kwargs[reply_name]
+            error = kwargs[error_name_]
+
+            def on_reply(*result):
+                stats.record(_clock() - start)
+                reply(*result)
+
+            def on_error(e):
+                stats.record(_clock() - start, e)
+                error(e)
+
+            kwargs[reply_name] = on_reply
+            kwargs[error_name_] = on_error
+            try:
+                return func(self, *args, **kwargs)
+            except Exception as e:
+                stats.record(_clock() - start, e)
+                raise
+    else:
+        @functools.wraps(func)
+        def wrapper(self, *args, **kwargs):
+            start = _clock()
+            try:
+                result = func(self, *args, **kwargs)
+            except Exception as e:
+                stats.record(_clock() - start, e)
+                raise
+            stats.record(_clock() - start)
+            return result
+    wrapper._metrics_stats = stats
+    return wrapper
+
+
+def instrument(cls, registry=registry):
+    """
+    Wrap the D-Bus method handlers defined by cls itself. Inherited
+    handlers are already wrapped by their own class.
+    """
+    for name, func in list(cls.__dict__.items()):
+        if not callable(func) or hasattr(func, '_metrics_stats'):
+            continue
+        parent = _find_dbus_method(cls, name)
+        if parent is None:
+            continue
+        stats = registry.method(parent._dbus_interface, name)
+        setattr(cls, name, _wrap(func, stats, parent._dbus_async_callbacks))
+
+
+class Instrumented(object):
+    """
+    Records metrics for the D-Bus methods of every subclass.
+
+    List it before mixins whose __init_subclass__ replaces handlers (such
+    as AttributeValue), so that the handlers it wraps are the final ones.
+    """
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        instrument(cls)
+
+
+class StatsInterface(dbus.service.Interface):
+    """
+    com.github.maldata.Stats1: the metrics of the default Registry.
+    """
+    @dbus.service.method(STATS_IFACE, out_signature='a{sa{sv}}')
+    def GetMethodStats(self):
+        response = {}
+        for (iface, method), stats in registry.methods.items():
+            response[iface + '.' + method] = {
+                    'Calls': dbus.UInt64(stats.calls),
+                    'Errors': dbus.Dictionary(stats.errors, signature='st'),
+                    'Bounds': dbus.Array(stats.latency.bounds, signature='d'),
+                    'Buckets': dbus.Array(stats.latency.counts,
+                                          signature='t'),
+                    'Sum': dbus.Double(stats.latency.sum),
+            }
+        return response
+
+    @dbus.service.method(STATS_IFACE, out_signature='a{sa{sv}}')
+    def GetNotificationStats(self):
+        return {path: {'Count': dbus.UInt64(stats.count),
+                       'Rate': dbus.Double(stats.rate())}
+                for path, stats in registry.notifications.items()}
+
+    @dbus.service.method(STATS_IFACE)
+    def ResetStats(self):
+        registry.reset()
+
+
+def start_prometheus_file(path, interval=10):
+    """
+    Write the default Registry to path now and then every interval
+    seconds from the GLib mainloop.
+    """
+    def write():
+        try:
+            registry.write_prometheus(path)
+        except OSError:
+            # Keep trying; the directory may come back.
+            pass
+        return True
+
+    write()
+    return GObject.timeout_add(int(interval * 1000), write)
@@ -0,0 +1,187 @@
+# SPDX-License-Identifier: LGPL-2.1-or-later
+"""
+On-demand cProfile sessions for a running server.
+
+A Profiler profiles the GLib mainloop thread, where every D-Bus handler
+and notification timer runs, for a given number of seconds. The stats are
+written to a file that pstats or snakeviz can open, and the functions
+with the highest own time are returned. Handlers offloaded to the asyncio
+or thread pool backends run on other threads and are not included.
+
+ProfilingInterface starts a session over D-Bus and replies with the hot
+functions once it ends. install_signal_handler() adds a fallback for when
+the bus is not usable: SIGUSR1 starts a session and a second SIGUSR1 ends
+it early. Either way the hot functions are logged.
+"""
+
+import cProfile
+import logging
+import os
+import pstats
+import signal
+import sys
+import tempfile
+import time
+
+import dbus
+import dbus.exceptions
+import dbus.service
+
+try:
+    from gi.repository import GObject
+except ImportError:
+    import gobject as GObject
+
+PROFILING_IFACE = 'com.github.maldata.Profiling1'
+
+log = logging.getLogger('profiling')
+
+
+class InProgressException(dbus.exceptions.DBusException):
+    _dbus_error_name = 'com.github.maldata.Error.InProgress'
+
+
+class NotRunningException(dbus.exceptions.DBusException):
+    _dbus_error_name = 'com.github.maldata.Error.NotRunning'
+
+
+def default_path():
+    name = os.path.splitext(os.path.basename(sys.argv[0] or 'python'))[0]
+    return os.path.join(tempfile.gettempdir(), '%s-%d-%d.prof' % (
+            name, os.getpid(), int(time.time())))
+
+
+def top_functions(stats, count):
+    """
+    Return (function, calls, own seconds, cumulative seconds) for the
+    count functions with the highest own time in stats.
+    """
+    stats.sort_stats('tottime')
+    result = []
+    for func in stats.fcn_list[:count]:
+        _, calls, tottime, cumtime, _ = stats.stats[func]
+        result.append((pstats.func_std_string(func), calls, tottime, cumtime))
+    return result
+
+
+class Profiler(object):
+    """
+    One cProfile session at a time on the mainloop thread.
+
+    start() must be called from the mainloop thread. The session ends
+    after duration seconds (or at stop() when duration is 0); the stats
+    are then written to path and every callback passed to start() or
+    added with on_stop() is given the pstats.Stats.
+    """
+    def __init__(self):
+        self.profile = None
+        self.path = None
+        self.started = None
+        self._timeout_id = None
+        self._callbacks = []
+
+    @property
+    def running(self):
+        return self.profile is not None
+
+    def start(self, duration, path=None, callback=None):
+        if self.running:
+            raise InProgressException('Profiling already running')
+        self.path = path or default_path()
+        self.started = time.monotonic()
+        if callback is not None:
+            self._callbacks.append(callback)
+        if duration > 0:
+            self._timeout_id = GObject.timeout_add(int(duration * 1000),
+                                                   self._timeout)
+        self.profile = cProfile.Profile()
+        self.profile.enable()
+        log.info('Profiling for %s, writing to %s',
+                 '%gs' % duration if duration > 0 else 'until stopped',
+                 self.path)
+
+    def on_stop(self, callback):
+        self._callbacks.append(callback)
+
+    def stop(self):
+        if not self.running:
+            raise NotRunningException('Profiling not running')
+        self.profile.disable()
+        if self._timeout_id is not None:
+            GObject.source_remove(self._timeout_id)
+            self._timeout_id = None
+
+        stats = pstats.Stats(self.profile)
+        self.profile = None
+        callbacks, self._callbacks = self._callbacks, []
+        try:
+            stats.dump_stats(self.path)
+        except OSError as e:
+            log.error('Could not write profile to %s: %s', self.path, e)
+        log.info('Profiled %.1fs, stats written to %s',
+                 time.monotonic() - self.started, self.path)
+
+        for callback in callbacks:
+            callback(stats)
+        return stats
+
+    def _timeout(self):
+        self._timeout_id = None
+        self.stop()
+        return False
+
+
+profiler = Profiler()
+
+
+def log_top_functions(stats, count=20):
+    for func, calls, tottime, cumtime in top_functions(stats, count):
+        log.info('%10d %10.4f %10.4f  %s', calls, tottime, cumtime, func)
+
+
+class ProfilingInterface(dbus.service.Interface):
+    """
+    com.github.maldata.Profiling1: controls the default Profiler.
+    """
+    @dbus.service.method(PROFILING_IFACE, in_signature='dsu',
+                         out_signature='sa(sudd)',
+                         async_callbacks=('reply_handler', 'error_handler'))
+    def Profile(self, duration, path, count, reply_handler, error_handler):
+        """
+        Profile for duration seconds (0: until StopProfiling) and reply
+        with the stats file and the count hottest functions.
+        """
+        def done(stats):
+            log_top_functions(stats)
+            reply_handler(profiler.path, dbus.Array(
+                    top_functions(stats, int(count)), signature='(sudd)'))
+
+        try:
+            profiler.start(float(duration), str(path) or None, done)
+        except Exception as e:
+            error_handler(e)
+
+    @dbus.service.method(PROFILING_IFACE)
+    def StopProfiling(self):
+        profiler.stop()
+
+
+def install_signal_handler(signum=signal.SIGUSR1, duration=60):
+    """
+    Toggle a profiling session of at most duration seconds on signum.
+    """
+    def toggle():
+        if profiler.running:
+            profiler.stop()
+        else:
+            profiler.start(duration, callback=log_top_functions)
+        return True
+
+    try:
+        from gi.repository import GLib
+        GLib.unix_signal_add(GLib.PRIORITY_DEFAULT, signum, toggle)
+    except (ImportError, AttributeError):
+        # The Python handler only queues the toggle, so it still runs on
+        # the mainloop thread.
+        signal.signal(signum, lambda *args: GObject.idle_add(
+                lambda: toggle() and False))
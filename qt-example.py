@@ -1,7 +1,8 @@
 import sys
+import time
 
 from PyQt5.QtCore import pyqtSignal, pyqtSlot, pyqtProperty, Q_CLASSINFO, QCoreApplication, QObject, QTimer
-from PyQt5.QtDBus import QDBus, QDBusAbstractInterface, QDBusReply, QDBusConnection, QDBusMessage, QDBusAbstractAdaptor, QDBusConnectionInterface, QDBusObjectPath, QDBusVariant
+from PyQt5.QtDBus import QDBusAbstractInterface, QDBusConnection, QDBusAbstractAdaptor, QDBusConnectionInterface, QDBusObjectPath, QDBusPendingCallWatcher, QDBusPendingReply
 
 
 class ExampleObject(QObject):
@@ -116,32 +117,71 @@ class AnotherAdapter(QDBusAbstractAdaptor):
 #        return {0xffff: [0x00, 0x01, 0x02, 0x03]}
 
 
-class BleAdManager(QDBusAbstractInterface):
-    def __init__(self, dbus_obj_path, parent=None):
+class PendingCall(QObject):
+    """
+    One outstanding D-Bus call. Emits finished with the reply arguments,
+    or failed with the error name and message (NoReply on timeout), from
+    the event loop. latency is the time the reply took, in seconds.
+    """
+    finished = pyqtSignal(list)
+    failed = pyqtSignal(str, str)
+
+    def __init__(self, pending, parent=None):
+        super().__init__(parent)
+        self.latency = None
+        self._started = time.perf_counter()
+        self._watcher = QDBusPendingCallWatcher(pending, self)
+        self._watcher.finished.connect(self._on_finished)
+
+    def _on_finished(self, watcher):
+        self.latency = time.perf_counter() - self._started
+        reply = QDBusPendingReply(watcher)
+        if reply.isError():
+            error = reply.error()
+            self.failed.emit(error.name(), error.message())
+        else:
+            self.finished.emit(reply.reply().arguments())
+        self.deleteLater()
+
+
+class AsyncInterface(QDBusAbstractInterface):
+    """
+    A QDBusAbstractInterface whose calls never wait for their reply.
+    callAsync() sends the call with asyncCall() and returns a PendingCall.
+    timeout is in milliseconds, -1 for the D-Bus default.
+    """
+    def __init__(self, service, path, interface, connection, parent=None,
+                 timeout=-1):
+        super().__init__(service, path, interface, connection, parent)
+        self.setTimeout(timeout)
+
+    def callAsync(self, method, *args):
+        return PendingCall(self.asyncCall(method, *args), self)
+
+
+class BleAdManager(AsyncInterface):
+    def __init__(self, dbus_obj_path, parent=None, connection=None,
+                 timeout=5000):
         self._ble_adapter_dbus_path = dbus_obj_path
-        self._dbus_system_bus = QDBusConnection.systemBus()
+        if connection is None:
+            connection = QDBusConnection.systemBus()
+        self._dbus_system_bus = connection
 
         super().__init__("org.bluez",
                          self._ble_adapter_dbus_path,
                          "org.bluez.LEAdvertisingManager1",
                          self._dbus_system_bus,
-                         parent)
+                         parent,
+                         timeout)
 
     def RegisterAdvertisement(self, ad_path):
-        print("Registering {0}...".format(ad_path))
-        msg = self.call(QDBus.CallMode.NoBlock,
-                        'RegisterAdvertisement',
-                        QDBusObjectPath(ad_path),
-                        {})
-        print("Call returned.")
-        reply = QDBusReply(msg)
-
-        if reply.isValid():
-            print("Valid")
-            return reply.value()
-        else:
-            print(reply.error().message())
-            return None
+        return self.callAsync('RegisterAdvertisement',
+                              QDBusObjectPath(ad_path),
+                              {})
+
+    def UnregisterAdvertisement(self, ad_path):
+        return self.callAsync('UnregisterAdvertisement',
+                              QDBusObjectPath(ad_path))
 
 
 class MainController(QObject):
@@ -158,9 +198,17 @@ class MainController(QObject):
         obj_name = "/com/github/maldata/TestObj1"
         result = bus.registerObject(obj_name, self._test_obj)
 
-        ad_mgr = BleAdManager("/org/bluez/hci0")
-        ad_mgr.RegisterAdvertisement(obj_name)
-        
+        # Replies arrive through the event loop; startup returns at once.
+        self._ad_mgr = BleAdManager("/org/bluez/hci0", self)
+        print("Registering {0}...".format(obj_name))
+        call = self._ad_mgr.RegisterAdvertisement(obj_name)
+        call.finished.connect(
+            lambda args: print("Registered {0} in {1:.1f} ms".format(
+                obj_name, call.latency * 1000)))
+        call.failed.connect(
+            lambda name, message: print("Registering {0} failed: {1}".format(
+                obj_name, message)))
+
     def shutdown(self):
         print("Shutdown")
         self._app.quit()
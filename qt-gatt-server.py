@@ -0,0 +1,812 @@
+#!/usr/bin/env python3
+# SPDX-License-Identifier: LGPL-2.1-or-later
+"""
+GATT server on QtDBus.
+
+The Heart Rate, Battery and Test services of stock-gatt-server.py, built
+from QObjects exported through QDBusAbstractAdaptor subclasses, so method
+dispatch and marshalling happen in QtDBus. Values are QByteArrays from
+ReadValue to the wire, and notifications are PropertiesChanged signals
+built with QDBusMessage.createSignal(). Subclasses override ReadValue,
+WriteValue, StartNotify and StopNotify as they do in stock-gatt-server.py
+and raise the same exceptions.
+
+QtDBus can only marshal a map whose value type is registered with it, and
+PyQt5 has no qDBusRegisterMetaType() to register one. The a{sa{sv}}
+values of the GetManagedObjects reply use InterfaceList, which
+QtBluetooth's BlueZ backend registers the first time it talks to
+bluetoothd; register_types() has it do so, and must be called before an
+Application is created.
+"""
+
+import abc
+import argparse
+import logging
+import sys
+import time
+
+from random import randint
+
+from PyQt5.QtBluetooth import QBluetoothLocalDevice
+from PyQt5.QtCore import (Q_CLASSINFO, QByteArray, QCoreApplication,
+                          QMetaType, QObject, QTimer, pyqtProperty, pyqtSlot)
+from PyQt5.QtDBus import (QDBusAbstractAdaptor, QDBusAbstractInterface,
+                          QDBusArgument, QDBusConnection, QDBusMessage,
+                          QDBusObjectPath, QDBusPendingCallWatcher,
+                          QDBusPendingReply)
+
+import ringlog
+
+BLUEZ_SERVICE_NAME = 'org.bluez'
+GATT_MANAGER_IFACE = 'org.bluez.GattManager1'
+DBUS_OM_IFACE =      'org.freedesktop.DBus.ObjectManager'
+DBUS_PROP_IFACE =    'org.freedesktop.DBus.Properties'
+
+GATT_SERVICE_IFACE = 'org.bluez.GattService1'
+GATT_CHRC_IFACE =    'org.bluez.GattCharacteristic1'
+GATT_DESC_IFACE =    'org.bluez.GattDescriptor1'
+
+log = logging.getLogger('qt-gatt-server')
+
+
+class DBusException(Exception):
+    _dbus_error_name = 'org.bluez.Error.Failed'
+
+
+class InvalidArgsException(DBusException):
+    _dbus_error_name = 'org.freedesktop.DBus.Error.InvalidArgs'
+
+class NotSupportedException(DBusException):
+    _dbus_error_name = 'org.bluez.Error.NotSupported'
+
+class NotPermittedException(DBusException):
+    _dbus_error_name = 'org.bluez.Error.NotPermitted'
+
+class InvalidValueLengthException(DBusException):
+    _dbus_error_name = 'org.bluez.Error.InvalidValueLength'
+
+class FailedException(DBusException):
+    _dbus_error_name = 'org.bluez.Error.Failed'
+
+class InvalidOffsetException(DBusException):
+    _dbus_error_name = 'org.bluez.Error.InvalidOffset'
+
+
+def object_path_array(paths):
+    # QDBusArgument(list, id) crashes on object paths; build it by hand.
+    arg = QDBusArgument()
+    arg.beginArray(QMetaType.type('QDBusObjectPath'))
+    for path in paths:
+        arg.add(QDBusObjectPath(path))
+    arg.endArray()
+    return arg
+
+
+def string_array(strings):
+    # A plain list would go out as av.
+    return QDBusArgument(list(strings), QMetaType.QStringList)
+
+
+def register_types():
+    """
+    Get QtBluetooth to register InterfaceList (a{sa{sv}}) with QtDBus.
+    This makes a blocking call to bluetoothd, so it belongs at startup,
+    before anything is exported or registered with bluetoothd.
+    """
+    if not QMetaType.type('InterfaceList'):
+        QBluetoothLocalDevice.allDevices()
+    if not QMetaType.type('InterfaceList'):
+        raise RuntimeError('QtBluetooth did not register InterfaceList')
+
+
+def dispatch(obj, message, handler, *args):
+    """
+    Call handler(*args) for an adaptor slot that was passed message. An
+    exception raised by the handler is sent back as the error reply, named
+    after its DBusException class or org.bluez.Error.Failed for any other
+    exception, and None is returned.
+    """
+    try:
+        return handler(*args)
+    except Exception as e:
+        name = getattr(e, '_dbus_error_name', DBusException._dbus_error_name)
+        if not isinstance(e, DBusException):
+            log.exception('%s failed', message.member())
+        message.setDelayedReply(True)
+        obj.connection.send(message.createErrorReply(name, str(e)))
+        return None
+
+
+class ObjectManagerAdaptor(QDBusAbstractAdaptor):
+    Q_CLASSINFO('D-Bus Interface', DBUS_OM_IFACE)
+    Q_CLASSINFO('D-Bus Introspection', ''
+                '  <interface name="org.freedesktop.DBus.ObjectManager">\n'
+                '    <method name="GetManagedObjects">\n'
+                '      <arg direction="out" type="a{oa{sa{sv}}}"'
+                ' name="objects"/>\n'
+                '    </method>\n'
+                '  </interface>\n'
+                '')
+
+    @pyqtSlot(QDBusMessage)
+    def GetManagedObjects(self, message):
+        app = self.parent()
+        message.setDelayedReply(True)
+        app.connection.send(message.createReply([app.managed_objects()]))
+
+
+class ServiceAdaptor(QDBusAbstractAdaptor):
+    Q_CLASSINFO('D-Bus Interface', GATT_SERVICE_IFACE)
+
+    @pyqtProperty(str)
+    def UUID(self):
+        return self.parent().uuid
+
+    @pyqtProperty(bool)
+    def Primary(self):
+        return self.parent().primary
+
+
+class CharacteristicAdaptor(QDBusAbstractAdaptor):
+    Q_CLASSINFO('D-Bus Interface', GATT_CHRC_IFACE)
+
+    @pyqtProperty(str)
+    def UUID(self):
+        return self.parent().uuid
+
+    @pyqtProperty(QDBusObjectPath)
+    def Service(self):
+        return QDBusObjectPath(self.parent().service.path)
+
+    @pyqtProperty('QStringList')
+    def Flags(self):
+        return self.parent().flags
+
+    @pyqtSlot('QVariantMap', QDBusMessage, result='QByteArray')
+    def ReadValue(self, options, message):
+        chrc = self.parent()
+        value = dispatch(chrc, message, chrc.ReadValue, options)
+        return QByteArray() if value is None else QByteArray(value)
+
+    @pyqtSlot('QByteArray', 'QVariantMap', QDBusMessage)
+    def WriteValue(self, value, options, message):
+        chrc = self.parent()
+        dispatch(chrc, message, chrc.WriteValue, value, options)
+
+    @pyqtSlot(QDBusMessage)
+    def StartNotify(self, message):
+        chrc = self.parent()
+        dispatch(chrc, message, chrc.StartNotify)
+
+    @pyqtSlot(QDBusMessage)
+    def StopNotify(self, message):
+        chrc = self.parent()
+        dispatch(chrc, message, chrc.StopNotify)
+
+
+class DescriptorAdaptor(QDBusAbstractAdaptor):
+    Q_CLASSINFO('D-Bus Interface', GATT_DESC_IFACE)
+
+    @pyqtProperty(str)
+    def UUID(self):
+        return self.parent().uuid
+
+    @pyqtProperty(QDBusObjectPath)
+    def Characteristic(self):
+        return QDBusObjectPath(self.parent().chrc.path)
+
+    @pyqtProperty('QStringList')
+    def Flags(self):
+        return self.parent().flags
+
+    @pyqtSlot('QVariantMap', QDBusMessage, result='QByteArray')
+    def ReadValue(self, options, message):
+        desc = self.parent()
+        value = dispatch(desc, message, desc.ReadValue, options)
+        return QByteArray() if value is None else QByteArray(value)
+
+    @pyqtSlot('QByteArray', 'QVariantMap', QDBusMessage)
+    def WriteValue(self, value, options, message):
+        desc = self.parent()
+        dispatch(desc, message, desc.WriteValue, value, options)
+
+
+class ExportedObject(QObject):
+    """
+    An object exported at path on connection through an instance of
+    adaptor_class, created as its child.
+    """
+    adaptor_class = None
+
+    def __init__(self, connection, path):
+        super().__init__()
+        self.connection = connection
+        self.path = path
+        self.adaptor = self.adaptor_class(self)
+        if not connection.registerObject(path, self):
+            raise RuntimeError('Could not export ' + path)
+
+    def get_path(self):
+        return self.path
+
+
+class GattObjectType(type(QObject), abc.ABCMeta):
+    pass
+
+
+class GattObject(ExportedObject, metaclass=GattObjectType):
+    """
+    An ExportedObject that is part of the GATT tree GetManagedObjects
+    reports.
+    """
+    def get_children(self):
+        return []
+
+    @abc.abstractmethod
+    def get_properties(self):
+        """
+        Return {interface: {name: value}} with the values marshallable by
+        QtDBus, for GetManagedObjects.
+        """
+
+
+class Application(QObject):
+    """
+    org.bluez.GattApplication1 interface implementation
+    """
+    def __init__(self, connection, populate=True):
+        super().__init__()
+        self.path = '/'
+        self.connection = connection
+        self.services = []
+        self.adaptor = ObjectManagerAdaptor(self)
+        self._interface_list = QMetaType.type('InterfaceList')
+        if not self._interface_list:
+            raise RuntimeError('InterfaceList is not registered, '
+                               'call register_types() first')
+        if not connection.registerObject(self.path, self):
+            raise RuntimeError('Could not export ' + self.path)
+        if not populate:
+            return
+        self.add_service(HeartRateService(connection, 0))
+        self.add_service(BatteryService(connection, 1))
+        self.add_service(TestService(connection, 2))
+
+    def get_path(self):
+        return self.path
+
+    def add_service(self, service):
+        self.services.append(service)
+
+    def managed_objects(self):
+        arg = QDBusArgument()
+        arg.beginMap(QMetaType.type('QDBusObjectPath'), self._interface_list)
+        for service in self.services:
+            for obj in self._subtree(service):
+                arg.beginMapEntry()
+                arg.add(QDBusObjectPath(obj.get_path()))
+                interfaces = QDBusArgument()
+                interfaces.beginMap(QMetaType.QString, QMetaType.QVariantMap)
+                for interface, properties in obj.get_properties().items():
+                    interfaces.beginMapEntry()
+                    interfaces.add(interface, QMetaType.QString)
+                    interfaces.add(properties, QMetaType.QVariantMap)
+                    interfaces.endMapEntry()
+                interfaces.endMap()
+                arg.add(interfaces)
+                arg.endMapEntry()
+        arg.endMap()
+        return arg
+
+    def _subtree(self, obj):
+        yield obj
+        for child in obj.get_children():
+            for o in self._subtree(child):
+                yield o
+
+
+class Service(GattObject):
+    """
+    org.bluez.GattService1 interface implementation
+    """
+    PATH_BASE = '/org/bluez/example/service'
+    adaptor_class = ServiceAdaptor
+
+    def __init__(self, connection, index, uuid, primary):
+        self.uuid = uuid
+        self.primary = primary
+        self.characteristics = []
+        super().__init__(connection, self.PATH_BASE + str(index))
+
+    def get_properties(self):
+        return {
+                GATT_SERVICE_IFACE: {
+                        'UUID': self.uuid,
+                        'Primary': self.primary,
+                        'Characteristics': object_path_array(
+                                c.path for c in self.characteristics)
+                }
+        }
+
+    def get_children(self):
+        return self.characteristics
+
+    def add_characteristic(self, characteristic):
+        self.characteristics.append(characteristic)
+
+
+class Characteristic(GattObject):
+    """
+    org.bluez.GattCharacteristic1 interface implementation
+
+    ReadValue may return a QByteArray or anything QByteArray() takes.
+    WriteValue is given a QByteArray.
+    """
+    adaptor_class = CharacteristicAdaptor
+
+    def __init__(self, connection, index, uuid, flags, service):
+        self.uuid = uuid
+        self.flags = flags
+        self.service = service
+        self.descriptors = []
+        # Shared by every notification; QtDBus only reads it.
+        self._invalidated = string_array([])
+        super().__init__(connection, service.path + '/char' + str(index))
+
+    def get_properties(self):
+        return {
+                GATT_CHRC_IFACE: {
+                        'Service': QDBusObjectPath(self.service.path),
+                        'UUID': self.uuid,
+                        'Flags': string_array(self.flags),
+                        'Descriptors': object_path_array(
+                                d.path for d in self.descriptors)
+                }
+        }
+
+    def get_children(self):
+        return self.descriptors
+
+    def add_descriptor(self, descriptor):
+        self.descriptors.append(descriptor)
+
+    def emit_notification(self, value):
+        signal = QDBusMessage.createSignal(self.path, DBUS_PROP_IFACE,
+                                           'PropertiesChanged')
+        signal.setArguments([GATT_CHRC_IFACE, {'Value': QByteArray(value)},
+                             self._invalidated])
+        self.connection.send(signal)
+
+    def ReadValue(self, options):
+        log.debug('Default ReadValue called, returning error')
+        raise NotSupportedException()
+
+    def WriteValue(self, value, options):
+        log.debug('Default WriteValue called, returning error')
+        raise NotSupportedException()
+
+    def StartNotify(self):
+        log.debug('Default StartNotify called, returning error')
+        raise NotSupportedException()
+
+    def StopNotify(self):
+        log.debug('Default StopNotify called, returning error')
+        raise NotSupportedException()
+
+
+class Descriptor(GattObject):
+    """
+    org.bluez.GattDescriptor1 interface implementation
+    """
+    adaptor_class = DescriptorAdaptor
+
+    def __init__(self, connection, index, uuid, flags, characteristic):
+        self.uuid = uuid
+        self.flags = flags
+        self.chrc = characteristic
+        super().__init__(connection, characteristic.path + '/desc' + str(index))
+
+    def get_properties(self):
+        return {
+                GATT_DESC_IFACE: {
+                        'Characteristic': QDBusObjectPath(self.chrc.path),
+                        'UUID': self.uuid,
+                        'Flags': string_array(self.flags),
+                }
+        }
+
+    def ReadValue(self, options):
+        log.debug('Default ReadValue called, returning error')
+        raise NotSupportedException()
+
+    def WriteValue(self, value, options):
+        log.debug('Default WriteValue called, returning error')
+        raise NotSupportedException()
+
+
+def read_at(value, options):
+    offset = int(options.get('offset', 0))
+    if offset > len(value):
+        raise InvalidOffsetException()
+    return value.mid(offset)
+
+
+def write_at(value, data, options):
+    offset = int(options.get('offset', 0))
+    if offset > len(value):
+        raise InvalidOffsetException()
+    return value.left(offset) + data
+
+
+class HeartRateService(Service):
+    """
+    Fake Heart Rate Service that simulates a fake heart beat and control point
+    behavior.
+
+    """
+    HR_UUID = '0000180d-0000-1000-8000-00805f9b34fb'
+
+    def __init__(self, connection, index):
+        super().__init__(connection, index, self.HR_UUID, True)
+        self.add_characteristic(HeartRateMeasurementChrc(connection, 0, self))
+        self.add_characteristic(BodySensorLocationChrc(connection, 1, self))
+        self.add_characteristic(HeartRateControlPointChrc(connection, 2, self))
+        self.energy_expended = 0
+
+
+class HeartRateMeasurementChrc(Characteristic):
+    HR_MSRMT_UUID = '00002a37-0000-1000-8000-00805f9b34fb'
+
+    def __init__(self, connection, index, service):
+        super().__init__(connection, index, self.HR_MSRMT_UUID, ['notify'],
+                         service)
+        self.hr_ee_count = 0
+        self.timer = QTimer(self)
+        self.timer.setInterval(1000)
+        self.timer.timeout.connect(self.hr_msrmt_cb)
+
+    def hr_msrmt_cb(self):
+        value = bytearray((0x06, randint(90, 130)))
+
+        if self.hr_ee_count % 10 == 0:
+            value[0] |= 0x08
+            value += self.service.energy_expended.to_bytes(2, 'little')
+
+        self.service.energy_expended = \
+                min(0xffff, self.service.energy_expended + 1)
+        self.hr_ee_count += 1
+
+        log.debug('Updating value: %r', value)
+
+        self.emit_notification(bytes(value))
+
+    def StartNotify(self):
+        if self.timer.isActive():
+            log.info('Already notifying, nothing to do')
+            return
+        self.timer.start()
+
+    def StopNotify(self):
+        if not self.timer.isActive():
+            log.info('Not notifying, nothing to do')
+            return
+        self.timer.stop()
+
+
+class BodySensorLocationChrc(Characteristic):
+    BODY_SNSR_LOC_UUID = '00002a38-0000-1000-8000-00805f9b34fb'
+
+    def __init__(self, connection, index, service):
+        super().__init__(connection, index, self.BODY_SNSR_LOC_UUID,
+                         ['read'], service)
+
+    def ReadValue(self, options):
+        # Return 'Chest' as the sensor location.
+        return b'\x01'
+
+
+class HeartRateControlPointChrc(Characteristic):
+    HR_CTRL_PT_UUID = '00002a39-0000-1000-8000-00805f9b34fb'
+
+    def __init__(self, connection, index, service):
+        super().__init__(connection, index, self.HR_CTRL_PT_UUID, ['write'],
+                         service)
+
+    def WriteValue(self, value, options):
+        log.debug('Heart Rate Control Point WriteValue called')
+
+        if len(value) != 1:
+            raise InvalidValueLengthException()
+
+        byte = bytes(value)[0]
+        log.debug('Control Point value: %r', byte)
+
+        if byte != 1:
+            raise FailedException("0x80")
+
+        log.info('Energy Expended field reset!')
+        self.service.energy_expended = 0
+
+
+class BatteryService(Service):
+    """
+    Fake Battery service that emulates a draining battery.
+
+    """
+    BATTERY_UUID = '180f'
+
+    def __init__(self, connection, index):
+        super().__init__(connection, index, self.BATTERY_UUID, True)
+        self.add_characteristic(
+                BatteryLevelCharacteristic(connection, 0, self))
+
+
+class BatteryLevelCharacteristic(Characteristic):
+    """
+    Fake Battery Level characteristic. The battery level is drained by 2 points
+    every 5 seconds.
+
+    """
+    BATTERY_LVL_UUID = '2a19'
+
+    def __init__(self, connection, index, service):
+        super().__init__(connection, index, self.BATTERY_LVL_UUID,
+                         ['read', 'notify'], service)
+        self.notifying = False
+        self.battery_lvl = 100
+        self.timer = QTimer(self)
+        self.timer.timeout.connect(self.drain_battery)
+        self.timer.start(5000)
+
+    def notify_battery_level(self):
+        if not self.notifying:
+            return
+        self.emit_notification(bytes([self.battery_lvl]))
+
+    def drain_battery(self):
+        if not self.notifying:
+            return
+        self.battery_lvl = max(0, self.battery_lvl - 2)
+        log.debug('Battery Level drained: %r', self.battery_lvl)
+        self.notify_battery_level()
+
+    def ReadValue(self, options):
+        log.debug('Battery Level read: %r', self.battery_lvl)
+        return bytes([self.battery_lvl])
+
+    def StartNotify(self):
+        if self.notifying:
+            log.info('Already notifying, nothing to do')
+            return
+
+        self.notifying = True
+        self.notify_battery_level()
+
+    def StopNotify(self):
+        if not self.notifying:
+            log.info('Not notifying, nothing to do')
+            return
+
+        self.notifying = False
+
+
+class TestService(Service):
+    """
+    Dummy test service that provides a characteristic and descriptors that
+    exercise various API functionality.
+
+    """
+    TEST_SVC_UUID = '12345678-1234-5678-1234-56789abcdef0'
+
+    def __init__(self, connection, index):
+        super().__init__(connection, index, self.TEST_SVC_UUID, True)
+        self.add_characteristic(TestCharacteristic(connection, 0, self))
+        self.add_characteristic(TestEncryptCharacteristic(connection, 1, self))
+        self.add_characteristic(TestSecureCharacteristic(connection, 2, self))
+
+
+class TestCharacteristic(Characteristic):
+    """
+    Dummy test characteristic. Allows writing arbitrary bytes to its value, and
+    contains "extended properties", as well as a test descriptor.
+
+    """
+    TEST_CHRC_UUID = '12345678-1234-5678-1234-56789abcdef1'
+
+    def __init__(self, connection, index, service):
+        super().__init__(connection, index, self.TEST_CHRC_UUID,
+                         ['read', 'write', 'writable-auxiliaries'], service)
+        self.value = QByteArray()
+        self.add_descriptor(TestDescriptor(connection, 0, self))
+        self.add_descriptor(
+                CharacteristicUserDescriptionDescriptor(connection, 1, self))
+
+    def ReadValue(self, options):
+        log.debug('TestCharacteristic Read: %r', self.value)
+        return read_at(self.value, options)
+
+    def WriteValue(self, value, options):
+        log.debug('TestCharacteristic Write: %r', value)
+        self.value = write_at(self.value, value, options)
+
+
+class TestDescriptor(Descriptor):
+    """
+    Dummy test descriptor. Returns a static value.
+
+    """
+    TEST_DESC_UUID = '12345678-1234-5678-1234-56789abcdef2'
+
+    def __init__(self, connection, index, characteristic):
+        super().__init__(connection, index, self.TEST_DESC_UUID,
+                         ['read', 'write'], characteristic)
+
+    def ReadValue(self, options):
+        return b'Test'
+
+
+class CharacteristicUserDescriptionDescriptor(Descriptor):
+    """
+    Writable CUD descriptor.
+
+    """
+    CUD_UUID = '2901'
+
+    def __init__(self, connection, index, characteristic):
+        self.writable = 'writable-auxiliaries' in characteristic.flags
+        self.value = QByteArray(b'This is a characteristic for testing')
+        super().__init__(connection, index, self.CUD_UUID,
+                         ['read', 'write'], characteristic)
+
+    def ReadValue(self, options):
+        return read_at(self.value, options)
+
+    def WriteValue(self, value, options):
+        if not self.writable:
+            raise NotPermittedException()
+        self.value = write_at(self.value, value, options)
+
+
+class TestEncryptCharacteristic(Characteristic):
+    """
+    Dummy test characteristic requiring encryption.
+
+    """
+    TEST_CHRC_UUID = '12345678-1234-5678-1234-56789abcdef3'
+
+    def __init__(self, connection, index, service):
+        super().__init__(connection, index, self.TEST_CHRC_UUID,
+                         ['encrypt-read', 'encrypt-write'], service)
+        self.value = QByteArray()
+        self.add_descriptor(TestEncryptDescriptor(connection, 2, self))
+        self.add_descriptor(
+                CharacteristicUserDescriptionDescriptor(connection, 3, self))
+
+    def ReadValue(self, options):
+        log.debug('TestEncryptCharacteristic Read: %r', self.value)
+        return read_at(self.value, options)
+
+    def WriteValue(self, value, options):
+        log.debug('TestEncryptCharacteristic Write: %r', value)
+        self.value = write_at(self.value, value, options)
+
+
+class TestEncryptDescriptor(Descriptor):
+    """
+    Dummy test descriptor requiring encryption. Returns a static value.
+
+    """
+    TEST_DESC_UUID = '12345678-1234-5678-1234-56789abcdef4'
+
+    def __init__(self, connection, index, characteristic):
+        super().__init__(connection, index, self.TEST_DESC_UUID,
+                         ['encrypt-read', 'encrypt-write'], characteristic)
+
+    def ReadValue(self, options):
+        return b'Test'
+
+
+class TestSecureCharacteristic(Characteristic):
+    """
+    Dummy test characteristic requiring secure connection.
+
+    """
+    TEST_CHRC_UUID = '12345678-1234-5678-1234-56789abcdef5'
+
+    def __init__(self, connection, index, service):
+        super().__init__(connection, index, self.TEST_CHRC_UUID,
+                         ['secure-read', 'secure-write'], service)
+        self.value = QByteArray()
+        self.add_descriptor(TestSecureDescriptor(connection, 2, self))
+        self.add_descriptor(
+                CharacteristicUserDescriptionDescriptor(connection, 3, self))
+
+    def ReadValue(self, options):
+        log.debug('TestSecureCharacteristic Read: %r', self.value)
+        return read_at(self.value, options)
+
+    def WriteValue(self, value, options):
+        log.debug('TestSecureCharacteristic Write: %r', value)
+        self.value = write_at(self.value, value, options)
+
+
+class TestSecureDescriptor(Descriptor):
+    """
+    Dummy test descriptor requiring secure connection. Returns a static value.
+
+    """
+    TEST_DESC_UUID = '12345678-1234-5678-1234-56789abcdef6'
+
+    def __init__(self, connection, index, characteristic):
+        super().__init__(connection, index, self.TEST_DESC_UUID,
+                         ['secure-read', 'secure-write'], characteristic)
+
+    def ReadValue(self, options):
+        return b'Test'
+
+
+class GattManager(QDBusAbstractInterface):
+    """
+    org.bluez.GattManager1 on one adapter. Calls return a
+    QDBusPendingCallWatcher at once; its finished signal carries the
+    reply.
+    """
+    def __init__(self, adapter, connection, parent=None):
+        super().__init__(BLUEZ_SERVICE_NAME, adapter, GATT_MANAGER_IFACE,
+                         connection, parent)
+
+    def RegisterApplication(self, app):
+        return QDBusPendingCallWatcher(
+                self.asyncCall('RegisterApplication',
+                               QDBusObjectPath(app.get_path()), {}),
+                self)
+
+    def UnregisterApplication(self, app):
+        return QDBusPendingCallWatcher(
+                self.asyncCall('UnregisterApplication',
+                               QDBusObjectPath(app.get_path())),
+                self)
+
+
+def main(adapter='/org/bluez/hci0', log_level='INFO'):
+    ringlog.setup(log_level)
+
+    qapp = QCoreApplication(sys.argv)
+
+    connection = QDBusConnection.systemBus()
+    if not connection.isConnected():
+        sys.exit('Cannot connect to the system bus.')
+    connection.registerService('com.github.maldata.testservice1')
+
+    register_types()
+    app = Application(connection)
+    manager = GattManager(adapter, connection)
+
+    log.info('Registering GATT application on %s...', adapter)
+    start = time.perf_counter()
+
+    def registered(watcher):
+        reply = QDBusPendingReply(watcher)
+        if reply.isError():
+            log.error('Failed to register application: %s',
+                      reply.error().message())
+            qapp.exit(1)
+            return
+        log.info('GATT application registered in %.1f ms',
+                 (time.perf_counter() - start) * 1000)
+
+    manager.RegisterApplication(app).finished.connect(registered)
+
+    sys.exit(qapp.exec_())
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--adapter', default='/org/bluez/hci0',
+                        help="adapter to register on " +
+                        "(default: /org/bluez/hci0)")
+    parser.add_argument('--log-level', default='INFO',
+                        choices=['DEBUG', 'INFO', 'WARNING', 'ERROR'],
+                        help="(default: INFO)")
+    args = parser.parse_args()
+
+    main(args.adapter, args.log_level)
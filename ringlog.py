@@ -0,0 +1,116 @@
+# SPDX-License-Identifier: LGPL-2.1-or-later
+"""
+Non-blocking logging for the example servers.
+
+Log records are appended to a fixed-size ring buffer and written out by a
+background thread, so the GLib mainloop never waits on a terminal or a
+file. Call sites pass arguments instead of building strings
+(log.debug('Value: %r', value)), so a disabled level costs one level
+check. Enabled records are formatted on the calling thread, as
+logging.handlers.QueueHandler does, because the arguments may change or
+belong to another thread by the time the buffer is written out. When the
+buffer is full the oldest records are dropped; RingBufferHandler.dropped
+counts them and the flusher reports them with the next records it writes.
+"""
+
+import atexit
+import collections
+import copy
+import logging
+import sys
+import threading
+
+
+class RingBufferHandler(logging.Handler):
+    def __init__(self, target, capacity=4096, interval=0.2):
+        logging.Handler.__init__(self)
+        self.target = target
+        self.interval = interval
+        self.records = collections.deque(maxlen=capacity)
+        self.dropped = 0
+        self.reported = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='ringlog')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def handle(self, record):
+        rv = self.filter(record)
+        if not rv:
+            return False
+        if isinstance(rv, logging.LogRecord):
+            record = rv
+        # No handler lock: deque.append is atomic and the flusher thread
+        # only ever pops from the other end.
+        record = self.prepare(record)
+        if len(self.records) == self.records.maxlen:
+            self.dropped += 1
+        self.records.append(record)
+        return rv
+
+    def prepare(self, record):
+        """
+        Return a copy of record with the message and any traceback already
+        formatted, as QueueHandler.prepare() does.
+        """
+        msg = self.format(record)
+        record = copy.copy(record)
+        record.message = msg
+        record.msg = msg
+        record.args = None
+        record.exc_info = None
+        record.exc_text = None
+        record.stack_info = None
+        return record
+
+    def emit(self, record):
+        self.handle(record)
+
+    def flush(self):
+        with self.lock:
+            records = self.records
+            target = self.target
+            dropped = self.dropped
+            if dropped != self.reported:
+                target.handle(logging.LogRecord(
+                        'ringlog', logging.WARNING, __file__, 0,
+                        '%d log records dropped (buffer full)',
+                        (dropped - self.reported,), None))
+                self.reported = dropped
+            while True:
+                try:
+                    record = records.popleft()
+                except IndexError:
+                    break
+                target.handle(record)
+            target.flush()
+
+    def close(self):
+        # Stop the flusher first, so it is not writing out records while
+        # the last ones are drained here.
+        self._stop.set()
+        if self._thread is not threading.current_thread():
+            self._thread.join()
+        self.flush()
+        logging.Handler.close(self)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            if self.records or self.dropped != self.reported:
+                self.flush()
+
+
+def setup(level=logging.INFO, capacity=4096, interval=0.2, stream=None):
+    """
+    Send all logging through a RingBufferHandler writing to stream
+    (stdout by default) and return the handler.
+    """
+    target = logging.StreamHandler(stream or sys.stdout)
+    target.setFormatter(logging.Formatter('%(message)s'))
+    handler = RingBufferHandler(target, capacity, interval)
+
+    root = logging.getLogger()
+    root.addHandler(handler)
+    root.setLevel(level)
+    atexit.register(handler.close)
+    return handler
@@ -0,0 +1,191 @@
+# SPDX-License-Identifier: LGPL-2.1-or-later
+"""
+Bounded stream of BlueZ discovery results.
+
+Scanner listens for Device1 InterfacesAdded, InterfacesRemoved and
+PropertiesChanged signals from org.bluez. The PropertiesChanged match is
+filtered on the interface argument by the bus daemon, so other objects'
+changes never reach the process. Every RSSI reading goes into a
+fixed-size ring buffer for its device. An advertisement whose
+ManufacturerData and ServiceData are the same as the last one queued,
+within dedup_window seconds, counts as a duplicate and is not queued
+again. A device has at most one entry in the queue however many
+advertisements arrive before the next pull(), and the least recently seen
+devices are forgotten beyond max_devices. Memory therefore stays bounded
+at any advertisement rate.
+
+Consumers call pull() from the mainloop thread to take the devices that
+changed since the previous pull, oldest first.
+"""
+
+import collections
+import time
+
+import dbus
+
+BLUEZ_SERVICE_NAME = 'org.bluez'
+ADAPTER_IFACE = 'org.bluez.Adapter1'
+DEVICE_IFACE = 'org.bluez.Device1'
+DBUS_OM_IFACE = 'org.freedesktop.DBus.ObjectManager'
+DBUS_PROP_IFACE = 'org.freedesktop.DBus.Properties'
+
+ScanResult = collections.namedtuple('ScanResult', [
+        'path', 'address', 'name', 'rssi', 'manufacturer_data',
+        'service_data', 'last_seen', 'advertisements'])
+
+
+class DeviceTrack(object):
+    __slots__ = ('path', 'address', 'name', 'rssi', 'manufacturer_data',
+                 'service_data', 'last_seen', 'last_queued',
+                 'advertisements')
+
+    def __init__(self, path, history):
+        self.path = path
+        self.address = None
+        self.name = None
+        self.rssi = collections.deque(maxlen=history)
+        self.manufacturer_data = None
+        self.service_data = None
+        self.last_seen = 0.0
+        self.last_queued = None
+        self.advertisements = 0
+
+    def result(self):
+        return ScanResult(self.path, self.address, self.name,
+                          self.rssi[-1][1] if self.rssi else None,
+                          self.manufacturer_data, self.service_data,
+                          self.last_seen, self.advertisements)
+
+
+def _bytes_dict(value):
+    # dbus.Array of dbus.Byte to bytes, so values compare and hash cheaply.
+    return dict((k if isinstance(k, int) else str(k), bytes(bytearray(v)))
+                for k, v in value.items())
+
+
+class Scanner(object):
+    """
+    stats counts 'advertisements' received, 'duplicates' not queued,
+    'coalesced' ones merged into a queue entry that was still waiting and
+    'evicted' devices.
+    """
+    def __init__(self, bus, history=32, max_devices=4096, dedup_window=1.0):
+        self.bus = bus
+        self.history = history
+        self.max_devices = max_devices
+        self.dedup_window = dedup_window
+        self.devices = collections.OrderedDict()
+        self.queue = collections.OrderedDict()
+        self.stats = collections.Counter()
+        self._matches = []
+
+    def start(self, cache=None):
+        """
+        Start following the bus. Devices already in cache (a
+        bluezcache.ObjectCache) are taken in as if just discovered.
+        """
+        add = self.bus.add_signal_receiver
+        self._matches = [
+                add(self._interfaces_added, 'InterfacesAdded', DBUS_OM_IFACE,
+                    BLUEZ_SERVICE_NAME),
+                add(self._interfaces_removed, 'InterfacesRemoved',
+                    DBUS_OM_IFACE, BLUEZ_SERVICE_NAME),
+                add(self._properties_changed, 'PropertiesChanged',
+                    DBUS_PROP_IFACE, BLUEZ_SERVICE_NAME, arg0=DEVICE_IFACE,
+                    path_keyword='path'),
+        ]
+        if cache is not None:
+            for path in cache.paths(DEVICE_IFACE):
+                self.update(path, cache.properties(path, DEVICE_IFACE))
+
+    def stop(self):
+        for match in self._matches:
+            match.remove()
+        self._matches = []
+
+    def start_discovery(self, adapter, error_handler=None):
+        adapter = dbus.Interface(self.bus.get_object(BLUEZ_SERVICE_NAME,
+                                                     adapter),
+                                 ADAPTER_IFACE)
+        adapter.StartDiscovery(reply_handler=lambda: None,
+                               error_handler=error_handler or (lambda e: None))
+
+    def pull(self, max_count=256):
+        """
+        Return up to max_count ScanResults for the devices that changed
+        since they were last pulled, oldest change first.
+        """
+        results = []
+        queue = self.queue
+        devices = self.devices
+        while queue and len(results) < max_count:
+            path, _ = queue.popitem(last=False)
+            track = devices.get(path)
+            if track is not None:
+                results.append(track.result())
+        return results
+
+    def update(self, path, properties, now=None):
+        """
+        Take in one advertisement (the Device1 properties that came with
+        it) for the device at path.
+        """
+        if now is None:
+            now = time.monotonic()
+        stats = self.stats
+        stats['advertisements'] += 1
+
+        track = self.devices.get(path)
+        if track is None:
+            track = self.devices[path] = DeviceTrack(path, self.history)
+            if len(self.devices) > self.max_devices:
+                evicted, _ = self.devices.popitem(last=False)
+                self.queue.pop(evicted, None)
+                stats['evicted'] += 1
+        else:
+            self.devices.move_to_end(path)
+
+        track.last_seen = now
+        track.advertisements += 1
+        data_changed = False
+        for name, value in properties.items():
+            if name == 'RSSI':
+                track.rssi.append((now, int(value)))
+            elif name == 'ManufacturerData':
+                value = _bytes_dict(value)
+                data_changed |= value != track.manufacturer_data
+                track.manufacturer_data = value
+            elif name == 'ServiceData':
+                value = _bytes_dict(value)
+                data_changed |= value != track.service_data
+                track.service_data = value
+            elif name == 'Address':
+                track.address = str(value)
+            elif name == 'Name':
+                track.name = str(value)
+
+        if path in self.queue:
+            stats['coalesced'] += 1
+            return
+        if (not data_changed and track.last_queued is not None and
+                now - track.last_queued < self.dedup_window):
+            stats['duplicates'] += 1
+            return
+        track.last_queued = now
+        self.queue[path] = None
+
+    def forget(self, path):
+        self.devices.pop(path, None)
+        self.queue.pop(path, None)
+
+    def _interfaces_added(self, path, interfaces):
+        properties = interfaces.get(DEVICE_IFACE)
+        if properties is not None:
+            self.update(str(path), properties)
+
+    def _interfaces_removed(self, path, interfaces):
+        if DEVICE_IFACE in interfaces:
+            self.forget(str(path))
+
+    def _properties_changed(self, interface, changed, invalidated, path=None):
+        self.update(str(path), changed)
@@ -1,13 +1,14 @@
 #!/usr/bin/python
 # SPDX-License-Identifier: LGPL-2.1-or-later
 
-from __future__ import print_function
-
 import argparse
+import collections
+import contextlib
 import dbus
 import dbus.exceptions
 import dbus.mainloop.glib
 import dbus.service
+import logging
 import time
 import threading
 
@@ -16,8 +17,16 @@ try:
 except ImportError:
     import gobject as GObject  # python2
 
+import backends
+import bluezcache
+import metrics
+import ringlog
+import scanner
+
 mainloop = None
 
+log = logging.getLogger('stock-example')
+
 BLUEZ_SERVICE_NAME = 'org.bluez'
 LE_ADVERTISING_MANAGER_IFACE = 'org.bluez.LEAdvertisingManager1'
 DBUS_OM_IFACE = 'org.freedesktop.DBus.ObjectManager'
@@ -46,95 +55,201 @@ class FailedException(dbus.exceptions.DBusException):
     _dbus_error_name = 'org.bluez.Error.Failed'
 
 
-class Advertisement(dbus.service.Object):
+def _byte_arrays(signature):
+    def convert(value):
+        return dbus.Dictionary(
+                dict((k, dbus.Array(v, signature='y'))
+                     for k, v in value.items()),
+                signature=signature)
+    return convert
+
+
+class AdvertisementField(object):
+    """
+    One LEAdvertisement1 property of an Advertisement, kept in its D-Bus
+    type.
+
+    Assigning to the attribute converts the value once and stores it in
+    the property dict that GetAll returns. If the value changed,
+    PropertiesChanged is emitted, or an invalidation if it was set to None.
+    """
+    def __init__(self, name, to_dbus, from_dbus=None):
+        self.name = name
+        self.to_dbus = to_dbus
+        self.from_dbus = from_dbus
+
+    def __get__(self, obj, owner):
+        if obj is None:
+            return self
+        value = obj._properties.get(self.name)
+        if self.from_dbus is not None:
+            return self.from_dbus(value)
+        return value
+
+    def __set__(self, obj, value):
+        if value is not None:
+            value = self.to_dbus(value)
+        obj.set_property(self.name, value)
+
+
+class Advertisement(dbus.service.Object, metrics.Instrumented):
+    """
+    org.bluez.LEAdvertisement1 interface implementation
+
+    The advertised fields are AdvertisementFields: the property dict is
+    built as they are assigned and GetAll returns it as is. Changing a
+    field of a registered advertisement emits PropertiesChanged, which
+    bluetoothd applies without unregistering it. Changes made inside
+    `with advertisement.changes():` go out as one signal.
+
+    GetAll and Release may be overridden with `async def` handlers, which
+    run on the asyncio backend. They are off the mainloop thread there, so
+    they read the fields through backends.on_mainloop().
+    """
     PATH_BASE = '/org/bluez/example/advertisement'
 
+    ad_type = AdvertisementField('Type', dbus.String)
+    service_uuids = AdvertisementField(
+            'ServiceUUIDs', lambda v: dbus.Array(v, signature='s'))
+    solicit_uuids = AdvertisementField(
+            'SolicitUUIDs', lambda v: dbus.Array(v, signature='s'))
+    manufacturer_data = AdvertisementField('ManufacturerData',
+                                           _byte_arrays('qv'))
+    service_data = AdvertisementField('ServiceData', _byte_arrays('sv'))
+    local_name = AdvertisementField('LocalName', dbus.String)
+    include_tx_power = AdvertisementField(
+            'Includes',
+            lambda v: dbus.Array(['tx-power'], signature='s') if v else None,
+            lambda v: v is not None)
+    data = AdvertisementField('Data', _byte_arrays('yv'))
+
+    def __init_subclass__(cls, **kwargs):
+        # Before super(), so that Instrumented wraps the final handlers.
+        backends.defer_methods(cls, ('GetAll', 'Release'),
+                               backends.select_backend)
+        super().__init_subclass__(**kwargs)
+
     def __init__(self, bus, index, advertising_type):
         self.path = self.PATH_BASE + str(index)
         self.bus = bus
-        self.ad_type = advertising_type
-        self.service_uuids = None
-        self.manufacturer_data = None
-        self.solicit_uuids = None
-        self.service_data = None
-        self.local_name = None
-        self.include_tx_power = False
-        self.data = None
+        self._properties = {}
+        self._pending = None
+        # Nothing to announce before the object is exported.
+        with self.changes(emit=False):
+            self.ad_type = advertising_type
         dbus.service.Object.__init__(self, bus, self.path)
 
     def get_properties(self):
-        properties = dict()
-        properties['Type'] = self.ad_type
-        if self.service_uuids is not None:
-            properties['ServiceUUIDs'] = dbus.Array(self.service_uuids,
-                                                    signature='s')
-        if self.solicit_uuids is not None:
-            properties['SolicitUUIDs'] = dbus.Array(self.solicit_uuids,
-                                                    signature='s')
-        if self.manufacturer_data is not None:
-            properties['ManufacturerData'] = dbus.Dictionary(
-                self.manufacturer_data, signature='qv')
-        if self.service_data is not None:
-            properties['ServiceData'] = dbus.Dictionary(self.service_data,
-                                                        signature='sv')
-        if self.local_name is not None:
-            properties['LocalName'] = dbus.String(self.local_name)
-        if self.include_tx_power:
-            properties['Includes'] = dbus.Array(["tx-power"], signature='s')
-
-        if self.data is not None:
-            properties['Data'] = dbus.Dictionary(
-                self.data, signature='yv')
-        return {LE_ADVERTISEMENT_IFACE: properties}
+        return {LE_ADVERTISEMENT_IFACE: self._properties}
 
     def get_path(self):
         return dbus.ObjectPath(self.path)
 
+    def set_property(self, name, value):
+        """
+        Set the LEAdvertisement1 property name to value, which must
+        already have its D-Bus type, or remove it if value is None.
+        """
+        if value is None:
+            if name not in self._properties:
+                return
+            del self._properties[name]
+            changed, invalidated = {}, [name]
+        else:
+            if self._properties.get(name) == value:
+                return
+            self._properties[name] = value
+            changed, invalidated = {name: value}, []
+
+        if self._pending is not None:
+            self._pending[0].update(changed)
+            for name in invalidated:
+                self._pending[0].pop(name, None)
+            self._pending[1].update(invalidated)
+            self._pending[1].difference_update(changed)
+            return
+        self.PropertiesChanged(LE_ADVERTISEMENT_IFACE, changed, invalidated)
+
+    @contextlib.contextmanager
+    def changes(self, emit=True):
+        """
+        Collect the changes made in the block into one PropertiesChanged.
+        """
+        if self._pending is not None:
+            yield
+            return
+        self._pending = ({}, set())
+        try:
+            yield
+        finally:
+            changed, invalidated = self._pending
+            self._pending = None
+        if emit and (changed or invalidated):
+            self.PropertiesChanged(LE_ADVERTISEMENT_IFACE, changed,
+                                   sorted(invalidated))
+
     def add_service_uuid(self, uuid):
-        if not self.service_uuids:
-            self.service_uuids = []
-        self.service_uuids.append(uuid)
+        self.service_uuids = list(self.service_uuids or []) + [uuid]
 
     def add_solicit_uuid(self, uuid):
-        if not self.solicit_uuids:
-            self.solicit_uuids = []
-        self.solicit_uuids.append(uuid)
+        self.solicit_uuids = list(self.solicit_uuids or []) + [uuid]
 
     def add_manufacturer_data(self, manuf_code, data):
-        if not self.manufacturer_data:
-            self.manufacturer_data = dbus.Dictionary({}, signature='qv')
-        self.manufacturer_data[manuf_code] = dbus.Array(data, signature='y')
+        manufacturer_data = dict(self.manufacturer_data or {})
+        manufacturer_data[manuf_code] = data
+        self.manufacturer_data = manufacturer_data
 
     def add_service_data(self, uuid, data):
-        if not self.service_data:
-            self.service_data = dbus.Dictionary({}, signature='sv')
-        self.service_data[uuid] = dbus.Array(data, signature='y')
+        service_data = dict(self.service_data or {})
+        service_data[uuid] = data
+        self.service_data = service_data
 
     def add_local_name(self, name):
-        if not self.local_name:
-            self.local_name = ""
-        self.local_name = dbus.String(name)
+        self.local_name = name
 
     def add_data(self, ad_type, data):
-        if not self.data:
-            self.data = dbus.Dictionary({}, signature='yv')
-        self.data[ad_type] = dbus.Array(data, signature='y')
+        ad_data = dict(self.data or {})
+        ad_data[ad_type] = data
+        self.data = ad_data
+
+    def set_payload(self, payload):
+        """
+        Replace everything but the type with payload, announced with a
+        single PropertiesChanged.
+
+        payload is a dict with any of the keys service_uuids,
+        solicit_uuids, manufacturer_data, service_data, local_name,
+        include_tx_power and data, in the form the add_* methods take.
+        """
+        with self.changes():
+            self.service_uuids = payload.get('service_uuids')
+            self.solicit_uuids = payload.get('solicit_uuids')
+            self.manufacturer_data = payload.get('manufacturer_data')
+            self.service_data = payload.get('service_data')
+            self.local_name = payload.get('local_name')
+            self.include_tx_power = payload.get('include_tx_power', False)
+            self.data = payload.get('data')
+
+    @dbus.service.signal(DBUS_PROP_IFACE,
+                         signature='sa{sv}as')
+    def PropertiesChanged(self, interface, changed, invalidated):
+        pass
 
     @dbus.service.method(DBUS_PROP_IFACE,
                          in_signature='s',
                          out_signature='a{sv}')
     def GetAll(self, interface):
-        print('GetAll')
+        log.debug('GetAll')
         if interface != LE_ADVERTISEMENT_IFACE:
             raise InvalidArgsException()
-        print('returning props')
+        log.debug('returning props')
         return self.get_properties()[LE_ADVERTISEMENT_IFACE]
 
     @dbus.service.method(LE_ADVERTISEMENT_IFACE,
                          in_signature='',
                          out_signature='')
     def Release(self):
-        print('%s: Released!' % self.path)
+        log.info('%s: Released!', self.path)
 
 
 class TestAdvertisement(Advertisement):
@@ -150,72 +265,296 @@ class TestAdvertisement(Advertisement):
         #self.add_data(0x26, [0x01, 0x01, 0x00])
 
 
-def register_ad_cb():
-    print('Advertisement registered')
+# More than fits in one advertising instance, for --rotate-interval.
+ROTATION_PAYLOADS = [
+        {'service_uuids': ['180D'], 'service_data': {'180D': [0x00, 0x48]},
+         'local_name': 'RotateHR'},
+        {'service_uuids': ['180F'], 'service_data': {'180F': [0x64]},
+         'local_name': 'RotateBatt'},
+        {'manufacturer_data': {0xffff: [0x00, 0x01, 0x02, 0x03]},
+         'local_name': 'RotateMfr', 'include_tx_power': True},
+        {'service_data': {'9999': [0x00, 0x01, 0x02, 0x03, 0x04]},
+         'local_name': 'RotateData'},
+        {'service_uuids': ['1809'], 'service_data': {'1809': [0x00, 0x25]},
+         'local_name': 'RotateTemp'},
+        {'service_uuids': ['181A'], 'service_data': {'181A': [0x10, 0x27]},
+         'local_name': 'RotateEnv'},
+        {'solicit_uuids': ['1812'], 'local_name': 'RotateHID'},
+        {'data': {0x26: [0x01, 0x01, 0x00]}, 'local_name': 'RotateMesh'},
+]
+
+
+class AdvertisementRotation(object):
+    """
+    Broadcasts more payloads than the adapters have advertising instances.
+
+    A pool of advertisements, one per available instance, is registered
+    once. Every interval seconds each advertisement in the pool is given
+    the next payload in turn and announces it with PropertiesChanged, so
+    nothing is unregistered or registered again while rotating.
+    emit_times keeps how long the recent rotations took to emit their
+    PropertiesChanged signals, in seconds; bluetoothd applies the new data
+    after that, without telling us when. Advertisements that no adapter
+    took are left out of the rotation, and the mainloop is stopped once
+    none of the pool is registered or pending anywhere.
+    """
+    PATH_INDEX_BASE = 100
+
+    def __init__(self, bus, payloads, instances, interval,
+                 advertising_type='peripheral'):
+        self.payloads = payloads
+        self.interval = interval
+        self.pool = [Advertisement(bus, self.PATH_INDEX_BASE + i,
+                                   advertising_type)
+                     for i in range(min(instances, len(payloads)))]
+        self.registrations = [
+                AdvertisementRegistrations(bus, ad, self._registration_failed)
+                for ad in self.pool]
+        self.next = 0
+        self.rotations = 0
+        self.emit_times = collections.deque(maxlen=1000)
+        self._timeout_id = None
+        self._assign()
+
+    @property
+    def follow_new(self):
+        return all(r.follow_new for r in self.registrations)
+
+    @follow_new.setter
+    def follow_new(self, follow_new):
+        for registrations in self.registrations:
+            registrations.follow_new = follow_new
+
+    def register(self, adapter):
+        for registrations in self.registrations:
+            registrations.register(adapter)
+
+    def adapter_changed(self, event, adapter, properties):
+        for registrations in self.registrations:
+            registrations.adapter_changed(event, adapter, properties)
+
+    def unregister_all(self):
+        self.stop()
+        for registrations in self.registrations:
+            registrations.unregister_all()
+
+    def start(self):
+        if len(self.payloads) <= len(self.pool):
+            log.info('All %d payloads fit, not rotating', len(self.payloads))
+            return
+        log.info('Rotating %d payloads over %d instances every %gs',
+                 len(self.payloads), len(self.pool), self.interval)
+        self._timeout_id = GObject.timeout_add(int(self.interval * 1000),
+                                               self._rotate)
+
+    def stop(self):
+        if self._timeout_id is not None:
+            GObject.source_remove(self._timeout_id)
+            self._timeout_id = None
+
+    def rotate(self):
+        start = time.perf_counter()
+        self._assign()
+        elapsed = time.perf_counter() - start
+        self.rotations += 1
+        self.emit_times.append(elapsed)
+        log.info('Rotation %d emitted in %.3f ms', self.rotations,
+                 elapsed * 1000)
+        return elapsed
+
+    def _assign(self):
+        for ad, registrations in zip(self.pool, self.registrations):
+            if registrations.failed():
+                continue
+            ad.set_payload(self.payloads[self.next])
+            self.next = (self.next + 1) % len(self.payloads)
+
+    def _registration_failed(self):
+        if all(r.failed() for r in self.registrations):
+            mainloop.quit()
+
+    def _rotate(self):
+        self.rotate()
+        return True
+
+
+class AdvertisementRegistrations(object):
+    """
+    Registers one advertisement on several adapters in parallel.
+
+    Each adapter is powered on and then asked to register the
+    advertisement, all with asynchronous calls. status maps every adapter
+    path to 'pending', 'registered', 'removed' or the error it failed
+    with. Once no adapter is pending and none succeeded, on_failed is
+    called, which by default stops the mainloop.
+    """
+    follow_new = False
+
+    def __init__(self, bus, advertisement, on_failed=None):
+        self.bus = bus
+        self.advertisement = advertisement
+        self.on_failed = on_failed
+        self.status = {}
+        self.managers = {}
+
+    def register(self, adapter):
+        self.status[adapter] = 'pending'
+        adapter_obj = self.bus.get_object(BLUEZ_SERVICE_NAME, adapter)
+        self.managers[adapter] = dbus.Interface(adapter_obj,
+                                                LE_ADVERTISING_MANAGER_IFACE)
+
+        adapter_props = dbus.Interface(adapter_obj,
+                                       "org.freedesktop.DBus.Properties")
+        adapter_props.Set("org.bluez.Adapter1", "Powered", dbus.Boolean(1),
+                          reply_handler=lambda: self._powered(adapter),
+                          error_handler=lambda e: self._failed(adapter, e))
+
+    def registered(self):
+        return [a for a, s in self.status.items() if s == 'registered']
+
+    def failed(self):
+        return (bool(self.status) and
+                'pending' not in self.status.values() and
+                not self.registered())
+
+    def unregister_all(self):
+        for adapter in self.registered():
+            self.managers[adapter].UnregisterAdvertisement(self.advertisement)
+            log.info('Advertisement unregistered from %s', adapter)
+
+    def adapter_changed(self, event, adapter, properties):
+        """
+        bluezcache listener. Registers again on adapters that come back,
+        as they all do when bluetoothd restarts, and on new adapters too
+        if follow_new is set.
+        """
+        if event == 'removed' and adapter in self.status:
+            self.status[adapter] = 'removed'
+            log.warning('Adapter %s removed', adapter)
+        elif event == 'added' and (self.follow_new or
+                                   self.status.get(adapter) == 'removed'):
+            self.register(adapter)
+
+    def _powered(self, adapter):
+        self.managers[adapter].RegisterAdvertisement(
+                self.advertisement.get_path(), {},
+                reply_handler=lambda: self._registered(adapter),
+                error_handler=lambda e: self._failed(adapter, e))
+
+    def _registered(self, adapter):
+        self.status[adapter] = 'registered'
+        log.info('Advertisement registered on %s', adapter)
+
+    def _failed(self, adapter, error):
+        self.status[adapter] = str(error)
+        log.error('Failed to register advertisement on %s: %s', adapter,
+                  error)
+        if self.failed():
+            if self.on_failed is not None:
+                self.on_failed()
+            else:
+                mainloop.quit()
+
+
+def find_adapters(bus):
+    return bluezcache.get_cache(bus).paths(LE_ADVERTISING_MANAGER_IFACE)
 
 
-def register_ad_error_cb(error):
-    print('Failed to register advertisement: ' + str(error))
-    mainloop.quit()
+def find_adapter(bus):
+    adapters = find_adapters(bus)
+    if not adapters:
+        return None
+    return adapters[0]
 
 
-def find_adapter(bus):
-    remote_om = dbus.Interface(bus.get_object(BLUEZ_SERVICE_NAME, '/'),
-                               DBUS_OM_IFACE)
-    objects = remote_om.GetManagedObjects()
+def supported_instances(bus, adapters):
+    """
+    Return the number of advertising instances still free on every one
+    of adapters.
+    """
+    cache = bluezcache.get_cache(bus)
+    return min(int(cache.properties(adapter, LE_ADVERTISING_MANAGER_IFACE)
+                   ['SupportedInstances']) for adapter in adapters)
 
-    for o, props in objects.items():
-        if LE_ADVERTISING_MANAGER_IFACE in props:
-            return o
 
-    return None
+def log_scan_results(scan):
+    results = scan.pull(max_count=1024)
+    for result in results:
+        log.debug('%s %s RSSI %s', result.address, result.name or '',
+                  result.rssi)
+    log.info('Scan: %d devices changed, %d tracked, %d advertisements',
+             len(results), len(scan.devices), scan.stats['advertisements'])
+    return True
 
 
 def shutdown(timeout):
-    print('Advertising for {} seconds...'.format(timeout))
+    log.info('Advertising for %d seconds...', timeout)
     time.sleep(timeout)
     mainloop.quit()
 
 
-def main(timeout=0):
+def main(timeout=0, log_level='INFO', all_adapters=False, metrics_file=None,
+         rotate_interval=0, scan=False):
     global mainloop
 
+    ringlog.setup(log_level)
+
     dbus.mainloop.glib.DBusGMainLoop(set_as_default=True)
 
+    if metrics_file is not None:
+        metrics.start_prometheus_file(metrics_file)
+
     bus = dbus.SystemBus()
     bus.request_name("com.github.maldata.testservice1")
 
-    adapter = find_adapter(bus)
-    if not adapter:
-        print('LEAdvertisingManager1 interface not found')
+    adapters = find_adapters(bus)
+    if not adapters:
+        log.error('LEAdvertisingManager1 interface not found')
         return
-
-    adapter_props = dbus.Interface(bus.get_object(BLUEZ_SERVICE_NAME, adapter),
-                                   "org.freedesktop.DBus.Properties")
-
-    adapter_props.Set("org.bluez.Adapter1", "Powered", dbus.Boolean(1))
-
-    ad_manager = dbus.Interface(bus.get_object(BLUEZ_SERVICE_NAME, adapter),
-                                LE_ADVERTISING_MANAGER_IFACE)
-
-    test_advertisement = TestAdvertisement(bus, 0)
+    if not all_adapters:
+        adapters = adapters[:1]
+
+    if rotate_interval > 0:
+        registrations = AdvertisementRotation(
+                bus, ROTATION_PAYLOADS, supported_instances(bus, adapters),
+                rotate_interval)
+        advertisements = registrations.pool
+        if not advertisements:
+            log.error('No free advertising instances')
+            return
+    else:
+        registrations = AdvertisementRegistrations(bus,
+                                                   TestAdvertisement(bus, 0))
+        advertisements = [registrations.advertisement]
+    registrations.follow_new = all_adapters
 
     mainloop = GObject.MainLoop()
 
-    ad_manager.RegisterAdvertisement(test_advertisement.get_path(), {},
-                                     reply_handler=register_ad_cb,
-                                     error_handler=register_ad_error_cb)
-    
+    for adapter in adapters:
+        registrations.register(adapter)
+    bluezcache.get_cache(bus).watch(LE_ADVERTISING_MANAGER_IFACE,
+                                    registrations.adapter_changed)
+    if rotate_interval > 0:
+        registrations.start()
+
+    if scan:
+        discovery = scanner.Scanner(bus)
+        discovery.start(bluezcache.get_cache(bus))
+        for adapter in adapters:
+            discovery.start_discovery(adapter, lambda e: log.error(
+                    'Failed to start discovery: %s', e))
+        GObject.timeout_add(1000, log_scan_results, discovery)
+
     if timeout > 0:
         threading.Thread(target=shutdown, args=(timeout,)).start()
     else:
-        print('Advertising forever...')
+        log.info('Advertising forever...')
 
     mainloop.run()  # blocks until mainloop.quit() is called
 
-    ad_manager.UnregisterAdvertisement(test_advertisement)
-    print('Advertisement unregistered')
-    dbus.service.Object.remove_from_connection(test_advertisement)
+    registrations.unregister_all()
+    for advertisement in advertisements:
+        dbus.service.Object.remove_from_connection(advertisement)
 
 
 if __name__ == '__main__':
@@ -223,6 +562,24 @@ if __name__ == '__main__':
     parser.add_argument('--timeout', default=0, type=int, help="advertise " +
                         "for this many seconds then stop, 0=run forever " +
                         "(default: 0)")
+    parser.add_argument('--log-level', default='INFO',
+                        choices=['DEBUG', 'INFO', 'WARNING', 'ERROR'],
+                        help="(default: INFO)")
+    parser.add_argument('--all-adapters', action='store_true',
+                        help="advertise on every adapter instead of the " +
+                        "first one found")
+    parser.add_argument('--metrics-file', help="write method metrics to " +
+                        "this file in Prometheus text format every 10 " +
+                        "seconds")
+    parser.add_argument('--rotate-interval', default=0, type=float,
+                        help="rotate a set of example payloads over the " +
+                        "free advertising instances every this many " +
+                        "seconds, 0=advertise TestAdvertisement only " +
+                        "(default: 0)")
+    parser.add_argument('--scan', action='store_true',
+                        help="also discover nearby devices and log what " +
+                        "changed every second")
     args = parser.parse_args()
 
-    main(args.timeout)
+    main(args.timeout, args.log_level, args.all_adapters, args.metrics_file,
+         args.rotate_interval, args.scan)
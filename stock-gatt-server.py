@@ -6,21 +6,47 @@ import dbus.exceptions
 import dbus.mainloop.glib
 import dbus.service
 
-import array
 try:
   from gi.repository import GObject
 except ImportError:
   import gobject as GObject
+import argparse
+import collections
+import json
+import logging
+import socket
 import sys
+import time
 
 from random import randint
 
+try:
+  import tomllib
+except ImportError:
+  tomllib = None
+
+import backends
+import bluezcache
+import fleetsim
+import metrics
+import profiling
+import ringlog
+import timerwheel
+
 mainloop = None
 
+log = logging.getLogger('stock-gatt-server')
+
+START_TIME = time.monotonic()
+
 BLUEZ_SERVICE_NAME = 'org.bluez'
 GATT_MANAGER_IFACE = 'org.bluez.GattManager1'
 DBUS_OM_IFACE =      'org.freedesktop.DBus.ObjectManager'
 DBUS_PROP_IFACE =    'org.freedesktop.DBus.Properties'
+DBUS_INTROSPECT_DOCTYPE = (
+        '<!DOCTYPE node PUBLIC '
+        '"-//freedesktop//DTD D-BUS Object Introspection 1.0//EN"\n'
+        '"http://www.freedesktop.org/standards/dbus/1.0/introspect.dtd">\n')
 
 GATT_SERVICE_IFACE = 'org.bluez.GattService1'
 GATT_CHRC_IFACE =    'org.bluez.GattCharacteristic1'
@@ -41,43 +67,501 @@ class InvalidValueLengthException(dbus.exceptions.DBusException):
 class FailedException(dbus.exceptions.DBusException):
     _dbus_error_name = 'org.bluez.Error.Failed'
 
+class InvalidOffsetException(dbus.exceptions.DBusException):
+    _dbus_error_name = 'org.bluez.Error.InvalidOffset'
+
+
+class ValueBuffer(object):
+    """
+    Attribute value stored in a bytearray.
+
+    read() hands back bytes, which dbus-python marshals directly as 'ay'
+    instead of going through one dbus.Byte object per element.
+
+    Long writes are assembled with stage() in a second buffer of
+    max_length bytes, allocated once, and copied over the value by
+    commit().
+    """
+    def __init__(self, value=b'', max_length=512):
+        self.max_length = max_length
+        self._buf = bytearray(value)
+        self._staging = None
+        self._staged = None
+
+    def __len__(self):
+        return len(self._buf)
+
+    def __repr__(self):
+        return 'ValueBuffer(' + repr(bytes(self._buf)) + ')'
+
+    def view(self):
+        return memoryview(self._buf)
+
+    def read(self, offset=0):
+        if offset == 0:
+            return bytes(self._buf)
+        return bytes(self.view()[offset:])
+
+    def write(self, value):
+        if len(value) > self.max_length:
+            raise InvalidValueLengthException()
+        self._buf[:] = value
+        self._staged = None
+
+    @property
+    def pending(self):
+        return self._staged is not None
+
+    def stage(self, offset, value):
+        if self._staging is None:
+            self._staging = bytearray(self.max_length)
+        if offset == 0:
+            self._staged = 0
+        elif self._staged is None:
+            self._staging[:len(self._buf)] = self._buf
+            self._staged = len(self._buf)
+
+        if offset > self._staged:
+            raise InvalidOffsetException()
+        end = offset + len(value)
+        if end > self.max_length:
+            raise InvalidValueLengthException()
+        self._staging[offset:end] = value
+        self._staged = max(self._staged, end)
+
+    def commit(self):
+        if self._staged is None:
+            return False
+        self._buf[:] = memoryview(self._staging)[:self._staged]
+        self._staged = None
+        return True
+
+
+class AttributeValue(object):
+    """
+    Offset and MTU handling shared by Characteristic and Descriptor.
+
+    Subclasses keeping their value in a ValueBuffer implement ReadValue and
+    WriteValue with read_value() and write_value(). A read at offset 0
+    takes a snapshot from build_value() and the blob reads that follow from
+    the same device are sliced from that snapshot, so the value is built
+    once per long read. A write at offset 0 is applied before WriteValue
+    returns. bluetoothd delivers a long (prepared) write as one WriteValue
+    per chunk, each sent after the previous reply, with type "reliable";
+    those chunks and any write at a non-zero offset are staged and
+    committed once the chunks stop for long_write_timeout milliseconds, or
+    before the next read or offset-0 write, so value_written() sees the
+    whole value once.
+
+    ReadValue and WriteValue handlers may be written as `async def`; they
+    then run on the asyncio backend and the reply is sent when the
+    coroutine finishes. Classes with blocking handlers (sensors, databases)
+    can set offload to run them in the shared worker pool instead, with at
+    most offload_limit calls per object in flight. Either way the handler
+    is off the mainloop thread, so read_value(), write_value() and
+    notify_value() hand themselves back to the mainloop when called from
+    it; coroutines avoid blocking their event loop with
+    `await backends.on_mainloop(self.read_value, options)`.
+
+    Setting cache_ttl (seconds) caches the result of build_value() as a
+    ready-to-send dbus.ByteArray, so centrals polling the same value do
+    not rebuild it. Writes and notifications invalidate the cache;
+    cache_hits and cache_misses count how it is doing.
+    """
+    value = None
+    offload = False
+    offload_limit = 1
+    cache_ttl = None
+    cache_hits = 0
+    cache_misses = 0
+    long_write_timeout = 100
+    _cache = None
+    _cache_expiry = 0.0
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        backends.defer_methods(cls, ('ReadValue', 'WriteValue'),
+                               backends.select_backend)
+
+    def build_value(self):
+        return self.value.read()
+
+    def value_written(self):
+        pass
+
+    def cached_value(self):
+        if self.cache_ttl is None:
+            return self.build_value()
+
+        now = time.monotonic()
+        if self._cache is not None and now < self._cache_expiry:
+            self.cache_hits += 1
+            return self._cache
+        self.cache_misses += 1
+        self._cache = dbus.ByteArray(self.build_value())
+        self._cache_expiry = now + self.cache_ttl
+        return self._cache
 
-class Application(dbus.service.Object):
+    def invalidate_cache(self):
+        self._cache = None
+
+    def cache_stats(self):
+        return {
+                'hits': self.cache_hits,
+                'misses': self.cache_misses,
+        }
+
+    def read_value(self, options):
+        if not backends.in_mainloop():
+            return backends.call_on_mainloop(self.read_value, options)
+        self._commit_staged()
+
+        offset = int(options.get('offset', 0))
+        device = options.get('device')
+        snapshot = self._read_snapshots.get(device)
+        if offset == 0 or snapshot is None:
+            snapshot = self.cached_value()
+        if offset > len(snapshot):
+            raise InvalidOffsetException()
+
+        mtu = int(options.get('mtu', 0))
+        end = offset + mtu - 1 if mtu > 1 else len(snapshot)
+        if end < len(snapshot):
+            self._read_snapshots[device] = snapshot
+        else:
+            self._read_snapshots.pop(device, None)
+            if offset == 0:
+                return snapshot
+        return snapshot[offset:end]
+
+    def write_value(self, value, options):
+        if not backends.in_mainloop():
+            return backends.call_on_mainloop(self.write_value, value,
+                                             options)
+        offset = int(options.get('offset', 0))
+        staged = (offset > 0 or options.get('type') == 'reliable' or
+                  options.get('prepare-authorize', False))
+
+        # A write at offset 0 starts a new value, so an earlier long write
+        # is complete.
+        if offset == 0:
+            self._commit_staged()
+        if not staged:
+            self.value.write(value)
+            self.invalidate_cache()
+            self.value_written()
+            return
+
+        self.value.stage(offset, value)
+        if self._commit_id is not None:
+            GObject.source_remove(self._commit_id)
+        self._commit_id = GObject.timeout_add(self.long_write_timeout,
+                                              self._commit_staged)
+
+    def _commit_staged(self):
+        if self._commit_id is not None:
+            GObject.source_remove(self._commit_id)
+            self._commit_id = None
+        if self.value is not None and self.value.commit():
+            self.invalidate_cache()
+            self.value_written()
+        return False
+
+
+class NotificationScheduler(object):
+    """
+    Rate limiter for the PropertiesChanged notifications of one
+    characteristic.
+
+    push() only records the latest value. Values that are due are emitted
+    together from a single idle callback per mainloop iteration, and a
+    characteristic is never notified more often than every min_interval
+    milliseconds. Values replaced before they were sent are counted in
+    coalesced.
+    """
+    _due = []
+    _flush_id = None
+
+    def __init__(self, chrc, min_interval=0):
+        self.chrc = chrc
+        self.min_interval = min_interval
+        self.value = None
+        self.last_emit = 0.0
+        self.timer_id = None
+        self.updates = 0
+        self.emitted = 0
+        self.coalesced = 0
+
+    def push(self, value):
+        self.updates += 1
+        if self.value is not None:
+            self.coalesced += 1
+            self.value = value
+            return
+
+        self.value = value
+        wait = self.last_emit + self.min_interval / 1000.0 - time.monotonic()
+        if wait > 0:
+            self.timer_id = GObject.timeout_add(int(wait * 1000) + 1,
+                                                self._interval_elapsed)
+        else:
+            self._schedule()
+
+    def cancel(self):
+        if self.timer_id is not None:
+            GObject.source_remove(self.timer_id)
+            self.timer_id = None
+        self.value = None
+
+    def stats(self):
+        return {
+                'updates': self.updates,
+                'emitted': self.emitted,
+                'coalesced': self.coalesced,
+        }
+
+    def _interval_elapsed(self):
+        self.timer_id = None
+        self._schedule()
+        return False
+
+    def _schedule(self):
+        cls = NotificationScheduler
+        cls._due.append(self)
+        if cls._flush_id is None:
+            cls._flush_id = GObject.idle_add(cls._flush)
+
+    @staticmethod
+    def _flush():
+        cls = NotificationScheduler
+        due, cls._due = cls._due, []
+        cls._flush_id = None
+        now = time.monotonic()
+        for scheduler in due:
+            scheduler._emit(now)
+        return False
+
+    def _emit(self, now):
+        value, self.value = self.value, None
+        if value is None:
+            return
+        self.last_emit = now
+        self.emitted += 1
+        self.chrc.emit_notification(value)
+
+
+class FrozenProperties(dict):
+    """
+    dict that refuses changes. Property snapshots are replaced, never
+    edited, so the same object can be handed to every reply.
+    """
+    def _read_only(self, *args, **kwargs):
+        raise TypeError('property snapshots are read-only')
+
+    __setitem__ = __delitem__ = _read_only
+    clear = pop = popitem = setdefault = update = _read_only
+
+
+class PropertySnapshot(object):
+    """
+    Versioned property snapshot shared by Service, Characteristic and
+    Descriptor.
+
+    get_properties() returns the snapshot made by build_properties() and
+    only rebuilds it after invalidate_properties(), which is called when
+    the children or flags of the object change. GetAll and
+    GetManagedObjects reuse the snapshot; properties_version counts the
+    rebuilds.
+    """
+    properties_version = 0
+    _properties = None
+
+    def get_properties(self):
+        if self._properties is None:
+            self._properties = FrozenProperties(
+                    (iface, FrozenProperties(props))
+                    for iface, props in self.build_properties().items())
+            self.properties_version += 1
+        return self._properties
+
+    def invalidate_properties(self):
+        self._properties = None
+        app = self.app
+        if app is not None:
+            app.object_changed(self)
+
+
+class CachedIntrospection(object):
+    """
+    Introspect replies served from cache.
+
+    The interface part of the XML only depends on the class, so it is
+    reflected once per class and shared by all objects of that class. Each
+    object counts its child nodes as children are added and removed,
+    instead of asking the connection to walk the registered paths, and
+    keeps its whole reply until the children change.
+
+    Objects that other code exported below this one on the connection
+    (a bench control object, anything registered by hand) are taken from
+    the connection's child list when the reply is built, so they are
+    listed as dbus-python lists them; exporting more of them later does
+    not rebuild a reply that is already cached.
+    """
+    _class_xml = {}
+    _child_nodes = None
+    _introspect_xml = None
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        # Undecorated, so dbus-python keeps the signature and keywords of
+        # dbus.service.Object.Introspect.
+        cls.Introspect = CachedIntrospection._introspect
+
+    @classmethod
+    def _interfaces_xml(cls):
+        xml = CachedIntrospection._class_xml.get(cls)
+        if xml is not None:
+            return xml
+        xml = ''
+        interfaces = cls._dbus_class_table[cls.__module__ + '.' + cls.__name__]
+        for name, funcs in interfaces.items():
+            xml += '  <interface name="%s">\n' % name
+            for func in funcs.values():
+                if getattr(func, '_dbus_is_method', False):
+                    xml += cls._reflect_on_method(func)
+                elif getattr(func, '_dbus_is_signal', False):
+                    xml += cls._reflect_on_signal(func)
+            xml += '  </interface>\n'
+        CachedIntrospection._class_xml[cls] = xml
+        return xml
+
+    def _child_node(self, child):
+        prefix = self.get_path().rstrip('/') + '/'
+        return child.get_path()[len(prefix):].split('/')[0]
+
+    def _get_child_nodes(self):
+        if self._child_nodes is None:
+            self._child_nodes = collections.Counter(
+                    self._child_node(child) for child in self.get_children())
+        return self._child_nodes
+
+    def add_child_node(self, child):
+        if self._child_nodes is not None:
+            self._child_nodes[self._child_node(child)] += 1
+        self._introspect_xml = None
+
+    def remove_child_node(self, child):
+        if self._child_nodes is not None:
+            name = self._child_node(child)
+            self._child_nodes[name] -= 1
+            if self._child_nodes[name] <= 0:
+                del self._child_nodes[name]
+        self._introspect_xml = None
+
+    def _introspect(self, object_path, connection):
+        if self._introspect_xml is None:
+            nodes = self._get_child_nodes()
+            names = list(nodes) + [
+                    name for name in
+                    connection.list_exported_child_objects(object_path)
+                    if name not in nodes]
+            self._introspect_xml = (
+                    DBUS_INTROSPECT_DOCTYPE +
+                    '<node name="%s">\n' % object_path +
+                    self._interfaces_xml() +
+                    ''.join('  <node name="%s"/>\n' % name
+                            for name in names) +
+                    '</node>\n')
+        return self._introspect_xml
+
+
+def unexport(obj):
+    """
+    Remove obj and every object below it from the bus.
+    """
+    for child in obj.get_children():
+        unexport(child)
+    obj.remove_from_connection()
+
+
+class Application(dbus.service.Object, metrics.Instrumented,
+                  metrics.StatsInterface, profiling.ProfilingInterface,
+                  CachedIntrospection):
     """
     org.bluez.GattApplication1 interface implementation
+
+    The ObjectManager reply is kept in self.managed_objects and updated as
+    services, characteristics and descriptors are added or removed, so
+    GetManagedObjects does not walk the whole tree on every call.
+
+    next_index is one past the highest service index ever added. It never
+    goes down, so a service numbered with it cannot reuse the path of a
+    removed one.
+
+    With a fleetsim.WearableFleet, the example gets a Heart Rate and a
+    Battery service for every device of the fleet, fed from it.
     """
-    def __init__(self, bus):
+    def __init__(self, bus, populate=True, fleet=None):
         self.path = '/'
+        self.bus = bus
         self.services = []
+        self.managed_objects = {}
+        self.next_index = 0
         dbus.service.Object.__init__(self, bus, self.path)
-        self.add_service(HeartRateService(bus, 0))
-        self.add_service(BatteryService(bus, 1))
-        self.add_service(TestService(bus, 2))
+        if not populate:
+            return
+        devices = 1 if fleet is None else fleet.n
+        for i in range(devices):
+            self.add_service(HeartRateService(bus, 2 * i, fleet, i))
+            self.add_service(BatteryService(bus, 2 * i + 1, fleet, i))
+        self.add_service(TestService(bus, 2 * devices))
 
     def get_path(self):
         return dbus.ObjectPath(self.path)
 
+    def get_children(self):
+        return self.services
+
     def add_service(self, service):
         self.services.append(service)
+        self.next_index = max(self.next_index, service.index + 1)
+        service.app = self
+        self.object_added(service)
+        self.add_child_node(service)
+
+    def remove_service(self, service):
+        self.services.remove(service)
+        self.object_removed(service)
+        self.remove_child_node(service)
+        service.app = None
+        unexport(service)
+
+    def object_added(self, obj):
+        for o in self._subtree(obj):
+            self.managed_objects[o.get_path()] = o.get_properties()
+
+    def object_removed(self, obj):
+        for o in self._subtree(obj):
+            self.managed_objects.pop(o.get_path(), None)
+
+    def object_changed(self, obj):
+        if obj.get_path() not in self.managed_objects:
+            return
+        self.managed_objects[obj.get_path()] = obj.get_properties()
+
+    def _subtree(self, obj):
+        yield obj
+        for child in obj.get_children():
+            for o in self._subtree(child):
+                yield o
 
     @dbus.service.method(DBUS_OM_IFACE, out_signature='a{oa{sa{sv}}}')
     def GetManagedObjects(self):
-        response = {}
-        print('GetManagedObjects')
-
-        for service in self.services:
-            response[service.get_path()] = service.get_properties()
-            chrcs = service.get_characteristics()
-            for chrc in chrcs:
-                response[chrc.get_path()] = chrc.get_properties()
-                descs = chrc.get_descriptors()
-                for desc in descs:
-                    response[desc.get_path()] = desc.get_properties()
-
-        return response
+        return self.managed_objects
 
 
-class Service(dbus.service.Object):
+class Service(dbus.service.Object, metrics.Instrumented, PropertySnapshot,
+              CachedIntrospection):
     """
     org.bluez.GattService1 interface implementation
     """
@@ -85,13 +569,15 @@ class Service(dbus.service.Object):
 
     def __init__(self, bus, index, uuid, primary):
         self.path = self.PATH_BASE + str(index)
+        self.index = index
         self.bus = bus
         self.uuid = uuid
         self.primary = primary
         self.characteristics = []
+        self.app = None
         dbus.service.Object.__init__(self, bus, self.path)
 
-    def get_properties(self):
+    def build_properties(self):
         return {
                 GATT_SERVICE_IFACE: {
                         'UUID': self.uuid,
@@ -105,8 +591,26 @@ class Service(dbus.service.Object):
     def get_path(self):
         return dbus.ObjectPath(self.path)
 
+    def get_parent(self):
+        return None
+
+    def get_children(self):
+        return self.characteristics
+
     def add_characteristic(self, characteristic):
         self.characteristics.append(characteristic)
+        if self.app is not None:
+            self.app.object_added(characteristic)
+        self.add_child_node(characteristic)
+        self.invalidate_properties()
+
+    def remove_characteristic(self, characteristic):
+        self.characteristics.remove(characteristic)
+        if self.app is not None:
+            self.app.object_removed(characteristic)
+        self.remove_child_node(characteristic)
+        self.invalidate_properties()
+        unexport(characteristic)
 
     def get_characteristic_paths(self):
         result = []
@@ -127,10 +631,23 @@ class Service(dbus.service.Object):
         return self.get_properties()[GATT_SERVICE_IFACE]
 
 
-class Characteristic(dbus.service.Object):
+class Characteristic(dbus.service.Object, metrics.Instrumented, AttributeValue,
+                     PropertySnapshot, CachedIntrospection):
     """
     org.bluez.GattCharacteristic1 interface implementation
+
+    Notifications go through notify_value(), which coalesces updates that
+    arrive faster than notify_interval milliseconds.
+
+    Setting acquire_notify or acquire_write lets BlueZ call AcquireNotify
+    or AcquireWrite. The value then travels as raw bytes over a socket
+    handed to BlueZ instead of through PropertiesChanged and WriteValue.
+    Notifications fall back to PropertiesChanged while no socket is held.
     """
+    notify_interval = 0
+    acquire_notify = False
+    acquire_write = False
+
     def __init__(self, bus, index, uuid, flags, service):
         self.path = service.path + '/char' + str(index)
         self.bus = bus
@@ -138,25 +655,65 @@ class Characteristic(dbus.service.Object):
         self.service = service
         self.flags = flags
         self.descriptors = []
+        self.notifier = NotificationScheduler(self, self.notify_interval)
+        self._read_snapshots = {}
+        self._commit_id = None
+        self.notify_sock = None
+        self.write_sock = None
         dbus.service.Object.__init__(self, bus, self.path)
 
-    def get_properties(self):
-        return {
-                GATT_CHRC_IFACE: {
-                        'Service': self.service.get_path(),
-                        'UUID': self.uuid,
-                        'Flags': self.flags,
-                        'Descriptors': dbus.Array(
-                                self.get_descriptor_paths(),
-                                signature='o')
-                }
+    @property
+    def flags(self):
+        return self._flags
+
+    @flags.setter
+    def flags(self, flags):
+        self._flags = flags
+        self.invalidate_properties()
+
+    def build_properties(self):
+        properties = {
+                'Service': self.service.get_path(),
+                'UUID': self.uuid,
+                'Flags': dbus.Array(self.flags, signature='s'),
+                'Descriptors': dbus.Array(
+                        self.get_descriptor_paths(),
+                        signature='o')
         }
+        # BlueZ only looks at whether these properties exist.
+        if self.acquire_notify:
+            properties['NotifyAcquired'] = dbus.Boolean(False)
+        if self.acquire_write:
+            properties['WriteAcquired'] = dbus.Boolean(False)
+        return {GATT_CHRC_IFACE: properties}
 
     def get_path(self):
         return dbus.ObjectPath(self.path)
 
+    @property
+    def app(self):
+        return self.service.app
+
+    def get_parent(self):
+        return self.service
+
+    def get_children(self):
+        return self.descriptors
+
     def add_descriptor(self, descriptor):
         self.descriptors.append(descriptor)
+        if self.app is not None:
+            self.app.object_added(descriptor)
+        self.add_child_node(descriptor)
+        self.invalidate_properties()
+
+    def remove_descriptor(self, descriptor):
+        self.descriptors.remove(descriptor)
+        if self.app is not None:
+            self.app.object_removed(descriptor)
+        self.remove_child_node(descriptor)
+        self.invalidate_properties()
+        unexport(descriptor)
 
     def get_descriptor_paths(self):
         result = []
@@ -167,6 +724,106 @@ class Characteristic(dbus.service.Object):
     def get_descriptors(self):
         return self.descriptors
 
+    def notify_value(self, value):
+        if not backends.in_mainloop():
+            return backends.call_on_mainloop(self.notify_value, value)
+        self.invalidate_cache()
+        self.notifier.push(value)
+
+    def emit_notification(self, value):
+        metrics.count_notification(self.path)
+        if self.notify_sock is not None:
+            try:
+                self.notify_sock.send(bytes(value))
+                return
+            except OSError as e:
+                log.warning('Notify socket failed: %s', e)
+                self._release_notify()
+        # Plain bytes in a variant would be sent as a string.
+        if not isinstance(value, dbus.ByteArray):
+            value = dbus.ByteArray(bytes(value))
+        self.PropertiesChanged(GATT_CHRC_IFACE, { 'Value': value }, [])
+
+    def notify_acquired(self):
+        pass
+
+    def notify_released(self):
+        pass
+
+    def _acquire_socket(self, options, callback, condition):
+        mtu = int(options.get('mtu', 23))
+        ours, theirs = socket.socketpair(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+        ours.setblocking(False)
+        watch = GObject.io_add_watch(ours.fileno(), condition, callback)
+        fd = dbus.types.UnixFd(theirs)
+        theirs.close()
+        return ours, watch, fd, dbus.UInt16(mtu)
+
+    def _release_notify(self):
+        if self.notify_sock is None:
+            return
+        GObject.source_remove(self._notify_watch)
+        self.notify_sock.close()
+        self.notify_sock = None
+        self.notify_released()
+
+    def _notify_sock_cb(self, fd, condition):
+        self._notify_watch = None
+        self.notify_sock.close()
+        self.notify_sock = None
+        self.notify_released()
+        return False
+
+    def _write_sock_cb(self, fd, condition):
+        if condition & GObject.IO_IN:
+            try:
+                data = self.write_sock.recv(self.write_mtu)
+            except OSError:
+                data = b''
+            if data:
+                backends.call_handler(
+                        self, 'WriteValue',
+                        (dbus.ByteArray(data),
+                         { 'mtu': self.write_mtu, 'type': 'command' }),
+                        lambda *result: None,
+                        lambda e: log.warning('Acquired write rejected: %s',
+                                              e))
+                return True
+
+        self.write_sock.close()
+        self.write_sock = None
+        return False
+
+    @dbus.service.method(GATT_CHRC_IFACE,
+                         in_signature='a{sv}',
+                         out_signature='hq')
+    def AcquireNotify(self, options):
+        if not self.acquire_notify:
+            raise NotSupportedException()
+        if self.notify_sock is not None:
+            raise NotPermittedException()
+
+        self.notify_sock, self._notify_watch, fd, mtu = self._acquire_socket(
+                options, self._notify_sock_cb,
+                GObject.IO_HUP | GObject.IO_ERR)
+        self.notify_acquired()
+        return fd, mtu
+
+    @dbus.service.method(GATT_CHRC_IFACE,
+                         in_signature='a{sv}',
+                         out_signature='hq')
+    def AcquireWrite(self, options):
+        if not self.acquire_write:
+            raise NotSupportedException()
+        if self.write_sock is not None:
+            raise NotPermittedException()
+
+        self.write_sock, self._write_watch, fd, mtu = self._acquire_socket(
+                options, self._write_sock_cb,
+                GObject.IO_IN | GObject.IO_HUP | GObject.IO_ERR)
+        self.write_mtu = int(mtu)
+        return fd, mtu
+
     @dbus.service.method(DBUS_PROP_IFACE,
                          in_signature='s',
                          out_signature='a{sv}')
@@ -180,22 +837,23 @@ class Characteristic(dbus.service.Object):
                         in_signature='a{sv}',
                         out_signature='ay')
     def ReadValue(self, options):
-        print('Default ReadValue called, returning error')
+        log.debug('Default ReadValue called, returning error')
         raise NotSupportedException()
 
-    @dbus.service.method(GATT_CHRC_IFACE, in_signature='aya{sv}')
+    @dbus.service.method(GATT_CHRC_IFACE, in_signature='aya{sv}',
+                         byte_arrays=True)
     def WriteValue(self, value, options):
-        print('Default WriteValue called, returning error')
+        log.debug('Default WriteValue called, returning error')
         raise NotSupportedException()
 
     @dbus.service.method(GATT_CHRC_IFACE)
     def StartNotify(self):
-        print('Default StartNotify called, returning error')
+        log.debug('Default StartNotify called, returning error')
         raise NotSupportedException()
 
     @dbus.service.method(GATT_CHRC_IFACE)
     def StopNotify(self):
-        print('Default StopNotify called, returning error')
+        log.debug('Default StopNotify called, returning error')
         raise NotSupportedException()
 
     @dbus.service.signal(DBUS_PROP_IFACE,
@@ -204,7 +862,8 @@ class Characteristic(dbus.service.Object):
         pass
 
 
-class Descriptor(dbus.service.Object):
+class Descriptor(dbus.service.Object, metrics.Instrumented, AttributeValue,
+                 PropertySnapshot, CachedIntrospection):
     """
     org.bluez.GattDescriptor1 interface implementation
     """
@@ -212,22 +871,43 @@ class Descriptor(dbus.service.Object):
         self.path = characteristic.path + '/desc' + str(index)
         self.bus = bus
         self.uuid = uuid
-        self.flags = flags
         self.chrc = characteristic
+        self.flags = flags
+        self._read_snapshots = {}
+        self._commit_id = None
         dbus.service.Object.__init__(self, bus, self.path)
 
-    def get_properties(self):
+    @property
+    def flags(self):
+        return self._flags
+
+    @flags.setter
+    def flags(self, flags):
+        self._flags = flags
+        self.invalidate_properties()
+
+    def build_properties(self):
         return {
                 GATT_DESC_IFACE: {
                         'Characteristic': self.chrc.get_path(),
                         'UUID': self.uuid,
-                        'Flags': self.flags,
+                        'Flags': dbus.Array(self.flags, signature='s'),
                 }
         }
 
     def get_path(self):
         return dbus.ObjectPath(self.path)
 
+    @property
+    def app(self):
+        return self.chrc.app
+
+    def get_parent(self):
+        return self.chrc
+
+    def get_children(self):
+        return []
+
     @dbus.service.method(DBUS_PROP_IFACE,
                          in_signature='s',
                          out_signature='a{sv}')
@@ -241,12 +921,13 @@ class Descriptor(dbus.service.Object):
                         in_signature='a{sv}',
                         out_signature='ay')
     def ReadValue(self, options):
-        print ('Default ReadValue called, returning error')
+        log.debug('Default ReadValue called, returning error')
         raise NotSupportedException()
 
-    @dbus.service.method(GATT_DESC_IFACE, in_signature='aya{sv}')
+    @dbus.service.method(GATT_DESC_IFACE, in_signature='aya{sv}',
+                         byte_arrays=True)
     def WriteValue(self, value, options):
-        print('Default WriteValue called, returning error')
+        log.debug('Default WriteValue called, returning error')
         raise NotSupportedException()
 
 
@@ -255,19 +936,30 @@ class HeartRateService(Service):
     Fake Heart Rate Service that simulates a fake heart beat and control point
     behavior.
 
+    When a fleetsim.WearableFleet is given, the measurements come from
+    device fleet_index of the fleet instead of a simulation of its own.
+
     """
     HR_UUID = '0000180d-0000-1000-8000-00805f9b34fb'
 
-    def __init__(self, bus, index):
+    def __init__(self, bus, index, fleet=None, fleet_index=0):
         Service.__init__(self, bus, index, self.HR_UUID, True)
+        self.fleet = fleet
+        self.fleet_index = fleet_index
         self.add_characteristic(HeartRateMeasurementChrc(bus, 0, self))
         self.add_characteristic(BodySensorLocationChrc(bus, 1, self))
         self.add_characteristic(HeartRateControlPointChrc(bus, 2, self))
         self.energy_expended = 0
 
+    def reset_energy_expended(self):
+        if self.fleet is not None:
+            self.fleet.reset_energy_expended(self.fleet_index)
+        self.energy_expended = 0
+
 
 class HeartRateMeasurementChrc(Characteristic):
     HR_MSRMT_UUID = '00002a37-0000-1000-8000-00805f9b34fb'
+    acquire_notify = True
 
     def __init__(self, bus, index, service):
         Characteristic.__init__(
@@ -279,37 +971,41 @@ class HeartRateMeasurementChrc(Characteristic):
         self.hr_ee_count = 0
 
     def hr_msrmt_cb(self):
-        value = []
-        value.append(dbus.Byte(0x06))
-
-        value.append(dbus.Byte(randint(90, 130)))
+        value = bytearray((0x06, randint(90, 130)))
 
         if self.hr_ee_count % 10 == 0:
-            value[0] = dbus.Byte(value[0] | 0x08)
-            value.append(dbus.Byte(self.service.energy_expended & 0xff))
-            value.append(dbus.Byte((self.service.energy_expended >> 8) & 0xff))
+            value[0] |= 0x08
+            value += self.service.energy_expended.to_bytes(2, 'little')
 
         self.service.energy_expended = \
                 min(0xffff, self.service.energy_expended + 1)
         self.hr_ee_count += 1
 
-        print('Updating value: ' + repr(value))
+        log.debug('Updating value: %r', value)
 
-        self.PropertiesChanged(GATT_CHRC_IFACE, { 'Value': value }, [])
+        self.notify_value(bytes(value))
 
         return self.notifying
 
     def _update_hr_msrmt_simulation(self):
-        print('Update HR Measurement Simulation')
+        log.debug('Update HR Measurement Simulation')
+
+        fleet = self.service.fleet
+        if fleet is not None:
+            if self.notifying:
+                fleet.subscribe(self.service.fleet_index, self.notify_value)
+            else:
+                fleet.unsubscribe(self.service.fleet_index)
+            return
 
         if not self.notifying:
             return
 
-        GObject.timeout_add(1000, self.hr_msrmt_cb)
+        timerwheel.get_default().add(1000, self.hr_msrmt_cb)
 
     def StartNotify(self):
         if self.notifying:
-            print('Already notifying, nothing to do')
+            log.info('Already notifying, nothing to do')
             return
 
         self.notifying = True
@@ -317,12 +1013,20 @@ class HeartRateMeasurementChrc(Characteristic):
 
     def StopNotify(self):
         if not self.notifying:
-            print('Not notifying, nothing to do')
+            log.info('Not notifying, nothing to do')
             return
 
         self.notifying = False
+        self.notifier.cancel()
+        log.info('HR Measurement notifications: %r', self.notifier.stats())
         self._update_hr_msrmt_simulation()
 
+    def notify_acquired(self):
+        self.StartNotify()
+
+    def notify_released(self):
+        self.StopNotify()
+
 
 class BodySensorLocationChrc(Characteristic):
     BODY_SNSR_LOC_UUID = '00002a38-0000-1000-8000-00805f9b34fb'
@@ -336,7 +1040,7 @@ class BodySensorLocationChrc(Characteristic):
 
     def ReadValue(self, options):
         # Return 'Chest' as the sensor location.
-        return [ 0x01 ]
+        return b'\x01'
 
 class HeartRateControlPointChrc(Characteristic):
     HR_CTRL_PT_UUID = '00002a39-0000-1000-8000-00805f9b34fb'
@@ -349,30 +1053,34 @@ class HeartRateControlPointChrc(Characteristic):
                 service)
 
     def WriteValue(self, value, options):
-        print('Heart Rate Control Point WriteValue called')
+        log.debug('Heart Rate Control Point WriteValue called')
 
         if len(value) != 1:
             raise InvalidValueLengthException()
 
         byte = value[0]
-        print('Control Point value: ' + repr(byte))
+        log.debug('Control Point value: %r', byte)
 
         if byte != 1:
             raise FailedException("0x80")
 
-        print('Energy Expended field reset!')
-        self.service.energy_expended = 0
+        log.info('Energy Expended field reset!')
+        self.service.reset_energy_expended()
 
 
 class BatteryService(Service):
     """
     Fake Battery service that emulates a draining battery.
 
+    When a fleetsim.WearableFleet is given, the level is the battery of
+    device fleet_index of the fleet, which drains it.
     """
     BATTERY_UUID = '180f'
 
-    def __init__(self, bus, index):
+    def __init__(self, bus, index, fleet=None, fleet_index=0):
         Service.__init__(self, bus, index, self.BATTERY_UUID, True)
+        self.fleet = fleet
+        self.fleet_index = fleet_index
         self.add_characteristic(BatteryLevelCharacteristic(bus, 0, self))
 
 
@@ -383,6 +1091,7 @@ class BatteryLevelCharacteristic(Characteristic):
 
     """
     BATTERY_LVL_UUID = '2a19'
+    cache_ttl = 1.0
 
     def __init__(self, bus, index, service):
         Characteristic.__init__(
@@ -392,33 +1101,45 @@ class BatteryLevelCharacteristic(Characteristic):
                 service)
         self.notifying = False
         self.battery_lvl = 100
-        GObject.timeout_add(5000, self.drain_battery)
+        timerwheel.get_default().add(5000, self.drain_battery)
+
+    @property
+    def battery_lvl(self):
+        fleet = self.service.fleet
+        if fleet is not None:
+            return fleet.battery_level(self.service.fleet_index)
+        return self._battery_lvl
+
+    @battery_lvl.setter
+    def battery_lvl(self, level):
+        self._battery_lvl = level
 
     def notify_battery_level(self):
         if not self.notifying:
             return
-        self.PropertiesChanged(
-                GATT_CHRC_IFACE,
-                { 'Value': [dbus.Byte(self.battery_lvl)] }, [])
+        self.notify_value(bytes([self.battery_lvl]))
 
     def drain_battery(self):
         if not self.notifying:
             return True
-        if self.battery_lvl > 0:
+        if self.service.fleet is None and self.battery_lvl > 0:
             self.battery_lvl -= 2
             if self.battery_lvl < 0:
                 self.battery_lvl = 0
-        print('Battery Level drained: ' + repr(self.battery_lvl))
+        log.debug('Battery Level drained: %r', self.battery_lvl)
         self.notify_battery_level()
         return True
 
+    def build_value(self):
+        return bytes([self.battery_lvl])
+
     def ReadValue(self, options):
-        print('Battery Level read: ' + repr(self.battery_lvl))
-        return [dbus.Byte(self.battery_lvl)]
+        log.debug('Battery Level read: %r', self.battery_lvl)
+        return self.read_value(options)
 
     def StartNotify(self):
         if self.notifying:
-            print('Already notifying, nothing to do')
+            log.info('Already notifying, nothing to do')
             return
 
         self.notifying = True
@@ -426,10 +1147,13 @@ class BatteryLevelCharacteristic(Characteristic):
 
     def StopNotify(self):
         if not self.notifying:
-            print('Not notifying, nothing to do')
+            log.info('Not notifying, nothing to do')
             return
 
         self.notifying = False
+        self.notifier.cancel()
+        log.info('Battery Level notifications: %r', self.notifier.stats())
+        log.info('Battery Level read cache: %r', self.cache_stats())
 
 
 class TestService(Service):
@@ -453,25 +1177,27 @@ class TestCharacteristic(Characteristic):
 
     """
     TEST_CHRC_UUID = '12345678-1234-5678-1234-56789abcdef1'
+    acquire_write = True
 
     def __init__(self, bus, index, service):
         Characteristic.__init__(
                 self, bus, index,
                 self.TEST_CHRC_UUID,
-                ['read', 'write', 'writable-auxiliaries'],
+                ['read', 'write', 'write-without-response',
+                 'writable-auxiliaries'],
                 service)
-        self.value = []
+        self.value = ValueBuffer()
         self.add_descriptor(TestDescriptor(bus, 0, self))
         self.add_descriptor(
                 CharacteristicUserDescriptionDescriptor(bus, 1, self))
 
     def ReadValue(self, options):
-        print('TestCharacteristic Read: ' + repr(self.value))
-        return self.value
+        log.debug('TestCharacteristic Read: %r', self.value)
+        return self.read_value(options)
 
     def WriteValue(self, value, options):
-        print('TestCharacteristic Write: ' + repr(value))
-        self.value = value
+        log.debug('TestCharacteristic Write: %r', value)
+        self.write_value(value, options)
 
 
 class TestDescriptor(Descriptor):
@@ -489,9 +1215,7 @@ class TestDescriptor(Descriptor):
                 characteristic)
 
     def ReadValue(self, options):
-        return [
-                dbus.Byte('T'), dbus.Byte('e'), dbus.Byte('s'), dbus.Byte('t')
-        ]
+        return b'Test'
 
 
 class CharacteristicUserDescriptionDescriptor(Descriptor):
@@ -503,8 +1227,7 @@ class CharacteristicUserDescriptionDescriptor(Descriptor):
 
     def __init__(self, bus, index, characteristic):
         self.writable = 'writable-auxiliaries' in characteristic.flags
-        self.value = array.array('B', b'This is a characteristic for testing')
-        self.value = self.value.tolist()
+        self.value = ValueBuffer(b'This is a characteristic for testing')
         Descriptor.__init__(
                 self, bus, index,
                 self.CUD_UUID,
@@ -512,12 +1235,12 @@ class CharacteristicUserDescriptionDescriptor(Descriptor):
                 characteristic)
 
     def ReadValue(self, options):
-        return self.value
+        return self.read_value(options)
 
     def WriteValue(self, value, options):
         if not self.writable:
             raise NotPermittedException()
-        self.value = value
+        self.write_value(value, options)
 
 class TestEncryptCharacteristic(Characteristic):
     """
@@ -532,18 +1255,18 @@ class TestEncryptCharacteristic(Characteristic):
                 self.TEST_CHRC_UUID,
                 ['encrypt-read', 'encrypt-write'],
                 service)
-        self.value = []
+        self.value = ValueBuffer()
         self.add_descriptor(TestEncryptDescriptor(bus, 2, self))
         self.add_descriptor(
                 CharacteristicUserDescriptionDescriptor(bus, 3, self))
 
     def ReadValue(self, options):
-        print('TestEncryptCharacteristic Read: ' + repr(self.value))
-        return self.value
+        log.debug('TestEncryptCharacteristic Read: %r', self.value)
+        return self.read_value(options)
 
     def WriteValue(self, value, options):
-        print('TestEncryptCharacteristic Write: ' + repr(value))
-        self.value = value
+        log.debug('TestEncryptCharacteristic Write: %r', value)
+        self.write_value(value, options)
 
 class TestEncryptDescriptor(Descriptor):
     """
@@ -560,9 +1283,7 @@ class TestEncryptDescriptor(Descriptor):
                 characteristic)
 
     def ReadValue(self, options):
-        return [
-                dbus.Byte('T'), dbus.Byte('e'), dbus.Byte('s'), dbus.Byte('t')
-        ]
+        return b'Test'
 
 
 class TestSecureCharacteristic(Characteristic):
@@ -578,18 +1299,18 @@ class TestSecureCharacteristic(Characteristic):
                 self.TEST_CHRC_UUID,
                 ['secure-read', 'secure-write'],
                 service)
-        self.value = []
+        self.value = ValueBuffer()
         self.add_descriptor(TestSecureDescriptor(bus, 2, self))
         self.add_descriptor(
                 CharacteristicUserDescriptionDescriptor(bus, 3, self))
 
     def ReadValue(self, options):
-        print('TestSecureCharacteristic Read: ' + repr(self.value))
-        return self.value
+        log.debug('TestSecureCharacteristic Read: %r', self.value)
+        return self.read_value(options)
 
     def WriteValue(self, value, options):
-        print('TestSecureCharacteristic Write: ' + repr(value))
-        self.value = value
+        log.debug('TestSecureCharacteristic Write: %r', value)
+        self.write_value(value, options)
 
 
 class TestSecureDescriptor(Descriptor):
@@ -607,58 +1328,297 @@ class TestSecureDescriptor(Descriptor):
                 characteristic)
 
     def ReadValue(self, options):
-        return [
-                dbus.Byte('T'), dbus.Byte('e'), dbus.Byte('s'), dbus.Byte('t')
-        ]
+        return b'Test'
+
+class SchemaCharacteristic(Characteristic):
+    """
+    Characteristic built from a schema entry by load_schema().
+
+    The value lives in a ValueBuffer. A 'read' handler, if named, builds
+    the value on reads and a 'write' handler is called with each committed
+    value.
+    """
+    def __init__(self, bus, index, service, spec, handlers):
+        self.notify_interval = spec.get('notify_interval', 0)
+        Characteristic.__init__(
+                self, bus, index,
+                spec['uuid'],
+                spec.get('flags', ['read']),
+                service)
+        self.value = ValueBuffer(schema_value(spec),
+                                 spec.get('max_length', 512))
+        self.read_handler = schema_handler(handlers, spec.get('read'))
+        self.write_handler = schema_handler(handlers, spec.get('write'))
+        self.notifying = False
+
+    def build_value(self):
+        if self.read_handler is not None:
+            return self.read_handler(self)
+        return self.value.read()
 
-def register_app_cb():
-    print('GATT application registered')
+    def value_written(self):
+        if self.write_handler is not None:
+            self.write_handler(self, self.value.read())
+        if self.notifying:
+            self.notify_value(self.value.read())
 
+    def ReadValue(self, options):
+        return self.read_value(options)
 
-def register_app_error_cb(error):
-    print('Failed to register application: ' + str(error))
-    mainloop.quit()
+    def WriteValue(self, value, options):
+        self.write_value(value, options)
 
+    def StartNotify(self):
+        self.notifying = True
 
-def find_adapter(bus):
-    remote_om = dbus.Interface(bus.get_object(BLUEZ_SERVICE_NAME, '/'),
-                               DBUS_OM_IFACE)
-    objects = remote_om.GetManagedObjects()
+    def StopNotify(self):
+        self.notifying = False
+        self.notifier.cancel()
+
+
+class SchemaDescriptor(Descriptor):
+    """
+    Descriptor built from a schema entry by load_schema().
+
+    """
+    def __init__(self, bus, index, characteristic, spec, handlers):
+        self.value = ValueBuffer(schema_value(spec),
+                                 spec.get('max_length', 512))
+        self.read_handler = schema_handler(handlers, spec.get('read'))
+        self.write_handler = schema_handler(handlers, spec.get('write'))
+        Descriptor.__init__(
+                self, bus, index,
+                spec['uuid'],
+                spec.get('flags', ['read']),
+                characteristic)
+
+    def build_value(self):
+        if self.read_handler is not None:
+            return self.read_handler(self)
+        return self.value.read()
+
+    def value_written(self):
+        if self.write_handler is not None:
+            self.write_handler(self, self.value.read())
+
+    def ReadValue(self, options):
+        return self.read_value(options)
+
+    def WriteValue(self, value, options):
+        self.write_value(value, options)
+
+
+def schema_value(spec):
+    if 'value_hex' in spec:
+        return bytes.fromhex(spec['value_hex'])
+    value = spec.get('value', b'')
+    if isinstance(value, str):
+        return value.encode('utf-8')
+    return bytes(value)
+
+
+def read_counter(attr):
+    """
+    Count the reads of attr, as a little-endian uint32.
+    """
+    attr.read_count = getattr(attr, 'read_count', 0) + 1
+    return attr.read_count.to_bytes(4, 'little')
+
+
+def read_uptime(attr):
+    """
+    Seconds since the server started, as a little-endian uint32.
+    """
+    return int(time.monotonic() - START_TIME).to_bytes(4, 'little')
 
-    for o, props in objects.items():
-        if GATT_MANAGER_IFACE in props.keys():
-            return o
 
-    return None
+def write_log(attr, value):
+    log.info('%s written: %r', attr.get_path(), value)
 
-def main():
+
+# Handlers a schema can name when the caller does not pass its own table.
+SCHEMA_HANDLERS = {
+        'counter': read_counter,
+        'uptime': read_uptime,
+        'log': write_log,
+}
+
+
+def schema_handler(handlers, name):
+    if name is None:
+        return None
+    if name not in handlers:
+        raise ValueError('Unknown schema handler: ' + name)
+    return handlers[name]
+
+
+def build_from_schema(app, schema, handlers=None):
+    """
+    Add the services described by a parsed schema to app.
+
+    Each service is assembled completely before it is added to app, so the
+    managed object cache is filled in a single pass per service.
+    """
+    if handlers is None:
+        handlers = SCHEMA_HANDLERS
+    for spec in schema.get('services', []):
+        service = Service(app.bus, app.next_index, spec['uuid'],
+                          spec.get('primary', True))
+        for i, chrc_spec in enumerate(spec.get('characteristics', [])):
+            chrc = SchemaCharacteristic(app.bus, i, service, chrc_spec,
+                                        handlers)
+            for j, desc_spec in enumerate(chrc_spec.get('descriptors', [])):
+                chrc.add_descriptor(SchemaDescriptor(app.bus, j, chrc,
+                                                     desc_spec, handlers))
+            service.add_characteristic(chrc)
+        app.add_service(service)
+
+
+def load_schema(app, path, handlers=None):
+    """
+    Add the services described in a JSON or TOML file to app.
+
+    Read and write handlers are looked up by name in handlers, or in
+    SCHEMA_HANDLERS if no table is given.
+    """
+    if path.endswith('.toml'):
+        if tomllib is None:
+            raise RuntimeError('TOML schemas need Python 3.11 or newer')
+        with open(path, 'rb') as f:
+            schema = tomllib.load(f)
+    else:
+        with open(path) as f:
+            schema = json.load(f)
+    build_from_schema(app, schema, handlers)
+
+
+class AppRegistrations(object):
+    """
+    Registers one GATT application on several adapters in parallel.
+
+    status maps every adapter path to 'pending', 'registered', 'removed'
+    or the error its RegisterApplication call failed with. The mainloop is
+    stopped once no adapter is pending and none succeeded.
+    """
+    follow_new = False
+
+    def __init__(self, bus, app):
+        self.bus = bus
+        self.app = app
+        self.status = {}
+
+    def register(self, adapter):
+        self.status[adapter] = 'pending'
+        service_manager = dbus.Interface(
+                self.bus.get_object(BLUEZ_SERVICE_NAME, adapter),
+                GATT_MANAGER_IFACE)
+        service_manager.RegisterApplication(
+                self.app.get_path(), {},
+                reply_handler=lambda: self._registered(adapter),
+                error_handler=lambda e: self._failed(adapter, e))
+
+    def registered(self):
+        return [a for a, s in self.status.items() if s == 'registered']
+
+    def adapter_changed(self, event, adapter, properties):
+        """
+        bluezcache listener. Registers again on adapters that come back,
+        as they all do when bluetoothd restarts, and on new adapters too
+        if follow_new is set.
+        """
+        if event == 'removed' and adapter in self.status:
+            self.status[adapter] = 'removed'
+            log.warning('Adapter %s removed', adapter)
+        elif event == 'added' and (self.follow_new or
+                                   self.status.get(adapter) == 'removed'):
+            self.register(adapter)
+
+    def _registered(self, adapter):
+        self.status[adapter] = 'registered'
+        log.info('GATT application registered on %s', adapter)
+
+    def _failed(self, adapter, error):
+        self.status[adapter] = str(error)
+        log.error('Failed to register application on %s: %s', adapter, error)
+        if 'pending' not in self.status.values() and not self.registered():
+            mainloop.quit()
+
+
+def find_adapters(bus):
+    return bluezcache.get_cache(bus).paths(GATT_MANAGER_IFACE)
+
+
+def find_adapter(bus):
+    adapters = find_adapters(bus)
+    if not adapters:
+        return None
+    return adapters[0]
+
+def main(schema=None, log_level='INFO', all_adapters=False,
+         metrics_file=None, fleet_size=0):
     global mainloop
 
+    ringlog.setup(log_level)
+
     dbus.mainloop.glib.DBusGMainLoop(set_as_default=True)
 
+    if metrics_file is not None:
+        metrics.start_prometheus_file(metrics_file)
+    profiling.install_signal_handler()
+
     bus = dbus.SystemBus()
     bus.request_name("com.github.maldata.testservice1")
 
-    adapter = find_adapter(bus)
-    if not adapter:
-        print('GattManager1 interface not found')
+    adapters = find_adapters(bus)
+    if not adapters:
+        log.error('GattManager1 interface not found')
         return
-
-    service_manager = dbus.Interface(
-            bus.get_object(BLUEZ_SERVICE_NAME, adapter),
-            GATT_MANAGER_IFACE)
-
-    app = Application(bus)
+    if not all_adapters:
+        adapters = adapters[:1]
+
+    if schema is None:
+        fleet = None
+        if fleet_size:
+            fleet = fleetsim.WearableFleet(fleet_size)
+            fleet.start()
+        app = Application(bus, fleet=fleet)
+    else:
+        app = Application(bus, populate=False)
+        load_schema(app, schema)
 
     mainloop = GObject.MainLoop()
 
-    print('Registering GATT application...')
+    log.info('Registering GATT application on %d adapter(s)...',
+             len(adapters))
 
-    service_manager.RegisterApplication(app.get_path(), {},
-                                    reply_handler=register_app_cb,
-                                    error_handler=register_app_error_cb)
+    registrations = AppRegistrations(bus, app)
+    registrations.follow_new = all_adapters
+    for adapter in adapters:
+        registrations.register(adapter)
+    bluezcache.get_cache(bus).watch(GATT_MANAGER_IFACE,
+                                    registrations.adapter_changed)
 
     mainloop.run()
 
 if __name__ == '__main__':
-    main()
+    parser = argparse.ArgumentParser()
+    trees = parser.add_mutually_exclusive_group()
+    trees.add_argument('--schema', help="build the GATT services from " +
+                       "this JSON or TOML file instead of the built-in " +
+                       "examples")
+    trees.add_argument('--fleet', default=0, type=int, metavar='N',
+                       help="serve Heart Rate and Battery services for N " +
+                       "simulated wearables (needs NumPy)")
+    parser.add_argument('--log-level', default='INFO',
+                        choices=['DEBUG', 'INFO', 'WARNING', 'ERROR'],
+                        help="(default: INFO)")
+    parser.add_argument('--all-adapters', action='store_true',
+                        help="register on every adapter instead of the " +
+                        "first one found")
+    parser.add_argument('--metrics-file', help="write method and " +
+                        "notification metrics to this file in Prometheus " +
+                        "text format every 10 seconds")
+    args = parser.parse_args()
+
+    main(args.schema, args.log_level, args.all_adapters, args.metrics_file,
+         args.fleet)
@@ -0,0 +1,119 @@
+# SPDX-License-Identifier: LGPL-2.1-or-later
+"""
+One GLib timeout for many periodic callbacks.
+
+Every simulated characteristic used to own a GObject.timeout_add source,
+so thousands of simulated sensors meant thousands of sources and as many
+uncoordinated wakeups. TimerWheel keeps the timers in a hashed wheel of
+slots and runs a single timeout at its tick resolution; all callbacks due
+in the same tick run in one wakeup. The timeout is only installed while
+timers are registered.
+
+Callbacks follow GLib conventions: return True to run again after the
+same interval, anything else to stop.
+"""
+
+import time
+
+try:
+    from gi.repository import GObject
+except ImportError:
+    import gobject as GObject
+
+
+class Timer(object):
+    __slots__ = ('ticks', 'expiry', 'callback', 'args', 'cancelled')
+
+    def __init__(self, ticks, callback, args):
+        self.ticks = ticks
+        self.expiry = 0
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+
+
+class TimerWheel(object):
+    def __init__(self, tick_ms=100, slots=512):
+        self.tick_ms = tick_ms
+        self.slots = [[] for _ in range(slots)]
+        self.current = 0
+        self.count = 0
+        self.wakeups = 0
+        self.callbacks = 0
+        self._start = 0.0
+        self._source_id = None
+
+    def add(self, interval_ms, callback, *args):
+        """
+        Call callback(*args) every interval_ms, rounded to whole ticks, and
+        return a Timer that can be passed to remove().
+        """
+        ticks = max(1, int(round(interval_ms / float(self.tick_ms))))
+        timer = Timer(ticks, callback, args)
+        if self._source_id is None:
+            self._start = time.monotonic()
+            self.current = 0
+            self._source_id = GObject.timeout_add(self.tick_ms, self._tick)
+        self._schedule(timer)
+        self.count += 1
+        return timer
+
+    def remove(self, timer):
+        # The entry is dropped lazily when its slot comes round.
+        if not timer.cancelled:
+            timer.cancelled = True
+            self.count -= 1
+
+    def _schedule(self, timer):
+        timer.expiry = self.current + timer.ticks
+        self.slots[timer.expiry % len(self.slots)].append(timer)
+
+    def _tick(self):
+        self.wakeups += 1
+        # Catch up on ticks missed while the mainloop was busy.
+        now = int((time.monotonic() - self._start) * 1000 / self.tick_ms)
+        while self.current < now:
+            self.current += 1
+            self._run_slot(self.slots[self.current % len(self.slots)])
+
+        if self.count == 0:
+            self._source_id = None
+            return False
+        return True
+
+    def _run_slot(self, slot):
+        if not slot:
+            return
+        keep = []
+        due = []
+        for timer in slot:
+            if timer.cancelled:
+                continue
+            if timer.expiry <= self.current:
+                due.append(timer)
+            else:
+                keep.append(timer)
+        slot[:] = keep
+
+        for timer in due:
+            if timer.cancelled:
+                continue
+            self.callbacks += 1
+            if timer.callback(*timer.args):
+                self._schedule(timer)
+            else:
+                timer.cancelled = True
+                self.count -= 1
+
+
+_default = None
+
+
+def get_default():
+    """
+    Return the wheel shared by everything in the process.
+    """
+    global _default
+    if _default is None:
+        _default = TimerWheel()
+    return _default